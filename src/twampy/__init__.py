@@ -9,6 +9,16 @@ as defined in RFC 5357, Simple Two-Way Active Measurement Protocol (STAMP) as
 defined in RFC 8762, and STAMP Optional Extensions as defined in RFC 8972.
 
 Developed for validation of Nokia SR OS and SR Linux TWAMP/STAMP implementations.
+
+Library usage::
+
+    import twampy
+
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:20001"))
+    result = twampy.run_sender(twampy.SenderConfig(far_end="127.0.0.1:20001", count=10, interval=10))
+    print(result.roundtrip.avg, result.roundtrip.loss)
+    reflector.stop()
+    reflector.join()
 """
 
 from importlib.metadata import PackageNotFoundError, version
@@ -23,4 +33,31 @@ __author__ = "Sven Wisotzky"
 __license__ = "BSD-3-Clause"
 __copyright__ = "Copyright (c) 2013-2026 Nokia"
 
-__all__ = []
+__all__ = [
+    "ClassProfile",
+    "DirectionResult",
+    "ReflectorConfig",
+    "ReflectorProtocol",
+    "SenderConfig",
+    "SenderProtocol",
+    "SessionResult",
+    "SizeProfile",
+    "TwampStatistics",
+    "TwampySessionReflector",
+    "TwampySessionSender",
+    "run_sender",
+    "run_sender_async",
+    "start_reflector",
+    "start_reflector_async",
+    "start_sender_async",
+]
+
+
+def __getattr__(name):
+    # Load the session module on first use only, so "import twampy" stays cheap
+    # and never loads the CLI [PEP 562]
+    if name in __all__:
+        from twampy import session
+
+        return getattr(session, name)
+    raise AttributeError(f"module 'twampy' has no attribute {name!r}")
@@ -47,371 +47,89 @@ See LICENSE file for details
 """
 
 import argparse
+import asyncio
 import binascii
+import collections
+import contextlib
+import dataclasses
+import datetime
+import errno
+import gzip
+import heapq
+import json
 import logging
+import math
+import multiprocessing
 import os
+import platform
+import queue
 import random
 import select
+import selectors
 import signal
 import socket
+import sqlite3
+import statistics
 import struct
+import subprocess
 import sys
 import threading
 import time
+import timeit
+import tomllib
+import zlib
 
 from twampy import __version__
+from twampy.session import (
+    ALLBITS,
+    BURST_MODES,
+    PACKET_FIELDS,
+    REPLY_ECHO,
+    REQUEST_MIN,
+    SUMMARY_FIELDS,
+    TIMEOFFSET,
+    Admission,
+    BurstSender,
+    ClassProfile,
+    CsvSink,
+    Histogram,
+    LowLatency,
+    NdjsonSink,
+    PacketArchive,
+    ReflectorConfig,
+    ReflectorProtocol,
+    SenderConfig,
+    SendTimes,
+    SizeProfile,
+    SlaRule,
+    TwampStatistics,
+    TwampySessionReflector,
+    TwampySessionSender,
+    UdpSession,
+    decode_reply,
+    decode_request,
+    dp,
+    drain_timeout,
+    dscp_tos,
+    dump_rejected,
+    encode_reply,
+    encode_request,
+    flatten_result,
+    libc_sendmmsg,
+    log,
+    now,
+    parse_addr,
+    parse_cpus,
+    profiled,
+    reply_delays,
+    result_writer,
+    start_sender_async,
+    udp_socket,
+    zeros,
+)
 
 #############################################################################
 
-if sys.platform == "win32":
-    time0 = time.time() - time.perf_counter()
-
-# Constants to convert between python timestamps and NTP 8B binary format [RFC1305]
-TIMEOFFSET = 2208988800  # Time Difference: 1-JAN-1900 to 1-JAN-1970
-ALLBITS = 0xFFFFFFFF  # To calculate 32bit fraction of the second
-
-# Module-level logger - configured in main()
-log = logging.getLogger("twampy")
-
-
-def now():
-    if sys.platform == "win32":
-        return time.perf_counter() + time0
-    return time.time()
-
-
-def time_ntp2py(data):
-    """
-    Convert NTP 8 byte binary format [RFC1305] to python timestamp
-    """
-
-    ta, tb = struct.unpack("!2I", data)
-    t = ta - TIMEOFFSET + float(tb) / float(ALLBITS)
-    return t
-
-
-def zeros(nbr):
-    return struct.pack(f"!{nbr}B", *[0 for x in range(nbr)])
-
-
-def dp(ms):
-    if abs(ms) > 60000:
-        return f"{float(ms / 60000):7.1f}min"
-    if abs(ms) > 10000:
-        return f"{float(ms / 1000):7.1f}sec"
-    if abs(ms) > 1000:
-        return f"{float(ms / 1000):7.2f}sec"
-    if abs(ms) > 1:
-        return f"{ms:8.2f}ms"
-    return f"{int(ms * 1000):8d}us"
-
-
-def parse_addr(addr, default_port=20000):
-    if addr == "":
-        # no address given (default: localhost IPv4 or IPv6)
-        return "", default_port, 0
-    elif "]:" in addr:
-        # IPv6 address with port
-        ip, port = addr.rsplit(":", 1)
-        return ip.strip("[]"), int(port), 6
-    elif "]" in addr:
-        # IPv6 address without port
-        return addr.strip("[]"), default_port, 6
-    elif addr.count(":") > 1:
-        # IPv6 address without port
-        return addr, default_port, 6
-    elif ":" in addr:
-        # IPv4 address with port
-        ip, port = addr.split(":")
-        return ip, int(port), 4
-    else:
-        # IPv4 address without port
-        return addr, default_port, 4
-
-
-#############################################################################
-
-
-class UdpSession(threading.Thread):
-    def __init__(self, addr="", port=20000, tos=0, ttl=64, do_not_fragment=False, ipversion=4):
-        threading.Thread.__init__(self)
-        if ipversion == 6:
-            self.bind6(addr, port, tos, ttl)
-        else:
-            self.bind(addr, port, tos, ttl, do_not_fragment)
-        self.running = True
-
-    def bind(self, addr, port, tos, ttl, df):
-        log.debug("bind(addr=%s, port=%d, tos=%d, ttl=%d)", addr, port, tos, ttl)
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((addr, port))
-        # Set TTL and TOS after binding (required for Windows compatibility)
-        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, tos)
-        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
-        if df:
-            if sys.platform == "linux":
-                self.socket.setsockopt(socket.SOL_IP, 10, 2)
-            elif sys.platform == "win32":
-                # Windows: SOL_IP+14 (IP_DONTFRAGMENT) can raise WSAEINVAL (10022).
-                # Use IPPROTO_IP + IPV6_DONTFRAG; it works for IPv4 UDP on Windows.
-                opt = getattr(socket, "IPV6_DONTFRAG", 14)
-                self.socket.setsockopt(socket.IPPROTO_IP, opt, 1)
-            elif sys.platform == "darwin":
-                log.error("do-not-fragment can not be set on darwin")
-            else:
-                log.error("unsupported OS, ignore do-not-fragment option")
-        else:
-            if sys.platform == "linux":
-                self.socket.setsockopt(socket.SOL_IP, 10, 0)
-
-    def bind6(self, addr, port, tos, ttl):
-        log.debug("bind6(addr=%s, port=%d, tos=%d, ttl=%d)", addr, port, tos, ttl)
-        self.socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_TCLASS, tos)
-        self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((addr, port))
-        log.info("Wait to receive test packets on [%s]:%d", addr, port)
-
-    def sendto(self, data, address):
-        log.debug("transmit: %s", binascii.hexlify(data))
-        self.socket.sendto(data, address)
-
-    def recvfrom(self):
-        data, address = self.socket.recvfrom(9216)
-        log.debug("received: %s", binascii.hexlify(data))
-        return data, address
-
-    def stop(self, signum, frame):
-        log.info("SIGINT received: Stop TWL session reflector")
-        self.running = False
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
-
-
-class TwampStatistics:
-    def __init__(self):
-        self.count = 0
-
-    def add(self, delayRT, delayOB, delayIB, rseq, sseq):
-        if self.count == 0:
-            self.minOB = delayOB
-            self.minIB = delayIB
-            self.minRT = delayRT
-
-            self.maxOB = delayOB
-            self.maxIB = delayIB
-            self.maxRT = delayRT
-
-            self.sumOB = delayOB
-            self.sumIB = delayIB
-            self.sumRT = delayRT
-
-            self.lossIB = rseq
-            self.lossOB = sseq - rseq
-
-            self.jitterOB = 0
-            self.jitterIB = 0
-            self.jitterRT = 0
-
-            self.lastOB = delayOB
-            self.lastIB = delayIB
-            self.lastRT = delayRT
-        else:
-            self.minOB = min(self.minOB, delayOB)
-            self.minIB = min(self.minIB, delayIB)
-            self.minRT = min(self.minRT, delayRT)
-
-            self.maxOB = max(self.maxOB, delayOB)
-            self.maxIB = max(self.maxIB, delayIB)
-            self.maxRT = max(self.maxRT, delayRT)
-
-            self.sumOB += delayOB
-            self.sumIB += delayIB
-            self.sumRT += delayRT
-
-            self.lossIB = rseq - self.count
-            self.lossOB = sseq - rseq
-
-            if self.count == 1:
-                self.jitterOB = abs(self.lastOB - delayOB)
-                self.jitterIB = abs(self.lastIB - delayIB)
-                self.jitterRT = abs(self.lastRT - delayRT)
-            else:
-                self.jitterOB = self.jitterOB + (abs(self.lastOB - delayOB) - self.jitterOB) / 16
-                self.jitterIB = self.jitterIB + (abs(self.lastIB - delayIB) - self.jitterIB) / 16
-                self.jitterRT = self.jitterRT + (abs(self.lastRT - delayRT) - self.jitterRT) / 16
-
-            self.lastOB = delayOB
-            self.lastIB = delayIB
-            self.lastRT = delayRT
-
-        self.count += 1
-
-    def dump(self, total):
-        print("===============================================================================")
-        print("Direction         Min         Max         Avg          Jitter     Loss")
-        print("-------------------------------------------------------------------------------")
-        if self.count > 0:
-            self.lossRT = total - self.count
-            print(
-                f"  Outbound:    {dp(self.minOB)}  {dp(self.maxOB)}  {dp(self.sumOB / self.count)}  {dp(self.jitterOB)}    {100 * float(self.lossOB) / total:5.1f}%"
-            )
-            print(
-                f"  Inbound:     {dp(self.minIB)}  {dp(self.maxIB)}  {dp(self.sumIB / self.count)}  {dp(self.jitterIB)}    {100 * float(self.lossIB) / total:5.1f}%"
-            )
-            print(
-                f"  Roundtrip:   {dp(self.minRT)}  {dp(self.maxRT)}  {dp(self.sumRT / self.count)}  {dp(self.jitterRT)}    {100 * float(self.lossRT) / total:5.1f}%"
-            )
-        else:
-            print("  NO STATS AVAILABLE (100% loss)")
-        print("-------------------------------------------------------------------------------")
-        print("                                                    Jitter Algorithm [RFC1889]")
-        print("===============================================================================")
-        sys.stdout.flush()
-
-
-#############################################################################
-
-
-class TwampySessionSender(UdpSession):
-    def __init__(self, args):
-        # Session Sender / Session Reflector:
-        #   get Address, UDP port, IP version from near_end/far_end attributes
-        sip, spt, sipv = parse_addr(args.near_end, 20000)
-        rip, rpt, ripv = parse_addr(args.far_end, 20001)
-
-        ipversion = 6 if (sipv == 6) or (ripv == 6) else 4
-        UdpSession.__init__(self, sip, spt, args.tos, args.ttl, args.do_not_fragment, ipversion)
-
-        self.remote_addr = rip
-        self.remote_port = rpt
-        self.interval = float(args.interval) / 1000
-        self.count = args.count
-        self.stats = TwampStatistics()
-
-        if args.padding != -1:
-            self.padmix = [args.padding]
-        elif ipversion == 6:
-            self.padmix = [0, 0, 0, 0, 0, 0, 0, 514, 514, 514, 514, 1438]
-        else:
-            self.padmix = [8, 8, 8, 8, 8, 8, 8, 534, 534, 534, 534, 1458]
-
-    def run(self):
-        schedule = now()
-        endtime = schedule + self.count * self.interval + 5
-
-        idx = 0
-        while self.running:
-            while select.select([self.socket], [], [], 0)[0]:
-                t4 = now()
-                data, address = self.recvfrom()
-
-                if len(data) < 36:
-                    log.error("short packet received: %d bytes", len(data))
-                    continue
-
-                t3 = time_ntp2py(data[4:12])
-                t2 = time_ntp2py(data[16:24])
-                t1 = time_ntp2py(data[28:36])
-
-                delayRT = max(0, 1000 * (t4 - t1 + t2 - t3))  # round-trip delay
-                delayOB = max(0, 1000 * (t2 - t1))  # out-bound delay
-                delayIB = max(0, 1000 * (t4 - t3))  # in-bound delay
-
-                rseq = struct.unpack("!I", data[0:4])[0]
-                sseq = struct.unpack("!I", data[24:28])[0]
-
-                log.info(
-                    "Reply from %s [rseq=%d sseq=%d rtt=%.2fms outbound=%.2fms inbound=%.2fms]",
-                    address[0],
-                    rseq,
-                    sseq,
-                    delayRT,
-                    delayOB,
-                    delayIB,
-                )
-                self.stats.add(delayRT, delayOB, delayIB, rseq, sseq)
-
-                if sseq + 1 == self.count:
-                    log.info("All packets received back")
-                    self.running = False
-
-            t1 = now()
-            if (t1 >= schedule) and (idx < self.count):
-                schedule = schedule + self.interval
-
-                data = struct.pack("!L2IH", idx, int(TIMEOFFSET + t1), int((t1 - int(t1)) * ALLBITS), 0x3FFF)
-                pbytes = zeros(self.padmix[int(len(self.padmix) * random.random())])
-
-                self.sendto(data + pbytes, (self.remote_addr, self.remote_port))
-                log.info("Sent to %s [sseq=%d]", self.remote_addr, idx)
-
-                idx = idx + 1
-                if schedule > t1:
-                    r, w, e = select.select([self.socket], [], [], schedule - t1)
-
-            if t1 > endtime:
-                log.info("Receive timeout for last packet (don't wait anymore)")
-                self.running = False
-
-        self.stats.dump(idx)
-
-
-class TwampySessionReflector(UdpSession):
-    def __init__(self, args):
-        addr, port, ipversion = parse_addr(args.near_end, 20001)
-
-        if args.padding != -1:
-            self.padmix = [args.padding]
-        elif ipversion == 6:
-            self.padmix = [0, 0, 0, 0, 0, 0, 0, 514, 514, 514, 514, 1438]
-        else:
-            self.padmix = [8, 8, 8, 8, 8, 8, 8, 534, 534, 534, 534, 1458]
-
-        UdpSession.__init__(self, addr, port, args.tos, args.ttl, args.do_not_fragment, ipversion)
-
-    def run(self):
-        index = {}
-        reset = {}
-
-        while self.running:
-            try:
-                data, address = self.recvfrom()
-
-                t2 = now()
-                sec = int(TIMEOFFSET + t2)  # seconds since 1-JAN-1900
-                msec = int((t2 - int(t2)) * ALLBITS)  # 32bit fraction of the second
-
-                sseq = struct.unpack("!I", data[0:4])[0]
-                t1 = time_ntp2py(data[4:12])
-
-                log.info("Request from %s:%d [sseq=%d outbound=%.2fms]", address[0], address[1], sseq, 1000 * (t2 - t1))
-
-                idx = 0
-                if address not in index:
-                    log.info("set rseq:=0     (new remote address/port)")
-                elif reset[address] < t2:
-                    log.info("reset rseq:=0   (session timeout, 30sec)")
-                elif sseq == 0:
-                    log.info("reset rseq:=0   (received sseq==0)")
-                else:
-                    idx = index[address]
-
-                rdata = struct.pack("!L2I2H2I", idx, sec, msec, 0x001, 0, sec, msec)
-                pbytes = zeros(self.padmix[int(len(self.padmix) * random.random())])
-                self.sendto(rdata + data[0:14] + pbytes, address)
-
-                index[address] = idx + 1
-                reset[address] = t2 + 30  # timeout is 30sec
-
-            except Exception as e:
-                log.debug("Exception: %s", str(e))
-                break
-
-        log.info("TWL session reflector stopped")
-
 
 class TwampyControlClient:
     def __init__(self, server="", tcp_port=862, tos=0x88, ipversion=4):
@@ -633,29 +351,78 @@ class TwampyControlClient:
 
 #############################################################################
 
+# join() and wait() without a timeout block Ctrl-C on Windows: wait in steps
+WAIT_STEP = 0.5
+
+
+def join_thread(thread, timeout=None):
+    """
+    Wait until the thread ended, at most 'timeout' seconds; returns at once when it ends
+    """
+
+    deadline = math.inf if timeout is None else now() + timeout
+    while thread.is_alive() and now() < deadline:
+        thread.join(min(WAIT_STEP, deadline - now()))
+
 
 def twl_responder(args):
     reflector = TwampySessionReflector(args)
+    if args.profile:
+        reflector.run = profiled(reflector.run, args.profile)
     reflector.daemon = True
     reflector.name = "twl_responder"
     reflector.start()
 
     signal.signal(signal.SIGINT, reflector.stop)
+    join_thread(reflector)
+
+    if reflector.received_tos:
+        reflector.dump_tos()
+    if reflector.admission:
+        reflector.admission.dump()
+    dump_rejected("requests", reflector.malformed, reflector.errors)
+    if reflector.timers:
+        reflector.timers.dump()
+    if reflector.tuning:
+        reflector.tuning.dump()
+
+
+def sinks_on_stdout(args):
+    return any(
+        (getattr(args, kind, None) or "").endswith(":-") for kind in ("packets", "intervals", "summary", "events")
+    )
+
 
-    while reflector.is_alive():
-        time.sleep(0.1)
+def report(sender, writer, started):
+    if writer:
+        writer.summary(sender.result(), started=started, ended=now(), **sender.metadata())
+        writer.close()
+    # keep stdout clean for NDJSON/CSV written to a pipe
+    with contextlib.redirect_stdout(sys.stderr if sinks_on_stdout(sender.args) else sys.stdout):
+        sender.dump()
+    if writer and writer.sla and writer.sla.breaches and getattr(sender.args, "sla_exit", False):
+        sys.exit(3)
 
 
 def twl_sender(args):
+    # --sla-exit: the first breach ends the session (the closure sees the sender created below)
+    args.on_breach = (lambda: sender.stop()) if args.sla_exit else None
+    args.writer = result_writer(args)
     sender = TwampySessionSender(args)
+    if args.profile:
+        sender.run = profiled(sender.run, args.profile)
     sender.daemon = True
     sender.name = "twl_responder"
+    started = now()
+    if args.writer:
+        args.writer.start()
+        args.writer.session(started=started, **sender.metadata())
     sender.start()
 
     signal.signal(signal.SIGINT, sender.stop)
+    join_thread(sender)
 
-    while sender.is_alive():
-        time.sleep(0.1)
+    report(sender, args.writer, started)
 
 
 def twamp_controller(args):
@@ -670,17 +437,24 @@ def twamp_controller(args):
     if client.reqSession(s_port=spt, r_port=rpt):
         client.startSessions()
 
+        args.on_breach = (lambda: sender.stop()) if args.sla_exit else None
+        args.writer = result_writer(args)
         sender = TwampySessionSender(args)
+        if args.profile:
+            sender.run = profiled(sender.run, args.profile)
         sender.daemon = True
         sender.name = "twl_responder"
+        started = now()
+        if args.writer:
+            args.writer.start()
+            args.writer.session(started=started, **sender.metadata())
         sender.start()
         signal.signal(signal.SIGINT, sender.stop)
+        join_thread(sender)
 
-        while sender.is_alive():
-            time.sleep(0.1)
-        time.sleep(5)
-
+        # the sender already waited for late replies (drain timeout)
         client.stopSessions()
+        report(sender, args.writer, started)
 
 
 def twamp_ctclient(args):
@@ -696,80 +470,2349 @@ def twamp_ctclient(args):
     if client.reqSession(sender=sip, s_port=spt, receiver="0.0.0.0", r_port=rpt):
         client.startSessions()
 
-        while True:
-            time.sleep(0.1)
+        # sessions run between the remote sender and reflector until Ctrl-C or --duration
+        stopped = threading.Event()
+        signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+        deadline = now() + args.duration if args.duration else math.inf
+        while not stopped.is_set() and now() < deadline:
+            stopped.wait(min(WAIT_STEP, deadline - now()))
 
         client.stopSessions()
 
 
 #############################################################################
+# Benchmark suite (loopback only)
+#
+#   Results are written as JSON and compared against a stored baseline:
+#     {"results": {"<metric>": {"value": .., "unit": .., "better": "lower"|"higher"}}}
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+@contextlib.contextmanager
+def _loopback_reflector():
+    """
+    Start a quiet responder subprocess on loopback, yield (port, process) once it reflects
+    """
+
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "twampy", "responder", f"127.0.0.1:{port}", "--quiet"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(("127.0.0.1", 0))
+            deadline = now() + 10
+            while True:
+                probe.sendto(encode_request(0, now()), ("127.0.0.1", port))
+                if select.select([probe], [], [], 0.2)[0]:
+                    probe.recv(9216)
+                    break
+                if now() > deadline or proc.poll() is not None:
+                    raise RuntimeError("loopback reflector did not start")
+        yield port, proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def bench_codec(quick: bool) -> dict:
+    number = 20000 if quick else 200000
+    t1 = now()
+    padding = SizeProfile.fixed(8).buffers[0]
+    request = encode_request(1, t1, padding)
+    reply = encode_reply(1, t1, request, padding)
+    cases = {
+        "codec.encode_request": lambda: encode_request(1, t1, padding),
+        "codec.decode_request": lambda: decode_request(request),
+        "codec.encode_reply": lambda: encode_reply(1, t1, request, padding),
+        "codec.decode_reply": lambda: decode_reply(reply),
+    }
+    results = {}
+    for name, func in cases.items():
+        best = min(timeit.Timer(func).repeat(repeat=5, number=number)) / number
+        results[name] = {"value": round(best * 1e9, 1), "unit": "ns/op", "better": "lower"}
+    return results
+
+
+def bench_stats(quick: bool) -> dict:
+    number = 100000 if quick else 1000000
+    rng = random.Random(1)
+    samples = [(rng.uniform(0.1, 2), rng.uniform(0.05, 1), rng.uniform(0.05, 1)) for _ in range(1024)]
+    best = None
+    for _ in range(5):
+        stats = TwampStatistics()
+        t0 = time.perf_counter()
+        for idx in range(number):
+            delayRT, delayOB, delayIB = samples[idx & 1023]
+            stats.add(delayRT, delayOB, delayIB, idx, idx)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return {"stats.add": {"value": round(number / best), "unit": "ops/s", "better": "higher"}}
+
+
+def _bench_blast(port: int, rate: float, duration: float) -> tuple[int, int, float]:
+    """
+    Offer requests at a fixed rate to a reflector, return sent, received, achieved rate
+    """
+
+    count = max(1, int(rate * duration))
+    gap = 1.0 / rate
+    request = encode_request(0, now(), zeros(8))
+    address = ("127.0.0.1", port)
+    sent = received = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        start = time.perf_counter()
+        while sent < count:
+            if time.perf_counter() >= start + sent * gap:
+                try:
+                    sock.sendto(request, address)
+                    sent += 1
+                except (BlockingIOError, InterruptedError):
+                    pass
+            try:
+                while True:
+                    sock.recv(9216)
+                    received += 1
+            except (BlockingIOError, InterruptedError):
+                pass
+        achieved = sent / max(time.perf_counter() - start, 1e-9)
+        while select.select([sock], [], [], 0.2)[0]:
+            try:
+                while True:
+                    sock.recv(9216)
+                    received += 1
+            except (BlockingIOError, InterruptedError):
+                pass
+    return sent, received, achieved
+
+
+def bench_reflector(port: int, quick: bool, loss: float) -> dict:
+    duration = 0.25 if quick else 1.0
+    best = 0.0
+    lo, hi = 0.0, None
+    rate = 1000.0
+    while hi is None:
+        sent, received, achieved = _bench_blast(port, rate, duration)
+        if 100 * (sent - received) / sent > loss or achieved < 0.9 * rate:
+            hi = rate
+        else:
+            lo, best = rate, achieved
+            rate *= 2
+    for _ in range(3 if quick else 6):
+        rate = (lo + hi) / 2
+        sent, received, achieved = _bench_blast(port, rate, duration)
+        if 100 * (sent - received) / sent > loss or achieved < 0.9 * rate:
+            hi = rate
+        else:
+            lo, best = rate, achieved
+    return {"reflector.max_pps": {"value": round(best), "unit": "pps", "better": "higher", "loss_pct": loss}}
+
+
+def bench_pacing(port: int, quick: bool) -> dict:
+    results = {}
+    for interval, count in ((1, 500), (10, 200), (100, 20)):
+        if quick:
+            count = max(5, count // 5)
+        config = SenderConfig(
+            far_end=f"127.0.0.1:{port}", near_end="127.0.0.1:0", tos=0, interval=interval, count=count
+        )
+        sender = TwampySessionSender(config)
+        stamps = []
+        transmit = sender.sendto
+
+        def sendto(data, address, sock=None, transmit=transmit, stamps=stamps):
+            stamps.append(decode_request(data)[1])
+            transmit(data, address, sock)
+
+        sender.sendto = sendto
+        sender.run()
+        sender.socket.close()
+
+        errors = [abs(t - (stamps[0] + i * interval / 1000)) * 1e6 for i, t in enumerate(stamps)]
+        results[f"sender.pacing.{interval}ms.mean_us"] = {
+            "value": round(sum(errors) / len(errors), 1),
+            "unit": "us",
+            "better": "lower",
+            "tolerance": 100,
+        }
+        results[f"sender.pacing.{interval}ms.p99_us"] = {
+            "value": round(_percentile(errors, 99), 1),
+            "unit": "us",
+            "better": "lower",
+            "tolerance": 100,
+        }
+    return results
+
+
+SO_TIMESTAMPNS = 35  # Linux, not exported by the socket module
+TIMESPEC = struct.Struct("@qq")
+
+
+def _burst_skew(mode: str, profile: SizeProfile, bursts: int) -> float | None:
+    """
+    Median spread of (kernel receive time - T1) within a burst of 32 on loopback, in
+    microseconds: how far the T1 of a request is off compared to the others of its
+    burst. None if the mode is not available or receive timestamps are not.
+    """
+
+    with (
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink,
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock,
+    ):
+        sink.bind(("127.0.0.1", 0))
+        sink.settimeout(1)
+        try:
+            sink.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        except OSError:
+            return None
+        burst = BurstSender(sock, sink.getsockname(), 32, profile, mode)
+        skews = []
+        for first in range(0, bursts * burst.size, burst.size):
+            stamps = burst.send(first, burst.size)
+            if burst.mode != mode:
+                return None  # GSO not supported here
+            offsets = []
+            for _ in range(burst.size):
+                data, ancdata, _, _ = sink.recvmsg(64, socket.CMSG_SPACE(TIMESPEC.size))
+                for level, kind, value in ancdata:
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = TIMESPEC.unpack(value[: TIMESPEC.size])
+                        offsets.append(sec + nsec / 1e9 - stamps[decode_request(data)[0] - first])
+            if len(offsets) == burst.size:
+                skews.append(max(offsets) - min(offsets))
+    return round(1e6 * statistics.median(skews), 1) if skews else None
+
+
+def bench_burst(quick: bool) -> dict:
+    """
+    Requests per second from one socket on loopback: one sendto() per request vs.
+    the --burst modes with 32 requests per call (to a bound socket that is never read),
+    and the T1 spread within a burst per mode (Linux)
+    """
+
+    count = 20000 if quick else 200000
+    profile = SizeProfile.fixed(0)
+    padding = profile.buffers[0]
+    results = {}
+    with (
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink,
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock,
+    ):
+        sink.bind(("127.0.0.1", 0))
+        address = sink.getsockname()
+
+        start = time.perf_counter()
+        for idx in range(count):
+            sock.sendto(encode_request(idx, now(), padding), address)
+        elapsed = time.perf_counter() - start
+        results["burst.single.pps"] = {"value": round(count / elapsed), "unit": "pps", "better": "higher"}
+
+        for mode in BURST_MODES:
+            if (mode == "gso" and not BurstSender.gso_capable(profile)) or (mode == "sendmmsg" and not libc_sendmmsg()):
+                continue
+            burst = BurstSender(sock, address, 32, profile, mode)
+            burst.send(0, burst.size)
+            if burst.mode != mode:
+                continue  # GSO not supported here
+            bursts = range(0, count, burst.size)
+            start = time.perf_counter()
+            for idx in bursts:
+                burst.send(idx, burst.size)
+            elapsed = time.perf_counter() - start
+            results[f"burst.{mode}.pps"] = {
+                "value": round(len(bursts) * burst.size / elapsed),
+                "unit": "pps",
+                "better": "higher",
+            }
+
+    if sys.platform == "linux":
+        for mode in BURST_MODES:
+            if (mode == "gso" and not BurstSender.gso_capable(profile)) or (mode == "sendmmsg" and not libc_sendmmsg()):
+                continue
+            skew = _burst_skew(mode, profile, 20 if quick else 200)
+            if skew is not None:
+                results[f"burst.{mode}.skew"] = {"value": skew, "unit": "usec", "better": "lower"}
+    return results
+
+
+def bench_lowlatency(port: int, quick: bool) -> dict:
+    """
+    Round-trip jitter on loopback at 1ms interval, default sender vs. --low-latency profile
+    """
+
+    results = {}
+    spread = {}
+    for name, low_latency in (("default", False), ("tuned", True)):
+        config = SenderConfig(
+            far_end=f"127.0.0.1:{port}",
+            near_end="127.0.0.1:0",
+            tos=0,
+            interval=1,
+            count=200 if quick else 2000,
+            low_latency=low_latency,
+        )
+        sender = TwampySessionSender(config)
+        rtts = []
+        add = sender.stats.add
+
+        def record(delayRT, delayOB, delayIB, rseq, sseq, add=add, rtts=rtts):
+            rtts.append(delayRT)
+            add(delayRT, delayOB, delayIB, rseq, sseq)
+
+        sender.stats.add = record
+        sender.run()
+        sender.socket.close()
+
+        spread[name] = statistics.pstdev(rtts) * 1000 if len(rtts) > 1 else 0.0
+        results[f"lowlatency.{name}.rtt_p99_us"] = {
+            "value": round(_percentile(rtts, 99) * 1000, 1),
+            "unit": "us",
+            "better": "lower",
+            "tolerance": 100,
+        }
+        results[f"lowlatency.{name}.rtt_stdev_us"] = {
+            "value": round(spread[name], 1),
+            "unit": "us",
+            "better": "lower",
+            "tolerance": 100,
+        }
+    if spread["default"]:
+        # informational only (better=None): not compared against the baseline
+        results["lowlatency.jitter_reduction_pct"] = {
+            "value": round(100 * (1 - spread["tuned"] / spread["default"]), 1),
+            "unit": "%",
+            "better": None,
+        }
+    return results
+
+
+def bench_compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print current results next to the baseline, return names of regressed metrics
+    """
+
+    regressions = []
+    print("===============================================================================")
+    print("Metric                                Baseline       Current     Change")
+    print("-------------------------------------------------------------------------------")
+    for name, base in baseline.get("results", {}).items():
+        current = results["results"].get(name)
+        if current is None or not base["value"] or base.get("better") is None:
+            continue
+        change = 100 * (current["value"] - base["value"]) / base["value"]
+        limit = base.get("tolerance", tolerance)
+        worse = change > limit if base["better"] == "lower" else change < -limit
+        if worse:
+            regressions.append(name)
+        flag = "  REGRESSION" if worse else ""
+        print(f"  {name:34s} {base['value']:>10} {current['value']:>12} {change:+9.1f}%{flag}")
+    print("-------------------------------------------------------------------------------")
+    print(f"  {len(regressions)} regression(s), tolerance {tolerance:.0f}%")
+    print("===============================================================================")
+    sys.stdout.flush()
+    return regressions
+
+
+def twampy_benchmark(args):
+    suites = args.only or ["codec", "stats", "burst", "reflector", "pacing", "lowlatency"]
+    results = {
+        "twampy": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "quick": args.quick,
+        "results": {},
+    }
+
+    if "codec" in suites:
+        log.info("benchmark: packet codec")
+        results["results"].update(bench_codec(args.quick))
+    if "stats" in suites:
+        log.info("benchmark: TwampStatistics.add")
+        results["results"].update(bench_stats(args.quick))
+    if "burst" in suites:
+        log.info("benchmark: sender transmit pps, single requests vs. --burst")
+        results["results"].update(bench_burst(args.quick))
+    if "reflector" in suites or "pacing" in suites or "lowlatency" in suites:
+        with _loopback_reflector() as (port, _proc):
+            if "reflector" in suites:
+                log.info("benchmark: reflector pps at %.1f%% loss", args.loss)
+                results["results"].update(bench_reflector(port, args.quick, args.loss))
+            if "pacing" in suites:
+                log.info("benchmark: sender pacing accuracy")
+                results["results"].update(bench_pacing(port, args.quick))
+            if "lowlatency" in suites:
+                log.info("benchmark: round-trip jitter with and without --low-latency")
+                results["results"].update(bench_lowlatency(port, args.quick))
+
+    for name, result in results["results"].items():
+        print(f"{name:38s} {result['value']:>12} {result['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if bench_compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+#############################################################################
+# Synthetic load generator (loopback reflector sizing / soak)
+
+
+def _rss_kb(pid):
+    """
+    Resident set size of a process in kB (Linux only, None elsewhere)
+    """
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _raise_nofile(needed):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+def _loadgen_worker(wid, target, clients, pps, ramp_to, duration, lifetime, imix, seed, start, results):
+    """
+    Simulate a share of the clients in one process, each client with its own source port
+    """
+
+    rng = random.Random(seed * 1000 + wid)
+    family = socket.AF_INET6 if ":" in target[0] else socket.AF_INET
+    profile = SizeProfile.parse(imix, 6 if family == socket.AF_INET6 else 4, seed * 1000 + wid)
+    sent_total = 0
+    _raise_nofile(clients + 64)
+    sel = selectors.DefaultSelector()
+    active = []
+    retired = []
+    sent = [0] * (int(duration) + 1)
+    received = [0] * (int(duration) + 1)
+    latency = Histogram()
+    opened = 0
+
+    def open_client(t):
+        nonlocal opened
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.bind(("::1" if family == socket.AF_INET6 else "127.0.0.1", 0))
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ)
+        opened += 1
+        # [socket, next sseq, time to stop]
+        return [sock, 0, t + rng.expovariate(1 / lifetime) if lifetime else start + duration + 1]
+
+    def drain(sock):
+        t4 = now()
+        while True:
+            try:
+                data = sock.recv(9216)
+            except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+                return
+            if len(data) < REPLY_ECHO:
+                continue
+            t1 = decode_reply(data)[2]
+            sec = int(t1 - start)
+            if 0 <= sec <= duration:
+                received[sec] += 1
+            latency.add(1e6 * (t4 - t1))
+
+    while now() < start:
+        time.sleep(min(0.01, start - now()))
+
+    # random start: clients come up over the first second
+    pending = sorted(start + rng.random() for _ in range(clients))
+    schedule = start
+    rr = 0
+    end = start + duration
+    while True:
+        t = now()
+        if t >= end:
+            break
+        while pending and pending[0] <= t:
+            active.append(open_client(pending.pop(0)))
+
+        while schedule <= t and active:
+            rr = (rr + 1) % len(active)
+            client = active[rr]
+            if client[2] <= t:
+                # random stop: keep the old socket a little longer for late replies
+                retired.append((t + 1, client[0]))
+                client = active[rr] = open_client(t)
+            try:
+                client[0].sendto(encode_request(client[1], now(), profile.buffers[sent_total % profile.length]), target)
+                sent_total += 1
+                sent[int(t - start)] += 1
+            except (BlockingIOError, InterruptedError):
+                pass
+            client[1] += 1
+            rate = pps + (ramp_to - pps) * (t - start) / duration if ramp_to else pps
+            schedule += 1 / rate
+        if not active:
+            schedule = t
+
+        while retired and retired[0][0] <= t:
+            sock = retired.pop(0)[1]
+            drain(sock)
+            sel.unregister(sock)
+            sock.close()
+
+        timeout = max(0.0, min(schedule, end) - now())
+        for key, _ in sel.select(timeout):
+            drain(key.fileobj)
+
+    # collect stragglers
+    deadline = now() + 1
+    while now() < deadline:
+        for key, _ in sel.select(deadline - now()):
+            drain(key.fileobj)
+    for key in list(sel.get_map().values()):
+        key.fileobj.close()
+    sel.close()
+
+    results.put({"sent": sent, "received": received, "latency": latency.todict(), "clients": opened})
+
+
+def twampy_loadgen(args):
+    procs = max(1, args.processes)
+    per_proc = [args.clients // procs + (1 if i < args.clients % procs else 0) for i in range(procs)]
+    duration = max(1, int(args.duration))
+
+    with contextlib.ExitStack() as stack:
+        if args.target:
+            addr, port, _ = parse_addr(args.target, 20001)
+            target = (addr or "127.0.0.1", port)
+            pid = args.reflector_pid
+        else:
+            port, proc = stack.enter_context(_loopback_reflector())
+            target = ("127.0.0.1", port)
+            pid = proc.pid
+        log.info("loadgen: %d clients in %d processes against %s:%d", args.clients, procs, target[0], target[1])
+
+        ctx = multiprocessing.get_context()
+        results = ctx.Queue()
+        start = now() + 1
+        rss = [(0.0, _rss_kb(pid) if pid else None)]
+        workers = [
+            ctx.Process(
+                target=_loadgen_worker,
+                args=(
+                    wid,
+                    target,
+                    per_proc[wid],
+                    args.pps / procs,
+                    args.ramp_to / procs if args.ramp_to else 0,
+                    duration,
+                    args.lifetime,
+                    args.imix,
+                    args.seed,
+                    start,
+                    results,
+                ),
+                daemon=True,
+            )
+            for wid in range(procs)
+        ]
+        for worker in workers:
+            worker.start()
+
+        reports = []
+        while len(reports) < procs:
+            try:
+                reports.append(results.get(timeout=args.sample))
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+            if pid and now() >= start:
+                rss.append((now() - start, _rss_kb(pid)))
+        for worker in workers:
+            worker.join(timeout=5)
+
+    sent = [sum(r["sent"][i] for r in reports) for i in range(duration + 1)]
+    received = [sum(r["received"][i] for r in reports) for i in range(duration + 1)]
+    latency = Histogram()
+    for r in reports:
+        latency.merge(Histogram.fromdict(r["latency"]))
+    total_sent = sum(sent)
+    total_received = sum(received)
+    drop = 100 * (total_sent - total_received) / total_sent if total_sent else 0.0
+
+    saturation = 0
+    for idx in range(duration):
+        if sent[idx] and 100 * (sent[idx] - received[idx]) / sent[idx] <= args.loss:
+            saturation = max(saturation, received[idx])
+
+    print("===============================================================================")
+    print(f"Load generator: {procs} process(es), {args.clients} clients, {duration}s against {target[0]}:{target[1]}")
+    print("-------------------------------------------------------------------------------")
+    print(f"  Sent:        {total_sent:10d} packets  {total_sent / duration:10.0f} pps")
+    print(f"  Received:    {total_received:10d} packets  {total_received / duration:10.0f} pps")
+    print(f"  Dropped:     {total_sent - total_received:10d} packets  {drop:9.2f}%")
+    print(f"  Clients:     {sum(r['clients'] for r in reports):10d} source ports used")
+    print(f"  Saturation:  {saturation:10d} pps (highest reply rate with <= {args.loss:.1f}% drop)")
+    print("-------------------------------------------------------------------------------")
+    print("Reply latency     Min         p50         p90         p99       p99.9         Max")
+    print(
+        f"               {dp((latency.min or 0) / 1000)}  {dp(latency.percentile(50) / 1000)}"
+        f"  {dp(latency.percentile(90) / 1000)}  {dp(latency.percentile(99) / 1000)}"
+        f"  {dp(latency.percentile(99.9) / 1000)}  {dp((latency.max or 0) / 1000)}"
+    )
+    print("-------------------------------------------------------------------------------")
+    print("  Time      Offered     Replies     Drop     Reflector RSS")
+    for idx in range(duration):
+        mem = [kb for t, kb in rss if kb is not None and idx <= t < idx + 1]
+        loss = 100 * (sent[idx] - received[idx]) / sent[idx] if sent[idx] else 0.0
+        memory = f"{mem[-1]:10d} kB" if mem else "           n/a"
+        print(f"  {idx + 1:4d}s  {sent[idx]:9d}   {received[idx]:9d}   {loss:6.2f}%   {memory}")
+    known = [kb for t, kb in rss if kb is not None]
+    if len(known) > 1:
+        print("-------------------------------------------------------------------------------")
+        print(f"  Reflector memory growth: {known[-1] - known[0]:+d} kB ({known[0]} kB -> {known[-1]} kB)")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "target": list(target),
+                    "sent": sent,
+                    "received": received,
+                    "drop_pct": drop,
+                    "saturation_pps": saturation,
+                    "latency_us": {p: latency.percentile(p) for p in (50, 90, 99, 99.9)},
+                    "rss_kb": rss,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+
+
+#############################################################################
+# Network impairment relay (loopback testing without root or tc/netem)
+#
+#   sender --> [listen] twampy impair [upstream] --> reflector
+#   Forward and reverse direction are impaired independently, each with its
+#   own random generator, so a seed reproduces the same decisions per packet.
+
+RATE_UNITS = {"": 1, "k": 1e3, "m": 1e6, "g": 1e9}
+
+
+class Impairment:
+    """
+    Impairment model of one direction: loss (Bernoulli or Gilbert-Elliott), rate limit
+    with a bounded queue, delay distribution, reordering and duplication.
+
+    schedule() returns the departure times of one packet: none if it is dropped,
+    two if it is duplicated.
+    """
+
+    def __init__(self, delay="0", loss="0", duplicate=0.0, reorder=0.0, gap=5.0, rate=0.0, limit=1000, seed=0):
+        self.rng = random.Random(seed)
+        self.delay = self.parse_delay(delay)
+        self.loss = self.parse_loss(loss)
+        self.duplicate = duplicate / 100
+        self.reorder = reorder / 100
+        self.gap = gap / 1000
+        self.rate = rate  # bits per second, 0 = unlimited
+        self.limit = limit
+        self.bad = False  # Gilbert-Elliott state
+        self.busy = 0.0  # rate limit: link busy until
+        self.queue = collections.deque()  # rate limit: departure times of queued packets
+        self.counters = dict.fromkeys(("received", "lost", "overflow", "duplicated", "reordered", "forwarded"), 0)
+
+    @staticmethod
+    def parse_delay(spec):
+        """
+        Delay distribution in msec: 'N' (constant), 'uniform:MIN,MAX', 'normal:MEAN,STDEV',
+        'exponential:MEAN' or 'pareto:SCALE,SHAPE'; returns a function of a Random
+        """
+
+        name, _, params = str(spec).partition(":")
+        try:
+            if not params:
+                value = float(name) / 1000
+                return lambda rng: value
+            values = [float(v) for v in params.split(",")]
+            if name == "uniform" and len(values) == 2:
+                low, high = values[0] / 1000, values[1] / 1000
+                return lambda rng: rng.uniform(low, high)
+            if name == "normal" and len(values) == 2:
+                mean, stdev = values[0] / 1000, values[1] / 1000
+                return lambda rng: max(0.0, rng.gauss(mean, stdev))
+            if name == "exponential" and len(values) == 1 and values[0] > 0:
+                rate = 1000 / values[0]
+                return lambda rng: rng.expovariate(rate)
+            if name == "pareto" and len(values) == 2 and values[1] > 0:
+                scale, shape = values[0] / 1000, values[1]
+                return lambda rng: scale * rng.paretovariate(shape)
+        except ValueError:
+            pass
+        raise ValueError(
+            f"invalid delay '{spec}' (N, uniform:MIN,MAX, normal:MEAN,STDEV, exponential:MEAN, pareto:SCALE,SHAPE)"
+        )
+
+    @staticmethod
+    def parse_loss(spec):
+        """
+        Loss model in percent: 'P' (Bernoulli) or 'ge:P,R[,BAD[,GOOD]]' (Gilbert-Elliott with
+        good->bad probability P, bad->good probability R, loss BAD (100) in the bad and
+        GOOD (0) in the good state); returns (p, r, bad, good) as probabilities
+        """
+
+        name, _, params = str(spec).partition(":")
+        try:
+            if not params:
+                loss = float(name) / 100
+                values = (0.0, 1.0, loss, loss)
+            elif name == "ge":
+                given = [float(v) / 100 for v in params.split(",")]
+                if not 2 <= len(given) <= 4:
+                    raise ValueError
+                values = tuple(given + [1.0, 0.0][len(given) - 2 :])
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"invalid loss '{spec}' (P or ge:P,R[,BAD[,GOOD]] in percent)") from None
+        if not all(0 <= v <= 1 for v in values):
+            raise ValueError(f"invalid loss '{spec}' (percentages must be 0..100)")
+        return values
+
+    def schedule(self, t, size):
+        counters = self.counters
+        rng = self.rng
+        counters["received"] += 1
+
+        p, r, bad, good = self.loss
+        if p or r < 1:
+            # state transition first, then loss in the new state
+            self.bad = (rng.random() >= r) if self.bad else (rng.random() < p)
+        if rng.random() < (bad if self.bad else good):
+            counters["lost"] += 1
+            return ()
+
+        if self.rate:
+            queue = self.queue
+            while queue and queue[0] <= t:
+                queue.popleft()
+            if len(queue) >= self.limit:
+                counters["overflow"] += 1
+                return ()
+            self.busy = max(t, self.busy) + 8 * (size + 28) / self.rate  # with IP/UDP header
+            queue.append(self.busy)
+            t = self.busy
+
+        due = t + self.delay(rng)
+        if self.reorder and rng.random() < self.reorder:
+            counters["reordered"] += 1
+            due += self.gap
+        if self.duplicate and rng.random() < self.duplicate:
+            counters["duplicated"] += 1
+            counters["forwarded"] += 2
+            return (due, due)
+        counters["forwarded"] += 1
+        return (due,)
+
+    @classmethod
+    def fromargs(cls, args, seed):
+        return cls(args.delay, args.loss, args.duplicate, args.reorder, args.reorder_gap, args.rate, args.limit, seed)
+
+
+def parse_rate(value):
+    """
+    Bits per second with optional k/M/G suffix, e.g. '100M'
+    """
+
+    number, unit = value.rstrip("kKmMgG"), value[len(value.rstrip("kKmMgG")) :].lower()
+    try:
+        return float(number) * RATE_UNITS[unit]
+    except (ValueError, KeyError):
+        raise argparse.ArgumentTypeError(f"invalid rate '{value}' (e.g. 500k, 100M)") from None
+
 
-dscpmap = {
-    "be": 0,
-    "cp1": 1,
-    "cp2": 2,
-    "cp3": 3,
-    "cp4": 4,
-    "cp5": 5,
-    "cp6": 6,
-    "cp7": 7,
-    "cs1": 8,
-    "cp9": 9,
-    "af11": 10,
-    "cp11": 11,
-    "af12": 12,
-    "cp13": 13,
-    "af13": 14,
-    "cp15": 15,
-    "cs2": 16,
-    "cp17": 17,
-    "af21": 18,
-    "cp19": 19,
-    "af22": 20,
-    "cp21": 21,
-    "af23": 22,
-    "cp23": 23,
-    "cs3": 24,
-    "cp25": 25,
-    "af31": 26,
-    "cp27": 27,
-    "af32": 28,
-    "cp29": 29,
-    "af33": 30,
-    "cp31": 31,
-    "cs4": 32,
-    "cp33": 33,
-    "af41": 34,
-    "cp35": 35,
-    "af42": 36,
-    "cp37": 37,
-    "af43": 38,
-    "cp39": 39,
-    "cs5": 40,
-    "cp41": 41,
-    "cp42": 42,
-    "cp43": 43,
-    "cp44": 44,
-    "cp45": 45,
-    "ef": 46,
-    "cp47": 47,
-    "nc1": 48,
-    "cp49": 49,
-    "cp50": 50,
-    "cp51": 51,
-    "cp52": 52,
-    "cp53": 53,
-    "cp54": 54,
-    "cp55": 55,
-    "nc2": 56,
-    "cp57": 57,
-    "cp58": 58,
-    "cp59": 59,
-    "cp60": 60,
-    "cp61": 61,
-    "cp62": 62,
-    "cp63": 63,
+class ImpairRelay(UdpSession):
+    """
+    UDP relay applying an Impairment per direction; one upstream socket per client
+    so replies find their way back. Packets wait in a timer heap until due, reads
+    and sends are batched per loop iteration.
+    """
+
+    def __init__(self, args):
+        addr, port, ipversion = parse_addr(args.listen, 30001)
+        raddr, rport, ripversion = parse_addr(args.target, 20001)
+        UdpSession.__init__(self, addr, port, 0, 64, False, 6 if 6 in (ipversion, ripversion) else ipversion)
+        self.socket.setblocking(False)
+        self.target = (raddr or "127.0.0.1", rport)
+        self.family = self.socket.family
+        self.batch = args.batch
+        none = argparse.Namespace(delay="0", loss="0", duplicate=0, reorder=0, reorder_gap=0, rate=0, limit=0)
+        self.forward = Impairment.fromargs(args if args.direction != "reverse" else none, args.seed)
+        self.reverse = Impairment.fromargs(args if args.direction != "forward" else none, args.seed + 1)
+        self.upstream = {}  # client address -> socket towards the target
+        self.heap = []
+        self.sequence = 0  # heap tie breaker: keep order of packets due at the same time
+
+    def receive(self, sock, client, impairment, out, destination):
+        heap = self.heap
+        for _ in range(self.batch):
+            try:
+                data, address = sock.recvfrom(9216)
+            except (BlockingIOError, InterruptedError):
+                return
+            t = now()
+            if client is None:
+                out = self.connect(address)
+                destination = self.target
+            for due in impairment.schedule(t, len(data)):
+                self.sequence += 1
+                heapq.heappush(heap, (due, self.sequence, out, data, destination))
+
+    def connect(self, client):
+        sock = self.upstream.get(client)
+        if sock is None:
+            sock = socket.socket(self.family, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setblocking(False)
+            self.upstream[client] = sock
+            self.selector.register(sock, selectors.EVENT_READ, client)
+            log.info("impair: new client %s:%d", client[0], client[1])
+        return sock
+
+    def run(self):
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        heap = self.heap
+        try:
+            while self.running:
+                # epoll timeouts have msec resolution: wake early and poll up to the deadline
+                timeout = 0.1 if not heap else min(0.1, max(0.0, heap[0][0] - now() - 0.001))
+                for key, _ in self.selector.select(timeout):
+                    if key.data is None:
+                        self.receive(self.socket, None, self.forward, None, None)
+                    else:
+                        self.receive(key.fileobj, key.data, self.reverse, self.socket, key.data)
+                t = now()
+                while heap and heap[0][0] <= t:
+                    _, _, sock, data, destination = heapq.heappop(heap)
+                    try:
+                        sock.sendto(data, destination)
+                    except OSError as e:
+                        log.debug("impair: send to %s failed: %s", destination, e)
+        finally:
+            for sock in self.upstream.values():
+                sock.close()
+            self.selector.close()
+            self.socket.close()
+
+    def stop(self, signum=None, frame=None):
+        log.info("Stop impairment relay")
+        self.running = False
+
+    def dump(self):
+        print("===============================================================================")
+        print("Direction    Received      Lost  Overflow  Duplicated  Reordered  Forwarded")
+        print("-------------------------------------------------------------------------------")
+        for name, impairment in (("Forward:", self.forward), ("Reverse:", self.reverse)):
+            c = impairment.counters
+            print(
+                f"  {name:9s}{c['received']:10d}{c['lost']:10d}{c['overflow']:10d}{c['duplicated']:12d}"
+                f"{c['reordered']:11d}{c['forwarded']:11d}"
+            )
+        print("-------------------------------------------------------------------------------")
+        print(f"  Clients: {len(self.upstream)}    Packets still queued: {len(self.heap)}")
+        print("===============================================================================")
+        sys.stdout.flush()
+
+
+def twampy_impair(args):
+    relay = ImpairRelay(args)
+    relay.daemon = True
+    relay.name = "twampy_impair"
+    log.info("Impairment relay %s -> %s:%d", args.listen, relay.target[0], relay.target[1])
+    relay.start()
+
+    signal.signal(signal.SIGINT, relay.stop)
+    join_thread(relay, args.duration or None)
+    if relay.is_alive():
+        relay.stop()
+        join_thread(relay)
+
+    relay.dump()
+
+
+#############################################################################
+# Offline capture analysis (pcap/pcapng)
+#
+#   Packets to a reflector port are requests, packets from it are reflections
+#   (TWAMP-light and unauthenticated STAMP share the fields twampy decodes).
+#   T4 is the capture time of the reflection, T1 the capture time of the
+#   matching request, or the sender timestamp if the request was not captured.
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
 }
+PCAPNG_SHB = b"\x0a\x0d\x0d\x0a"
+PCAPNG_BOM = {b"\x4d\x3c\x2b\x1a": "<", b"\x1a\x2b\x3c\x4d": ">"}
+ETH_VLAN = (0x8100, 0x88A8, 0x9100)
+ETH_IP = (0x0800, 0x86DD)
+IPV6_EXTENSIONS = (0, 43, 60)  # hop-by-hop, routing, destination options
+
+
+class PcapReader:
+    """
+    Streaming pcap/pcapng reader: yields (timestamp, linktype, frame) one packet at a
+    time, memory use does not depend on the file size
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        magic = self.stream.read(4)
+        if magic in PCAP_MAGIC:
+            return self._pcap(*PCAP_MAGIC[magic])
+        if magic == PCAPNG_SHB:
+            return self._pcapng()
+        raise ValueError("not a pcap or pcapng file")
+
+    def _pcap(self, order, resolution):
+        read = self.stream.read
+        header = read(20)
+        if len(header) < 20:
+            return
+        linktype = struct.unpack(order + "I", header[16:20])[0] & 0x0FFFFFFF  # upper bits: FCS length
+        record = struct.Struct(order + "4I")
+        while True:
+            head = read(16)
+            if len(head) < 16:
+                return
+            sec, frac, caplen, _ = record.unpack(head)
+            frame = read(caplen)
+            if len(frame) < caplen:
+                log.warning("pcap: truncated last packet")
+                return
+            yield sec + frac * resolution, linktype, frame
+
+    def _pcapng(self):
+        read = self.stream.read
+        head = PCAPNG_SHB + read(4)
+        order = "<"
+        interfaces = []
+        while len(head) == 8:
+            if head[:4] == PCAPNG_SHB:
+                # section header: byte order mark decides how to read the rest
+                bom = read(4)
+                if bom not in PCAPNG_BOM:
+                    raise ValueError("pcapng: invalid byte order mark")
+                order = PCAPNG_BOM[bom]
+                length = struct.unpack(order + "I", head[4:])[0]
+                read(length - 12)
+                interfaces = []
+            else:
+                kind, length = struct.unpack(order + "2I", head)
+                body = read(length - 8)
+                if len(body) < length - 8:
+                    log.warning("pcapng: truncated last block")
+                    return
+                if kind == 1:
+                    interfaces.append(self._interface(order, body))
+                elif kind == 6 and len(body) >= 20:
+                    iface, high, low, caplen, _ = struct.unpack_from(order + "5I", body)
+                    if iface >= len(interfaces):
+                        raise ValueError("pcapng: packet of an undefined interface")
+                    linktype, resolution, offset = interfaces[iface]
+                    yield offset + ((high << 32) | low) * resolution, linktype, body[20 : 20 + caplen]
+                # other blocks (simple packets without timestamp, statistics, ...) are skipped
+            head = read(8)
+
+    @staticmethod
+    def _interface(order, body):
+        linktype = struct.unpack_from(order + "H", body)[0]
+        resolution, offset = 1e-6, 0
+        pos = 8
+        while pos + 4 <= len(body) - 4:
+            code, size = struct.unpack_from(order + "2H", body, pos)
+            if code == 0:
+                break
+            value = body[pos + 4 : pos + 4 + size]
+            if code == 9 and size == 1:  # if_tsresol
+                resolution = 2.0 ** -(value[0] & 0x7F) if value[0] & 0x80 else 10.0 ** -value[0]
+            elif code == 14 and size == 8:  # if_tsoffset
+                offset = struct.unpack(order + "q", value)[0]
+            pos += 4 + (size + 3) // 4 * 4
+        return linktype, resolution, offset
+
+
+def decode_frame(linktype, frame):
+    """
+    Returns (src, sport, dst, dport, payload) of a UDP datagram, None for other packets
+    """
+
+    if linktype == 1:  # Ethernet
+        offset = 14
+        ethertype = int.from_bytes(frame[12:14], "big")
+        while ethertype in ETH_VLAN:
+            ethertype = int.from_bytes(frame[offset + 2 : offset + 4], "big")
+            offset += 4
+        if ethertype not in ETH_IP:
+            return None
+    elif linktype == 113:  # Linux cooked capture (tcpdump -i any)
+        offset = 16
+    elif linktype == 276:  # Linux cooked capture v2
+        offset = 20
+    elif linktype in (0, 108):  # BSD loopback
+        offset = 4
+    elif linktype in (12, 14, 101, 228, 229):  # raw IP
+        offset = 0
+    else:
+        return None
+
+    packet = memoryview(frame)[offset:]
+    if len(packet) < 20:
+        return None
+    version = packet[0] >> 4
+    if version == 4:
+        if packet[9] != 17 or int.from_bytes(packet[6:8], "big") & 0x1FFF:
+            return None  # not UDP, or not the first fragment
+        src, dst = socket.inet_ntop(socket.AF_INET, packet[12:16]), socket.inet_ntop(socket.AF_INET, packet[16:20])
+        udp = packet[(packet[0] & 0x0F) * 4 :]
+    elif version == 6 and len(packet) >= 40:
+        nxt, pos = packet[6], 40
+        while nxt in IPV6_EXTENSIONS and len(packet) >= pos + 8:
+            nxt, pos = packet[pos], pos + (packet[pos + 1] + 1) * 8
+        if nxt == 44 and len(packet) >= pos + 8:  # fragment header
+            if int.from_bytes(packet[pos + 2 : pos + 4], "big") & 0xFFF8:
+                return None
+            nxt, pos = packet[pos], pos + 8
+        if nxt != 17:
+            return None
+        src, dst = socket.inet_ntop(socket.AF_INET6, packet[8:24]), socket.inet_ntop(socket.AF_INET6, packet[24:40])
+        udp = packet[pos:]
+    else:
+        return None
+    if len(udp) < 8:
+        return None
+    sport, dport, length = struct.unpack_from("!3H", udp)
+    return src, sport, dst, dport, udp[8 : max(8, length)]
+
+
+class CaptureSession:
+    """
+    One test session found in a capture (sender and reflector address/port)
+    """
+
+    def __init__(self, sender, reflector):
+        self.sender = sender
+        self.reflector = reflector
+        self.stats = TwampStatistics()
+        self.pending = collections.OrderedDict()  # sseq -> request capture time
+        self.requests = 0
+        self.matched = 0
+        self.maxseq = -1
+        self.first = None
+        self.last = None
+
+    def request(self, t, sseq, timeout):
+        pending = self.pending
+        pending[sseq] = t
+        pending.move_to_end(sseq)
+        # requests without reflection are lost: keep memory bounded
+        while pending and next(iter(pending.values())) < t - timeout:
+            pending.popitem(last=False)
+        self.requests += 1
+
+    def sent(self):
+        # without captured requests: derived from the sender sequence numbers
+        return self.requests or self.maxseq + 1
+
+
+def pcap_sessions(args, ports, sessions, writer):
+    """
+    Stream a capture file into per-session statistics, returns (frames, decoded)
+    """
+
+    frames = decoded = 0
+    with contextlib.ExitStack() as stack:
+        if args.file == "-":
+            stream = sys.stdin.buffer
+        elif args.file.endswith(".gz"):
+            stream = stack.enter_context(gzip.open(args.file, "rb"))
+        else:
+            stream = stack.enter_context(open(args.file, "rb", buffering=1 << 20))
+
+        for t, linktype, frame in PcapReader(stream):
+            frames += 1
+            udp = decode_frame(linktype, frame)
+            if udp is None:
+                continue
+            src, sport, dst, dport, payload = udp
+            if dport in ports and sport in ports:
+                # reflector port on both ends (862 <-> 862): the first packet seen between them is a request
+                reply = ((dst, dport), (src, sport)) in sessions
+            elif dport in ports or sport in ports:
+                reply = sport in ports
+            else:
+                continue
+            if not reply and len(payload) >= REQUEST_MIN:
+                key = ((src, sport), (dst, dport))
+                session = sessions.get(key) or sessions.setdefault(key, CaptureSession(*key))
+                sseq, _ = decode_request(payload)
+                session.request(t, sseq, args.timeout)
+                if writer:
+                    writer.sent(sseq, t)
+                    if writer.sla:
+                        writer.events(writer.sla.sent(sseq, t))
+            elif reply and len(payload) >= REPLY_ECHO:
+                key = ((dst, dport), (src, sport))
+                session = sessions.get(key) or sessions.setdefault(key, CaptureSession(*key))
+                rseq, sseq, t1, t2, t3 = decode_reply(payload)
+                t4 = t
+                captured = session.pending.pop(sseq, None)
+                if captured is not None:
+                    t1 = captured
+                    session.matched += 1
+
+                delayRT = max(0, 1000 * (t4 - t1 + t2 - t3))  # round-trip delay
+                delayOB = max(0, 1000 * (t2 - t1))  # out-bound delay
+                delayIB = max(0, 1000 * (t4 - t3))  # in-bound delay
+                session.stats.add(delayRT, delayOB, delayIB, rseq, sseq)
+                session.maxseq = max(session.maxseq, sseq)
+                if writer:
+                    if writer.sla:
+                        writer.events(writer.sla.reply(t4, delayRT, delayOB, delayIB, sseq))
+                    writer.reply(rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, len(payload), src)
+            else:
+                continue
+            decoded += 1
+            if session.first is None:
+                session.first = t
+            session.last = t
+    return frames, decoded
+
+
+def twampy_pcap(args):
+    ports = set(args.port or (862, 20001))
+    writer = result_writer(args, offline=True)
+    if writer:
+        writer.start()
+    sessions = {}
+
+    try:
+        frames, decoded = pcap_sessions(args, ports, sessions, writer)
+    except (OSError, ValueError) as e:
+        log.critical("*** %s: %s", args.file, e)
+        sys.exit(1)
+
+    log.info("pcap: %d frames, %d TWAMP/STAMP packets, %d sessions", frames, decoded, len(sessions))
+    with contextlib.redirect_stdout(sys.stderr if sinks_on_stdout(args) else sys.stdout):
+        if not sessions:
+            print(f"No TWAMP-light/STAMP packets found (reflector ports {','.join(map(str, sorted(ports)))})")
+        for session in sessions.values():
+            print(
+                "Session {}:{} -> {}:{}".format(*session.sender, *session.reflector),
+                f"({session.requests} requests, {session.stats.count} reflections, {session.matched} matched)",
+            )
+            session.stats.dump(max(session.sent(), session.stats.count))
+
+    if writer:
+        for session in sessions.values():
+            writer.summary(
+                session.stats.result(max(session.sent(), session.stats.count)),
+                started=session.first,
+                ended=session.last,
+                far_end="{}:{}".format(*session.reflector),
+                near_end="{}:{}".format(*session.sender),
+                interval=None,
+                count=session.sent(),
+            )
+        writer.close()
+
+
+#############################################################################
+# Result history (queries on a --store database)
+
+HISTORY_BUCKETS = {"minute": 60, "hour": 3600, "day": 86400, "week": 604800}
+HISTORY_FIELDS = ["time", "far_end", "tos", "sessions", "sent", "received", "loss", "rt_min", "rt_avg", "rt_max"]
+HISTORY_FIELDS += ["rt_jitter", "ob_avg", "ib_avg"]
+
+
+def parse_time(value):
+    """
+    Absolute ('2026-10-01', '2026-10-01T12:00') or relative time ('30m', '24h', '7d' ago)
+    """
+
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if value[-1:] in units:
+        with contextlib.suppress(ValueError):
+            return now() - float(value[:-1]) * units[value[-1]]
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid time '{value}' (e.g. 2026-10-01, 2026-10-01T12:00, 24h, 7d)"
+        ) from None
+
+
+def parse_dscp(value):
+    try:
+        return dscp_tos(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid DSCP Value '{value}'") from None
+
+
+def history_query(args):
+    """
+    SQL and parameters for 'twampy history': one row per session or interval, or per
+    time bucket with weighted averages
+    """
+
+    if args.by_interval:
+        source, t, r = "intervals r JOIN sessions s ON s.id = r.session", "r.start", "r"
+    else:
+        source, t, r = "sessions s", "s.started", "s"
+    where, params = [f"{r}.received IS NOT NULL"], []
+    if args.target:
+        # exact 'host:port' or any port of 'host' (range scan on the far_end index)
+        where.append("(s.far_end = ? OR (s.far_end >= ? AND s.far_end < ?))")
+        params += [args.target, args.target + ":", args.target + ";"]
+    if args.tos_filter is not None:
+        where.append("s.tos = ?")
+        params.append(args.tos_filter)
+    if args.since:
+        where.append(f"{t} >= ?")
+        params.append(args.since)
+    if args.until:
+        where.append(f"{t} < ?")
+        params.append(args.until)
+
+    if args.bucket:
+        weighted = " ".join(
+            f"SUM({r}.{m} * {r}.received) / NULLIF(SUM({r}.received), 0) AS {m},"
+            for m in ("rt_avg", "rt_jitter", "ob_avg", "ib_avg")
+        )
+        sql = (
+            f"SELECT CAST({t} / {args.bucket} AS INTEGER) * {args.bucket} AS time, "
+            "CASE WHEN COUNT(DISTINCT s.far_end) = 1 THEN MIN(s.far_end) ELSE '*' END AS far_end, "
+            "CASE WHEN COUNT(DISTINCT s.tos) = 1 THEN MIN(s.tos) END AS tos, "
+            f"COUNT(*) AS sessions, SUM({r}.sent) AS sent, SUM({r}.received) AS received, "
+            f"MIN({r}.rt_min) AS rt_min, MAX({r}.rt_max) AS rt_max, {weighted.rstrip(',')} "
+            f"FROM {source} WHERE {' AND '.join(where)} GROUP BY 1 ORDER BY 1"
+        )
+    else:
+        sql = (
+            f"SELECT * FROM (SELECT {t} AS time, s.far_end, s.tos, 1 AS sessions, {r}.sent, {r}.received, "
+            f"{r}.rt_min, {r}.rt_avg, {r}.rt_max, {r}.rt_jitter, {r}.ob_avg, {r}.ib_avg "
+            f"FROM {source} WHERE {' AND '.join(where)} ORDER BY {t} DESC LIMIT ?) ORDER BY time"
+        )
+        params.append(args.limit)
+    return sql, params
+
+
+def twampy_history(args):
+    if not os.path.exists(args.store):
+        log.critical("*** %s: no such result store", args.store)
+        sys.exit(1)
+    db = sqlite3.connect(f"file:{args.store}?mode=ro", uri=True)
+    sql, params = history_query(args)
+    log.debug("history: %s %s", sql, params)
+
+    rows = []
+    cursor = db.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    for values in cursor:
+        record = dict(zip(columns, values, strict=True))
+        record["loss"] = 100 * (1 - record["received"] / record["sent"]) if record["sent"] else None
+        rows.append(record)
+    db.close()
+
+    if args.format != "table":
+        sink = (
+            NdjsonSink("history", sys.stdout)
+            if args.format == "ndjson"
+            else CsvSink("history", sys.stdout, HISTORY_FIELDS)
+        )
+        for record in rows:
+            sink.write(record)
+        sink.flush()
+        return
+
+    print("===============================================================================")
+    print("Time                 Target              Sent   Loss       Min       Avg       Max")
+    print("-------------------------------------------------------------------------------")
+    for record in rows:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"]))
+        if record["received"]:
+            delays = f"{dp(record['rt_min'])}{dp(record['rt_avg'])}{dp(record['rt_max'])}"
+        else:
+            delays = "    NO STATS AVAILABLE"
+        print(f"{stamp}  {record['far_end'][:17]:17s}{record['sent']:7d} {record['loss']:5.1f}%{delays}")
+    print("-------------------------------------------------------------------------------")
+    what = "intervals" if args.by_interval else "sessions"
+    if args.bucket:
+        print(f"  {len(rows)} buckets of {args.bucket}s, {sum(r['sessions'] for r in rows)} {what}")
+    else:
+        print(f"  {len(rows)} {what} (latest {args.limit})")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Packet archive queries: session statistics or packet records streamed from
+# the blocks of a time range
+
+ARCHIVE_FIELDS = ["started", "reflector", "sent", "received"] + SUMMARY_FIELDS
+
+
+def twampy_archive(args):
+    try:
+        archive = PacketArchive(args.archive)
+    except (OSError, ValueError) as e:
+        log.critical("*** %s: %s", args.archive, e)
+        sys.exit(1)
+
+    try:
+        if args.packets:
+            sink = (
+                NdjsonSink("packets", sys.stdout)
+                if args.format != "csv"
+                else CsvSink("packets", sys.stdout, PACKET_FIELDS)
+            )
+            for record in archive.records(args.since, args.until):
+                if not args.reflector or record["reflector"] == args.reflector:
+                    sink.write(record)
+            sink.flush()
+            return
+        sessions = archive.sessions(args.since, args.until, args.reflector)
+    except (ValueError, zlib.error) as e:
+        log.critical("*** %s: %s", args.archive, e)
+        sys.exit(1)
+    finally:
+        archive.close()
+
+    rows = []
+    for started, reflector, stats, first, last in sessions:
+        record = {"started": started, "reflector": reflector}
+        record.update(flatten_result(stats.result(last - first + 1)))
+        rows.append(record)
+
+    if args.format != "table":
+        sink = (
+            NdjsonSink("archive", sys.stdout)
+            if args.format == "ndjson"
+            else CsvSink("archive", sys.stdout, ARCHIVE_FIELDS)
+        )
+        for record in rows:
+            sink.write(record)
+        sink.flush()
+        return
+
+    size = os.path.getsize(args.archive)
+    print("===============================================================================")
+    print("Started              Reflector           Sent   Loss       Min       Avg       Max")
+    print("-------------------------------------------------------------------------------")
+    for record in rows:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["started"]))
+        delays = f"{dp(record['rt_min'])}{dp(record['rt_avg'])}{dp(record['rt_max'])}"
+        print(f"{stamp}  {record['reflector'][:17]:17s}{record['sent']:7d} {record['rt_loss']:5.1f}%{delays}")
+    print("-------------------------------------------------------------------------------")
+    packets = archive.packets
+    print(
+        f"  {len(rows)} sessions; archive: {packets} packets in {len(archive.index)} blocks, {size} bytes"
+        + (f" ({size / packets:.1f} bytes/packet)" if packets else "")
+    )
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Probe campaigns: many periodic sessions from one event loop
+#
+#   Campaign file (TOML, YAML or JSON):
+#     [scheduler]   max_sessions, max_pps, jitter, timeout    (optional)
+#     [defaults]    any probe setting                         (optional)
+#     [[probe]]     name, target, tos|dscp, padding|imix, interval, count, period, ...
+
+CAMPAIGN_PROBE = {
+    "name": str,
+    "target": str,
+    "near_end": str,
+    "tos": int,
+    "dscp": str,
+    "ttl": int,
+    "padding": int,
+    "imix": str,
+    "seed": int,
+    "do_not_fragment": bool,
+    "interval": (int, float),  # msec
+    "count": int,
+    "period": (int, float),  # seconds between session starts
+}
+CAMPAIGN_SCHEDULER = {"max_sessions": int, "max_pps": (int, float), "jitter": (int, float), "timeout": (int, float)}
+
+
+@dataclasses.dataclass(eq=False)
+class CampaignProbe:
+    """
+    One entry of a campaign: session settings plus its schedule
+    """
+
+    name: str
+    config: SenderConfig
+    period: float
+    first: float = 0.0  # start of the first run (randomized offset)
+    runs: int = 0
+    slot: int = 0  # period of the last start, counted from 'first'
+
+    @property
+    def pps(self):
+        return 1000 / self.config.interval if self.config.interval else 0
+
+
+def load_campaign(path):
+    """
+    Read a campaign file (.toml, .yaml/.yml or .json): returns (probes, scheduler settings)
+    """
+
+    if path.endswith(".toml"):
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML campaign files need PyYAML (pip install twampy[yaml])") from None
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    elif path.endswith(".json"):
+        with open(path) as f:
+            data = json.load(f)
+    else:
+        raise ValueError("campaign file must be .toml, .yaml, .yml or .json")
+
+    if not isinstance(data, dict):
+        raise ValueError("campaign file must contain a table/mapping")
+
+    def checked(section, entry, allowed):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{section}: expected a table/mapping")
+        for key, value in entry.items():
+            if key not in allowed:
+                raise ValueError(f"{section}: unknown setting '{key}'")
+            if not isinstance(value, allowed[key]) or isinstance(value, bool) != (allowed[key] is bool):
+                raise ValueError(f"{section}: invalid value for '{key}': {value!r}")
+        return entry
+
+    scheduler = checked("scheduler", data.get("scheduler", {}), CAMPAIGN_SCHEDULER)
+    defaults = checked("defaults", data.get("defaults", {}), CAMPAIGN_PROBE)
+    entries = data.get("probe", data.get("probes", []))
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("no probes defined (probe list)")
+
+    probes = []
+    for idx, entry in enumerate(entries):
+        settings = dict(defaults)
+        settings.update(checked(f"probe {idx + 1}", entry, CAMPAIGN_PROBE))
+        if "target" not in settings:
+            raise ValueError(f"probe {idx + 1}: missing target")
+        name = settings.pop("name", settings["target"])
+        period = float(settings.pop("period", 300))
+        dscp = settings.pop("dscp", None)
+        if dscp is not None:
+            try:
+                settings["tos"] = dscp_tos(dscp)
+            except (TypeError, ValueError):
+                raise ValueError(f"probe {name}: invalid DSCP value '{dscp}'") from None
+        if settings.get("imix"):
+            SizeProfile.parse(settings["imix"])
+        config = SenderConfig(far_end=settings.pop("target"), **settings)
+        if config.interval <= 0 or config.count <= 0 or period <= 0:
+            raise ValueError(f"probe {name}: interval, count and period must be positive")
+        probes.append(CampaignProbe(name, config, period))
+    return probes, scheduler
+
+
+class Campaign:
+    """
+    Runs campaign probes periodically on the running event loop, every session
+    a SenderProtocol: randomized start offsets (so probes with the same period
+    do not start together), at most max_sessions concurrent sessions and max_pps
+    packets per second in total. Probes over the limits wait for running
+    sessions to end.
+    """
+
+    def __init__(self, probes, max_sessions=0, max_pps=0, jitter=0.1, timeout=5.0, runs=0, writer=None, seed=None):
+        self.probes = probes
+        self.max_sessions = max_sessions
+        self.max_pps = max_pps
+        self.jitter = jitter
+        self.timeout = timeout
+        self.runs = runs
+        self.writer = writer
+        self.rng = random.Random(seed)
+        self.active = set()
+        self.waiting = collections.deque()  # (probe, future set once admitted)
+        self.pps = 0.0
+        self.sessions = 0
+        self.deferred = 0
+
+    async def run(self):
+        """
+        Run until every probe had 'runs' sessions (forever for 0); when cancelled,
+        running sessions end and are reported with what they received so far
+        """
+
+        t = now()
+        for probe in self.probes:
+            probe.first = t + self.rng.uniform(0, probe.period)
+            log.info("campaign: %s every %.0fs, first in %.1fs", probe.name, probe.period, probe.first - t)
+        await asyncio.gather(*(self.schedule(probe) for probe in self.probes))
+
+    async def schedule(self, probe):
+        due = probe.first
+        while not self.runs or probe.runs < self.runs:
+            await asyncio.sleep(max(0.0, due - now()))
+            if self.admit(probe):
+                self.reserve(probe)
+            else:
+                self.deferred += 1
+                admitted = asyncio.get_running_loop().create_future()
+                self.waiting.append((probe, admitted))
+                await admitted
+            try:
+                await self.session(probe)
+            finally:
+                self.release(probe)
+            due = self.next(probe)
+
+    def admit(self, probe):
+        if not self.active:
+            return True
+        if self.max_sessions and len(self.active) >= self.max_sessions:
+            return False
+        return not self.max_pps or self.pps + probe.pps <= self.max_pps
+
+    def reserve(self, probe):
+        self.active.add(probe)
+        self.pps += probe.pps
+
+    def release(self, probe):
+        self.active.discard(probe)
+        self.pps -= probe.pps
+        while self.waiting and self.admit(self.waiting[0][0]):
+            waiting, admitted = self.waiting.popleft()
+            if not admitted.done():  # done: cancelled while waiting
+                self.reserve(waiting)
+                admitted.set_result(None)
+
+    async def session(self, probe):
+        started = now()
+        session = await start_sender_async(probe.config, timeout=self.timeout)
+        try:
+            await asyncio.shield(session.done)  # cancelled: finish() sets the result so far
+        finally:
+            session.finish()
+            self.report(probe, session, started)
+            self.sessions += 1
+            probe.runs += 1
+
+    def next(self, probe):
+        """
+        Start time of the next run: a fixed grid from the first start,
+        re-randomized within the jitter window; periods already over are skipped
+        """
+
+        t = now()
+        slot = max(probe.slot + 1, math.ceil((t - probe.first) / probe.period))
+        if slot > probe.slot + 1:
+            log.warning(
+                "campaign: %s still running at its next start, skip %d period(s)", probe.name, slot - probe.slot - 1
+            )
+        probe.slot = slot
+        return probe.first + slot * probe.period + self.rng.uniform(0, self.jitter * probe.period)
+
+    def report(self, probe, session, started):
+        result = session.done.result()
+        rt = result.roundtrip
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+        line = f"{stamp}  {probe.name[:16]:16s} sent {result.sent:5d} rcvd {result.received:5d}"
+        if rt:
+            line += f"  loss {rt.loss:5.1f}%  rtt {dp(rt.min)} {dp(rt.avg)} {dp(rt.max)}  jitter {dp(rt.jitter)}"
+        else:
+            line += "  NO STATS AVAILABLE (100% loss)"
+        print(line)
+        sys.stdout.flush()
+        if self.writer:
+            self.writer.summary(result, started=started, ended=now(), probe=probe.name, **session.metadata())
+
+
+def twampy_campaign(args):
+    try:
+        probes, scheduler = load_campaign(args.file)
+    except (OSError, ValueError, tomllib.TOMLDecodeError) as e:
+        log.critical("*** %s: %s", args.file, e)
+        sys.exit(1)
+
+    settings = {
+        key: getattr(args, key) if getattr(args, key) is not None else scheduler.get(key, default)
+        for key, default in (("max_sessions", 0), ("max_pps", 0), ("jitter", 0.1), ("timeout", 5.0))
+    }
+    writer = result_writer(args)
+    if writer:
+        writer.start()
+    campaign = Campaign(probes, runs=args.runs, writer=writer, seed=args.seed, **settings)
+    log.info(
+        "campaign: %d probes, max %s sessions, max %s pps",
+        len(probes),
+        settings["max_sessions"] or "unlimited",
+        settings["max_pps"] or "unlimited",
+    )
+
+    # Ctrl-C and --duration cancel the campaign: running sessions are reported
+    with contextlib.suppress(KeyboardInterrupt, TimeoutError):
+        asyncio.run(asyncio.wait_for(campaign.run(), args.duration or None))
+
+    log.info("campaign: %d sessions, %d deferred by limits", campaign.sessions, campaign.deferred)
+    if writer:
+        writer.close()
+
+
+#############################################################################
+# Path MTU / padding sweep
+#
+#   Sizes are IP packet sizes of the request (headers plus padding), sent with
+#   do-not-fragment. Every round probes up to --parallel sizes between the
+#   largest size that passed and the smallest that failed so far, each with a
+#   short burst; --parallel 1 is a binary search. All targets are swept at the
+#   same time, every burst is a SenderProtocol on one event loop.
+
+SWEEP_FIELDS = [
+    "target",
+    "size",
+    "padding",
+    "sent",
+    "received",
+    "loss",
+    "rt_min",
+    "rt_avg",
+    "rt_max",
+    "error",
+    "largest",
+]
+
+
+class SweepTarget:
+    """
+    Search state of one target; candidate k is the size low + k * step
+    """
+
+    def __init__(self, target, ipversion, low, high, step):
+        self.target = target
+        self.overhead = 62 if ipversion == 6 else 42  # IP/UDP headers and 14 byte request
+        self.low = max(low, self.overhead)
+        self.step = step
+        self.passed = -1  # largest candidate that passed
+        self.failed = (high - self.low) // step + 1  # smallest candidate above it that failed
+        self.round = {}  # candidate -> passed
+        self.records = {}  # size -> record
+        self.inconsistent = False
+
+    def size(self, k):
+        return self.low + k * self.step
+
+    @property
+    def largest(self):
+        return self.size(self.passed) if self.passed >= 0 else None
+
+    def candidates(self, parallel):
+        a, b = self.passed, self.failed
+        if b - a <= 1:
+            return []
+        return sorted({a + max(1, round((b - a) * i / (parallel + 1))) for i in range(1, parallel + 1)} - {b})
+
+    def update(self):
+        passes = [k for k, ok in self.round.items() if ok]
+        fails = [k for k, ok in self.round.items() if not ok]
+        self.passed = max(passes, default=self.passed)
+        if any(k < self.passed for k in fails):
+            self.inconsistent = True
+        self.failed = min((k for k in fails if k > self.passed), default=self.failed)
+        self.round = {}
+
+
+class Sweep:
+    """
+    Runs the rounds of all SweepTargets on the running event loop, at most
+    max_sessions bursts at a time
+    """
+
+    def __init__(self, targets, args):
+        self.targets = targets
+        self.args = args
+        self.parallel = args.parallel
+        self.timeout = args.timeout
+        self.limit = asyncio.Semaphore(args.max_sessions) if args.max_sessions else contextlib.nullcontext()
+
+    async def run(self):
+        await asyncio.gather(*(self.search(target) for target in self.targets))
+
+    async def search(self, target):
+        while candidates := target.candidates(self.parallel):
+            log.info("sweep: %s sizes %s", target.target, ",".join(str(target.size(k)) for k in candidates))
+            await asyncio.gather(*(self.probe(target, k) for k in candidates))
+            target.update()
+
+    async def probe(self, target, k):
+        config = SenderConfig(
+            far_end=target.target,
+            tos=self.args.tos,
+            ttl=self.args.ttl,
+            padding=target.size(k) - target.overhead,
+            do_not_fragment=True,
+            interval=self.args.interval,
+            count=self.args.count,
+        )
+        async with self.limit:
+            # EMSGSIZE is the answer for this size (above the MTU of the local
+            # interface or a path MTU the kernel learned), not a lost datagram
+            session = await start_sender_async(config, timeout=self.timeout, fatal=(errno.EMSGSIZE,))
+            try:
+                result = await session.done
+            finally:
+                session.close()
+
+        rt = result.roundtrip
+        size = target.size(k)
+        target.records[size] = {
+            "target": target.target,
+            "size": size,
+            "padding": size - target.overhead,
+            "sent": result.sent,
+            "received": result.received,
+            "loss": rt.loss if rt else (100.0 if result.sent else None),
+            "rt_min": rt.min if rt else None,
+            "rt_avg": rt.avg if rt else None,
+            "rt_max": rt.max if rt else None,
+            "error": session.error.strerror if session.error else None,
+        }
+        target.round[k] = result.received > 0
+
+
+def twampy_sweep(args):
+    targets = []
+    for spec in args.targets:
+        addr, port, ipversion = parse_addr(spec, 20001)
+        target = f"[{addr}]:{port}" if ipversion == 6 else f"{addr}:{port}"  # parsed again by the sender
+        targets.append(SweepTarget(target, ipversion, args.min_size, args.max_size, args.step))
+
+    # Ctrl-C ends the sweep, the sizes probed so far are reported
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(Sweep(targets, args).run())
+
+    if args.format != "table":
+        sink = (
+            NdjsonSink("sweep", sys.stdout) if args.format == "ndjson" else CsvSink("sweep", sys.stdout, SWEEP_FIELDS)
+        )
+        for target in targets:
+            for size in sorted(target.records):
+                sink.write(dict(target.records[size], largest=target.largest))
+        sink.flush()
+        return
+
+    for target in targets:
+        print("===============================================================================")
+        print(f"Target {target.target}")
+        print("   Size  Padding   Sent   Rcvd   Loss       Min         Avg         Max")
+        print("-------------------------------------------------------------------------------")
+        for size in sorted(target.records):
+            record = target.records[size]
+            line = f"  {size:5d}  {record['padding']:7d}{record['sent']:7d}{record['received']:7d}"
+            if record["received"]:
+                line += (
+                    f" {record['loss']:5.1f}%  {dp(record['rt_min'])}  {dp(record['rt_avg'])}  {dp(record['rt_max'])}"
+                )
+            elif record["error"]:
+                line += f"   {record['error']}"
+            else:
+                line += "   NO REPLIES"
+            print(line)
+        print("-------------------------------------------------------------------------------")
+        if target.largest is None:
+            print(f"  No size passed (smallest tried: {target.low} bytes)")
+        else:
+            padding = target.largest - target.overhead
+            print(f"  Largest size passing: {target.largest} bytes IP (padding {padding})")
+        if target.inconsistent:
+            print("  Smaller sizes failed too: loss on the path, result may be too low")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Capacity estimation with packet trains (in the spirit of RFC 9097)
+#
+#   Trains of requests are sent back-to-back (dispersion, --train 2 is a packet
+#   pair) or paced at rate steps. The reflector's receive timestamps (T2) show
+#   the spacing after the bottleneck, so any TWAMP-light reflector works.
+#   Rates are IP-layer bits per second.
+
+CAPACITY_FIELDS = ["step", "rate", "sent", "received", "loss", "offered", "received_rate", "rtt_avg"]
+
+
+def parse_rates(value):
+    return [parse_rate(rate) for rate in value.split(",")]
+
+
+def format_rate(bps):
+    if bps is None:
+        return "-"
+    for unit, scale in (("Gbit/s", 1e9), ("Mbit/s", 1e6), ("kbit/s", 1e3)):
+        if bps >= scale:
+            return f"{bps / scale:.2f} {unit}"
+    return f"{bps:.0f} bit/s"
+
+
+class CapacityProbe:
+    """
+    Sends trains of equal-size requests and collects their reflections
+    """
+
+    def __init__(self, args):
+        sip, spt, sipv = parse_addr(args.near_end, 0)
+        rip, rpt, ripv = parse_addr(args.far_end, 20001)
+        ipversion = 6 if (sipv == 6) or (ripv == 6) else 4
+        self.far_end = (rip, rpt)
+        self.size = args.size
+        self.padding = bytes(max(0, args.size - (62 if ipversion == 6 else 42)))
+        self.socket = udp_socket(sip, spt, args.tos, args.ttl, False, ipversion)
+        LowLatency(rcvbuf=4 << 20, sndbuf=4 << 20).socket(self.socket)
+        self.sseq = 0
+        self.wait_max = 0.0
+
+    def train(self, count, gap=0.0):
+        """
+        Send count requests gap seconds apart (0: back-to-back), return the first sseq
+        """
+
+        first = self.sseq
+        clock = time.perf_counter
+        start = clock()
+        for i in range(count):
+            if gap:
+                due = start + i * gap
+                while clock() < due:
+                    pass
+            self.socket.sendto(encode_request(self.sseq, now(), self.padding), self.far_end)
+            self.sseq += 1
+        return first
+
+    def collect(self, first):
+        """
+        Reflections of requests first..sseq-1 as {sseq: (t1, t2, rtt)}, waiting for late ones
+        """
+
+        replies = {}
+        last = now()
+        while len(replies) < self.sseq - first:
+            remaining = last + drain_timeout(self.wait_max) - now()
+            if remaining <= 0 or not select.select([self.socket], [], [], remaining)[0]:
+                break
+            data = self.socket.recv(9216)
+            t4 = now()
+            if len(data) < REPLY_ECHO:
+                continue
+            rseq, sseq, t1, t2, t3 = decode_reply(data)
+            if first <= sseq < self.sseq:
+                replies[sseq] = (t1, t2, t4 - t1 - (t3 - t2))
+                self.wait_max = max(self.wait_max, t4 - t1)
+        return replies
+
+    def close(self):
+        self.socket.close()
+
+
+def train_rates(replies, size):
+    """
+    Offered rate from the T1 spacing and received rate from the T2 spacing of one train
+    """
+
+    if len(replies) < 2:
+        return None, None
+    stamps = [replies[sseq] for sseq in sorted(replies)]
+    bits = (len(stamps) - 1) * size * 8
+    t1 = [stamp[0] for stamp in stamps]
+    t2 = sorted(stamp[1] for stamp in stamps)
+    offered = bits / (t1[-1] - t1[0]) if t1[-1] > t1[0] else None
+    received = bits / (t2[-1] - t2[0]) if t2[-1] > t2[0] else None
+    return offered, received
+
+
+def capacity_step(probe, args, step, rate):
+    """
+    Run --trains trains at one rate (None: back-to-back), return the step record
+    """
+
+    gap = probe.size * 8 / rate if rate else 0.0
+    sent, received, offered, rates, rtts = 0, 0, [], [], []
+    for _ in range(args.trains):
+        first = probe.train(args.train, gap)
+        replies = probe.collect(first)
+        sent += args.train
+        received += len(replies)
+        o, r = train_rates(replies, probe.size)
+        if o:
+            offered.append(o)
+        if r:
+            rates.append(r)
+        rtts += [1000 * rtt for _, _, rtt in replies.values()]
+        time.sleep(args.gap / 1000)
+    return {
+        "step": step,
+        "rate": rate,
+        "sent": sent,
+        "received": received,
+        "loss": 100 * (sent - received) / sent,
+        "offered": statistics.median(offered) if offered else None,
+        "received_rate": statistics.median(rates) if rates else None,
+        "rtt_avg": statistics.fmean(rtts) if rtts else None,
+    }
+
+
+def twampy_capacity(args):
+    probe = CapacityProbe(args)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    records = []
+    try:
+        if args.rates:
+            for step, rate in enumerate(args.rates, 1):
+                records.append(capacity_step(probe, args, step, rate))
+                log.info("capacity: step %d at %s received %s", step, format_rate(rate), records[-1]["received_rate"])
+        else:
+            records.append(capacity_step(probe, args, "train", None))
+    except KeyboardInterrupt:
+        log.warning("capacity: interrupted")
+    finally:
+        probe.close()
+
+    # highest received rate among steps without too much loss
+    passing = [record["received_rate"] for record in records if record["received_rate"] and record["loss"] <= args.loss]
+    capacity = max(passing, default=None)
+
+    if args.format != "table":
+        sink = (
+            NdjsonSink("capacity", sys.stdout)
+            if args.format == "ndjson"
+            else CsvSink("capacity", sys.stdout, CAPACITY_FIELDS)
+        )
+        for record in records:
+            sink.write(record)
+        sink.flush()
+        return
+
+    print("===============================================================================")
+    print(f"Capacity {args.far_end}: trains of {args.train} x {args.size} bytes, {args.trains} per step")
+    print("Step   Target rate     Sent   Rcvd   Loss      Offered       Received     RTT")
+    print("-------------------------------------------------------------------------------")
+    for record in records:
+        target = format_rate(record["rate"]) if record["rate"] else "back-to-back"
+        rtt = dp(record["rtt_avg"]) if record["rtt_avg"] is not None else "       -"
+        print(
+            f"{record['step']!s:5s}  {target:13s}{record['sent']:6d}{record['received']:7d} {record['loss']:5.1f}%"
+            f"  {format_rate(record['offered']):>13s}  {format_rate(record['received_rate']):>13s} {rtt}"
+        )
+    print("-------------------------------------------------------------------------------")
+    if capacity:
+        print(f"  Capacity estimate: {format_rate(capacity)} (IP layer, steps with loss <= {args.loss}%)")
+    else:
+        print("  No capacity estimate: too few replies")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Full-mesh agent: every node of a shared peer list reflects and probes all
+# other nodes from one event loop
+#
+#   Peer file: one node per line, 'name address[:port]' (port default 20001),
+#   '#' starts a comment. One reflector socket and one sender socket per node,
+#   one timer per peer, so work and memory grow linearly with the peer count.
+#   Probes to the peers are spread evenly over the interval (and the first one
+#   is offset by a per-node random delay), so nodes do not send in bursts.
+#   Report intervals are aligned to the wall clock: after each interval a node
+#   sends its row (RTT and loss to every peer) to all peers, and every node
+#   prints the full N x N matrix. A row is split over as many report datagrams
+#   of at most MESH_REPORT bytes as it needs. Requests and replies are handled
+#   by the same code as sender and reflector (SenderIndex, reply_delays).
+
+MESH_MAGIC = b"TWAMPY-MESH1 "  # row reports, received on the reflector port
+MESH_REPORT = 1200  # bytes per row report, fits the IPv6 minimum MTU (1280)
+MESH_FIELDS = ["time", "from", "to", "sent", "received", "loss", "rt_min", "rt_avg", "rt_max"]
+
+
+def load_peers(path):
+    """
+    Read a peer file into {name: (address, port, ipversion)}
+    """
+
+    peers = {}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 2:
+                raise ValueError(f"line {number}: expected 'name address[:port]'")
+            name, spec = fields if len(fields) == 2 else (fields[0], fields[0])
+            if name in peers:
+                raise ValueError(f"line {number}: peer '{name}' listed twice")
+            peers[name] = parse_addr(spec, 20001)
+    if len(peers) < 2:
+        raise ValueError("at least two peers needed")
+    return peers
+
+
+def row_reports(name, interval, row, limit=MESH_REPORT):
+    """
+    Row report datagrams of at most 'limit' bytes, each with a part of the row
+    """
+
+    def report(part):
+        record = {"from": name, "interval": interval, "row": part}
+        return MESH_MAGIC + json.dumps(record, separators=(",", ":")).encode()
+
+    reports = []
+    part = {}
+    size = len(report(part))
+    for peer, cell in row.items():
+        item = len(json.dumps({peer: cell}, separators=(",", ":")))  # the cell and a comma
+        if part and size + item > limit:
+            reports.append(report(part))
+            part = {}
+            size = len(report(part))
+        part[peer] = cell
+        size += item
+    reports.append(report(part))
+    return reports
+
+
+class MeshLink:
+    """
+    Probes towards one peer: sequence number, transmit times and counters per
+    report interval, replies count for the interval their request was sent in
+    """
+
+    def __init__(self, address, capacity):
+        self.address = address
+        self.sseq = 0
+        self.sendtimes = SendTimes(capacity)
+        self.counts = {}  # interval: [sent, received, rtt sum, min, max]
+
+    def sent(self, interval):
+        counts = self.counts.get(interval)
+        if counts is None:
+            counts = self.counts[interval] = [0, 0, 0.0, math.inf, 0.0]
+        counts[0] += 1
+
+    def received(self, interval, rtt):
+        counts = self.counts.get(interval)
+        if counts is None:
+            return  # interval already reported: counts as lost
+        counts[1] += 1
+        counts[2] += rtt
+        counts[3] = min(counts[3], rtt)
+        counts[4] = max(counts[4], rtt)
+
+    def row(self, interval):
+        """
+        Remove and return [sent, received, min, avg, max] (msec) of an interval
+        """
+
+        sent, received, total, low, high = self.counts.pop(interval, (0, 0, 0.0, 0.0, 0.0))
+        if not received:
+            return [sent, 0, None, None, None]
+        return [sent, received, round(low, 3), round(total / received, 3), round(high, 3)]
+
+
+class MeshReflector(ReflectorProtocol):
+    """
+    Reflector of a mesh node, row reports of the peers go to MeshAgent.merge()
+    """
+
+    def __init__(self, agent, config, ipversion=4):
+        ReflectorProtocol.__init__(self, config, ipversion)
+        self.agent = agent
+
+    def datagram_received(self, data, address):
+        if data.startswith(MESH_MAGIC):
+            self.agent.merge(data[len(MESH_MAGIC) :])
+        else:
+            ReflectorProtocol.datagram_received(self, data, address)
+
+
+class MeshAgent(asyncio.DatagramProtocol):
+    """
+    One node of the mesh on the running event loop, the protocol of its probe
+    socket; 'on_matrix' is called with the interval start time and
+    {from: {to: [sent, received, min, avg, max]}}
+    """
+
+    def __init__(self, peers, name, args, on_matrix=None):
+        if name not in peers:
+            raise ValueError(f"'{name}' is not in the peer list")
+        self.name = name
+        self.interval = args.interval / 1000
+        self.report = args.report
+        self.grace = min(1.0, self.report / 4)  # wait for late replies, then for the rows of the peers
+        self.on_matrix = on_matrix
+        self.padding = bytes(args.padding)
+        addr, port, ipversion = peers[name]
+        if args.listen:
+            addr, port, ipversion = parse_addr(args.listen, port)
+        family = socket.AF_INET6 if ipversion == 6 else socket.AF_INET
+
+        # transmit times until a reply can no longer count (its interval is reported)
+        capacity = math.ceil((2 * self.report + self.grace) / self.interval) + 1
+        self.links = {}
+        self.names = {}
+        for peer, (paddr, pport, _) in peers.items():
+            if peer != name:
+                address = socket.getaddrinfo(paddr, pport, family, socket.SOCK_DGRAM)[0][4][:2]
+                self.links[peer] = MeshLink(address, capacity)
+                self.names[address] = peer
+        self.nodes = list(peers)
+        self.rows = {}  # interval: {from: row}
+        self.published = None  # last interval passed to on_matrix
+        self.malformed = collections.Counter()  # replies rejected, by reason
+
+        self.ipversion = ipversion
+        self.config = ReflectorConfig(tos=args.tos, ttl=args.ttl, padding=args.padding)
+        self.sockets = (
+            udp_socket(addr, port, args.tos, args.ttl, False, ipversion),  # reflector
+            udp_socket("", 0, args.tos, args.ttl, False, ipversion),  # probes
+        )
+        for sock in self.sockets:
+            LowLatency(rcvbuf=1 << 20).socket(sock)
+        self.random = random.Random(args.seed if args.seed is not None else name)
+        self.loop = None
+        self.reflector = None
+        self.transport = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        reflector, sender = self.sockets
+        _, self.reflector = await self.loop.create_datagram_endpoint(
+            lambda: MeshReflector(self, self.config, self.ipversion), sock=reflector
+        )
+        await self.loop.create_datagram_endpoint(lambda: self, sock=sender)
+        t = now()
+        self.published = int(t // self.report) - 1
+        first = t + self.random.uniform(0, self.interval)
+        for i, peer in enumerate(self.links):
+            self.call_at(first + i * self.interval / len(self.links), self.probe, peer)
+        self.call_at((t // self.report + 1) * self.report + self.grace, self.share, int(t // self.report))
+
+    def call_at(self, t, callback, *args):
+        # 't' is wall clock time (report intervals are aligned to it)
+        self.loop.call_later(max(0.0, t - now()), self.fire, callback, args)
+
+    def fire(self, callback, args):
+        if not self.transport.is_closing():
+            callback(*args)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def probe(self, peer):
+        link = self.links[peer]
+        t = now()
+        sseq = link.sseq & ALLBITS
+        link.sendtimes.put(sseq, t)
+        self.transport.sendto(encode_request(sseq, t, self.padding), link.address)
+        link.sseq += 1
+        link.sent(int(t // self.report))
+        self.call_at(t + self.interval, self.probe, peer)
+
+    def datagram_received(self, data, address):
+        t4 = now()
+        peer = self.names.get(address[:2])
+        if peer is None:
+            return
+        link = self.links[peer]
+        reply = reply_delays(data, t4, link.sseq, link.sendtimes, self.malformed)
+        if reply:
+            rseq, sseq, t1, t2, t3, delayRT, delayOB, delayIB = reply
+            link.received(int(t1 // self.report), delayRT)
+
+    def error_received(self, exc):
+        log.debug("mesh: %s", exc)  # ICMP unreachable from a peer: unreachable peers count as loss
+
+    def share(self, interval):
+        """
+        Close the own row of an interval and send it to all peers
+        """
+
+        row = {peer: link.row(interval) for peer, link in self.links.items()}
+        self.rows.setdefault(interval, {})[self.name] = row
+        reports = row_reports(self.name, interval, row)
+        for link in self.links.values():
+            for report in reports:
+                self.transport.sendto(report, link.address)
+        self.call_at(now() + self.grace, self.publish, interval)
+        self.call_at((interval + 2) * self.report + self.grace, self.share, interval + 1)
+
+    def merge(self, data):
+        try:
+            report = json.loads(data)
+            node, interval, row = report["from"], int(report["interval"]), dict(report["row"])
+        except (ValueError, KeyError, TypeError):
+            log.debug("mesh: invalid row report")
+            return
+        # peer clocks may be slightly ahead: keep rows of the next interval too
+        if node in self.links and self.published < interval <= now() // self.report + 1:
+            self.rows.setdefault(interval, {}).setdefault(node, {}).update(row)
+
+    def publish(self, interval):
+        rows = self.rows.pop(interval, {})
+        self.published = interval
+        if self.on_matrix:
+            self.on_matrix(interval * self.report, rows)
+
+    def close(self):
+        if self.transport:
+            self.reflector.close()
+            self.transport.close()
+        else:
+            for sock in self.sockets:
+                sock.close()
+
+
+def mesh_records(start, nodes, rows):
+    for node in nodes:
+        for peer, cell in rows.get(node, {}).items():
+            sent, received, low, avg, high = cell
+            loss = 100 * (sent - received) / sent if sent else None
+            yield {
+                "time": start,
+                "from": node,
+                "to": peer,
+                "sent": sent,
+                "received": received,
+                "loss": loss,
+                "rt_min": low,
+                "rt_avg": avg,
+                "rt_max": high,
+            }
+
+
+def print_matrix(start, nodes, rows):
+    width = max(8, *(len(node) for node in nodes)) + 2
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start))
+    print("===============================================================================")
+    print(f"Mesh {stamp}: {len(rows)} of {len(nodes)} nodes reported, avg RTT msec / loss %")
+    print("from \\ to".ljust(width) + "".join(f"{node:>15s}" for node in nodes))
+    print("-------------------------------------------------------------------------------")
+    for node in nodes:
+        row = rows.get(node)
+        if row is None:
+            print(node.ljust(width) + "   no report")
+            continue
+        line = node.ljust(width)
+        for peer in nodes:
+            cell = row.get(peer)
+            if peer == node or cell is None:
+                line += f"{'-':>15s}"
+            elif not cell[0]:
+                line += f"{'no probes':>15s}"
+            elif cell[1]:
+                line += f"{cell[3]:8.2f} /{100 * (cell[0] - cell[1]) / cell[0]:5.1f}"
+            else:
+                line += f"{'lost':>8s} /{100.0:5.1f}"
+        print(line)
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+def twampy_mesh(args):
+    try:
+        peers = load_peers(args.peers)
+    except (OSError, ValueError) as e:
+        log.critical("*** %s: %s", args.peers, e)
+        sys.exit(1)
+
+    if args.format == "table":
+
+        def on_matrix(start, rows):
+            print_matrix(start, list(peers), rows)
+
+    else:
+        sink = NdjsonSink("mesh", sys.stdout) if args.format == "ndjson" else CsvSink("mesh", sys.stdout, MESH_FIELDS)
+
+        def on_matrix(start, rows):
+            for record in mesh_records(start, list(peers), rows):
+                sink.write(record)
+            sink.flush()
+
+    try:
+        agent = MeshAgent(peers, args.name, args, on_matrix)
+    except (OSError, ValueError) as e:
+        log.critical("*** mesh: %s", e)
+        sys.exit(1)
+    log.info("mesh: %s probing %d peers every %.0f msec", args.name, len(agent.links), args.interval)
+
+    async def run():
+        await agent.start()
+        try:
+            if args.duration:
+                await asyncio.sleep(args.duration)
+            else:
+                await asyncio.get_running_loop().create_future()  # until Ctrl-C
+        finally:
+            agent.close()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run())
+
+
+#############################################################################
 
 
 def dscpTable():
@@ -875,30 +2918,110 @@ def main():
     group.add_argument("--ttl", metavar="time-to-live", default=64, type=int, help="[1..128]")
     group.add_argument("--padding", metavar="bytes", default=0, type=int, help="IP/UDP mtu value")
     group.add_argument("--do-not-fragment", action="store_true", help="keyword (do-not-fragment)")
+    group.add_argument("--imix", metavar="profile", help="frame sizes: simple, tolly, size:weight,... or CSV file")
+    group.add_argument("--seed", metavar="number", default=0, type=int, help="seed of the IMIX size sequence")
+
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    group = profile_parser.add_argument_group("Profiling options")
+    group.add_argument("--profile", metavar="filename", help="run session under cProfile, write pstats file")
+    group.add_argument("--timers", action="store_true", help="per-stage hot-path timers (printed with stats)")
+
+    lowlat_parser = argparse.ArgumentParser(add_help=False)
+    group = lowlat_parser.add_argument_group("Low-latency options")
+    group.add_argument(
+        "--low-latency", action="store_true", help="profile: 4MB buffers, busy-poll 50, priority 6, no GC"
+    )
+    group.add_argument("--rcvbuf", metavar="bytes", type=int, help="SO_RCVBUF")
+    group.add_argument("--sndbuf", metavar="bytes", type=int, help="SO_SNDBUF")
+    group.add_argument("--busy-poll", metavar="usec", type=int, help="SO_BUSY_POLL (Linux)")
+    group.add_argument("--priority", metavar="[0..6]", type=int, help="SO_PRIORITY (Linux)")
+    group.add_argument(
+        "--cpu", dest="cpus", metavar="list", type=parse_cpus, help="pin session thread, e.g. 2 or 0,2-3"
+    )
+    group.add_argument("--realtime", metavar="priority", type=int, help="SCHED_FIFO priority for the session thread")
+    group.add_argument("--gc", choices=["on", "off", "freeze"], help="garbage collector while the session runs")
+    group.add_argument(
+        "--ring", metavar="packets", type=int, default=16384, help="receive ring between I/O loop and statistics"
+    )
+
+    output_parser = argparse.ArgumentParser(add_help=False)
+    group = output_parser.add_argument_group(
+        "Output options", "FORMAT:PATH with FORMAT ndjson or csv, PATH - for stdout"
+    )
+    group.add_argument("--packets", metavar="format:path", help="per-packet results (or archive:<path>)")
+    group.add_argument("--intervals", metavar="format:path", help="per-interval summaries")
+    group.add_argument("--summary", metavar="format:path", help="final summary")
+    group.add_argument("--report-interval", metavar="seconds", default=10.0, type=float, help="interval length")
+    group.add_argument("--store", metavar="filename", help="SQLite result store (see history)")
+
+    sla_parser = argparse.ArgumentParser(add_help=False)
+    group = sla_parser.add_argument_group("SLA options", "evaluated on the live packet stream")
+    group.add_argument("--sla", metavar="rules", help="thresholds, e.g. rtt>20,jitter>5:3,loss>1 (msec, percent)")
+    group.add_argument("--sla-window", metavar="packets", default=100, type=int, help="sliding window (default: 100)")
+    group.add_argument(
+        "--sla-timeout", metavar="seconds", default=1.0, type=float, help="reply timeout for loss (default: 1)"
+    )
+    group.add_argument("--detect", action="store_true", help="report round-trip delay level shifts (EWMA/CUSUM)")
+    group.add_argument("--events", metavar="format:path", help="breach, clear and change events")
+    group.add_argument("--sla-exit", action="store_true", help="stop on the first breach, exit status 3")
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--version", action="version", version="twampy " + __version__)
 
     subparsers = parser.add_subparsers(help="twampy sub-commands")
 
-    p_responder = subparsers.add_parser("responder", help="TWL responder", parents=[debug_parser, ipopt_parser])
+    p_responder = subparsers.add_parser(
+        "responder", help="TWL responder", parents=[debug_parser, ipopt_parser, profile_parser, lowlat_parser]
+    )
     group = p_responder.add_argument_group("TWL responder options")
     group.add_argument("near_end", nargs="?", metavar="local-ip:port", default=":20001")
     group.add_argument("--timer", metavar="value", default=0, type=int, help="TWL session reset")
+    group.add_argument("--reflect-tos", action="store_true", help="reply with the received TOS, count received DSCP")
+    group = p_responder.add_argument_group("Admission control")
+    group.add_argument("--allow", metavar="prefix", action="append", help="reflect only these sources (repeatable)")
+    group.add_argument("--deny", metavar="prefix", action="append", help="never reflect these sources (repeatable)")
+    group.add_argument("--source-rate", metavar="pps", default=0.0, type=float, help="limit per source address")
+    group.add_argument(
+        "--source-burst", metavar="packets", default=0.0, type=float, help="per source burst (default: 100ms)"
+    )
+    group.add_argument("--max-pps", metavar="pps", default=0.0, type=float, help="limit for all sources")
 
-    p_sender = subparsers.add_parser("sender", help="TWL sender", parents=[debug_parser, ipopt_parser])
+    p_sender = subparsers.add_parser(
+        "sender",
+        help="TWL sender",
+        parents=[debug_parser, ipopt_parser, profile_parser, lowlat_parser, output_parser, sla_parser],
+    )
     group = p_sender.add_argument_group("TWL sender options")
     group.add_argument("far_end", nargs="?", metavar="remote-ip:port", default="127.0.0.1:20001")
     group.add_argument("near_end", nargs="?", metavar="local-ip:port", default=":20000")
-    group.add_argument("-i", "--interval", metavar="msec", default=100, type=int, help="[100,1000]")
+    group.add_argument(
+        "-i",
+        "--interval",
+        metavar="msec",
+        default=100,
+        type=float,
+        help="[100,1000], fractions for high rates (see --burst)",
+    )
     group.add_argument("-c", "--count", metavar="packets", default=100, type=int, help="[1..9999]")
+    group.add_argument("--classes", metavar="dscp,...", help="DSCP per packet, e.g. ef,af41:2,be (see --reflect-tos)")
+    group.add_argument(
+        "--flows", metavar="ports", default=1, type=int, help="spread packets over source ports (ECMP/LAG paths)"
+    )
+    group.add_argument(
+        "--burst", metavar="packets", default=1, type=int, help="requests per system call (sendmmsg, UDP GSO)"
+    )
 
-    p_control = subparsers.add_parser("controller", help="TWAMP controller", parents=[debug_parser, ipopt_parser])
+    p_control = subparsers.add_parser(
+        "controller",
+        help="TWAMP controller",
+        parents=[debug_parser, ipopt_parser, profile_parser, lowlat_parser, output_parser, sla_parser],
+    )
     group = p_control.add_argument_group("TWAMP controller options")
     group.add_argument("far_end", nargs="?", metavar="remote-ip:port", default="127.0.0.1:20001")
     group.add_argument("near_end", nargs="?", metavar="local-ip:port", default=":20000")
     group.add_argument("-i", "--interval", metavar="msec", default=100, type=int, help="[100,1000]")
     group.add_argument("-c", "--count", metavar="packets", default=100, type=int, help="[1..9999]")
+    group.add_argument("--classes", metavar="dscp,...", help="DSCP per packet, e.g. ef,af41:2,be")
 
     p_ctclient = subparsers.add_parser(
         "controlclient", help="TWAMP control client", parents=[debug_parser, ipopt_parser]
@@ -907,15 +3030,196 @@ def main():
     group.add_argument("twl_send", nargs="?", metavar="twamp-sender-ip:port", default="127.0.0.1:20001")
     group.add_argument("twserver", nargs="?", metavar="twamp-server-ip:port", default=":20000")
     group.add_argument("-c", "--count", metavar="packets", default=100, type=int, help="[1..9999]")
+    group.add_argument(
+        "--duration", metavar="seconds", default=0, type=float, help="stop sessions after (default: until Ctrl-C)"
+    )
 
     p_dscptab = subparsers.add_parser("dscptable", help="print DSCP table", parents=[debug_parser])
 
+    p_bench = subparsers.add_parser("benchmark", help="loopback benchmark suite", parents=[debug_parser])
+    group = p_bench.add_argument_group("Benchmark options")
+    group.add_argument(
+        "--only",
+        nargs="+",
+        choices=["codec", "stats", "burst", "reflector", "pacing", "lowlatency"],
+        help="run selected benchmarks only",
+    )
+    group.add_argument("--quick", action="store_true", help="shorter runs (less accurate)")
+    group.add_argument("--loss", metavar="percent", default=1.0, type=float, help="loss tolerated for reflector pps")
+    group.add_argument("-o", "--output", metavar="filename", help="write results as JSON")
+    group.add_argument("--baseline", metavar="filename", help="compare against stored JSON results")
+    group.add_argument("--tolerance", metavar="percent", default=25.0, type=float, help="allowed regression")
+
+    p_loadgen = subparsers.add_parser("loadgen", help="synthetic reflector load generator", parents=[debug_parser])
+    group = p_loadgen.add_argument_group("Load generator options")
+    group.add_argument(
+        "target", nargs="?", metavar="reflector-ip:port", help="reflector to load (default: start one on loopback)"
+    )
+    group.add_argument("--clients", metavar="number", default=1000, type=int, help="concurrent simulated clients")
+    group.add_argument("--pps", metavar="rate", default=10000, type=float, help="aggregate packets per second")
+    group.add_argument("--ramp-to", metavar="rate", default=0, type=float, help="ramp aggregate rate up to this pps")
+    group.add_argument("--processes", metavar="number", default=2, type=int, help="load generating processes")
+    group.add_argument("--duration", metavar="seconds", default=10, type=int, help="test duration")
+    group.add_argument("--lifetime", metavar="seconds", default=5.0, type=float, help="mean client lifetime (0=never)")
+    group.add_argument("--imix", metavar="profile", default="simple", help="frame size profile (see sender --imix)")
+    group.add_argument("--seed", metavar="number", default=1, type=int, help="random seed")
+    group.add_argument("--loss", metavar="percent", default=1.0, type=float, help="drop tolerated for saturation")
+    group.add_argument("--reflector-pid", metavar="pid", type=int, help="sample memory of an external reflector")
+    group.add_argument("--sample", metavar="seconds", default=0.5, type=float, help="memory sample interval")
+    group.add_argument("-o", "--output", metavar="filename", help="write results as JSON")
+
+    p_impair = subparsers.add_parser("impair", help="UDP relay emulating network impairments", parents=[debug_parser])
+    group = p_impair.add_argument_group("Impairment options")
+    group.add_argument("listen", nargs="?", metavar="local-ip:port", default=":30001", help="address senders use")
+    group.add_argument(
+        "target", nargs="?", metavar="reflector-ip:port", default="127.0.0.1:20001", help="where to relay to"
+    )
+    group.add_argument("--delay", metavar="spec", default="0", help="msec: N, uniform:MIN,MAX, normal:MEAN,STDEV, ...")
+    group.add_argument("--loss", metavar="spec", default="0", help="percent: P (random) or ge:P,R[,BAD[,GOOD]]")
+    group.add_argument("--duplicate", metavar="percent", default=0.0, type=float, help="duplicated packets")
+    group.add_argument(
+        "--reorder", metavar="percent", default=0.0, type=float, help="packets held back by --reorder-gap"
+    )
+    group.add_argument(
+        "--reorder-gap", metavar="msec", default=5.0, type=float, help="extra delay of reordered packets"
+    )
+    group.add_argument("--rate", metavar="bps", default=0.0, type=parse_rate, help="rate limit, e.g. 500k or 100M")
+    group.add_argument("--limit", metavar="packets", default=1000, type=int, help="queue limit with --rate")
+    group.add_argument(
+        "--direction", choices=["both", "forward", "reverse"], default="both", help="directions to impair"
+    )
+    group.add_argument("--seed", metavar="number", default=0, type=int, help="random seed (reproducible runs)")
+    group.add_argument("--batch", metavar="packets", default=64, type=int, help="packets read per socket and wakeup")
+    group.add_argument("--duration", metavar="seconds", default=0, type=float, help="stop after (0=until SIGINT)")
+
+    p_pcap = subparsers.add_parser(
+        "pcap", help="analyse TWAMP-light/STAMP packets in a capture", parents=[debug_parser, output_parser]
+    )
+    group = p_pcap.add_argument_group("Capture options")
+    group.add_argument("file", metavar="filename", help="pcap or pcapng file (.gz supported, - for stdin)")
+    group.add_argument(
+        "--port", metavar="number", type=int, action="append", help="reflector UDP port (default: 862 and 20001)"
+    )
+    group.add_argument(
+        "--timeout", metavar="seconds", default=10.0, type=float, help="forget requests without reflection after"
+    )
+
+    p_history = subparsers.add_parser("history", help="query results of a --store database", parents=[debug_parser])
+    group = p_history.add_argument_group("History options")
+    group.add_argument("store", metavar="filename", help="SQLite result store")
+    group.add_argument("--target", metavar="ip[:port]", help="far end (any port if none given)")
+    group.add_argument("--tos", dest="tos_filter", metavar="type-of-service", type=int, help="IP TOS value")
+    group.add_argument("--dscp", dest="tos_filter", metavar="dscp-value", type=parse_dscp, help="as for the sender")
+    group.add_argument("--since", metavar="time", type=parse_time, help="e.g. 2026-10-01, 2026-10-01T12:00 or 7d")
+    group.add_argument("--until", metavar="time", type=parse_time, help="end of the time range")
+    group.add_argument(
+        "--bucket",
+        metavar="size",
+        type=lambda v: HISTORY_BUCKETS.get(v) or int(v),
+        help="aggregate per minute, hour, day, week or seconds",
+    )
+    group.add_argument(
+        "--intervals", dest="by_interval", action="store_true", help="query interval summaries instead of sessions"
+    )
+    group.add_argument("--limit", metavar="number", default=20, type=int, help="latest rows without --bucket")
+    group.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="output format")
+
+    p_archive = subparsers.add_parser("archive", help="read a --packets archive:<path> file", parents=[debug_parser])
+    group = p_archive.add_argument_group("Archive options")
+    group.add_argument("archive", metavar="filename", help="packet archive")
+    group.add_argument("--reflector", metavar="ip", help="packets of this reflector only")
+    group.add_argument("--since", metavar="time", type=parse_time, help="e.g. 2026-10-01, 2026-10-01T12:00 or 7d")
+    group.add_argument("--until", metavar="time", type=parse_time, help="end of the time range")
+    group.add_argument("--packets", action="store_true", help="packet records instead of session statistics")
+    group.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="output format")
+
+    p_campaign = subparsers.add_parser(
+        "campaign", help="run periodic probes from a campaign file", parents=[debug_parser]
+    )
+    group = p_campaign.add_argument_group("Campaign options")
+    group.add_argument("file", metavar="filename", help="campaign file (.toml, .yaml or .json)")
+    group.add_argument("--max-sessions", metavar="number", type=int, help="concurrent sessions (default: unlimited)")
+    group.add_argument(
+        "--max-pps", metavar="rate", type=float, help="aggregate packets per second (default: unlimited)"
+    )
+    group.add_argument("--jitter", metavar="fraction", type=float, help="random start offset per run (default 0.1)")
+    group.add_argument(
+        "--timeout", metavar="seconds", type=float, help="max wait for replies after last packet (default 5)"
+    )
+    group.add_argument("--runs", metavar="number", default=0, type=int, help="stop after this many runs per probe")
+    group.add_argument("--duration", metavar="seconds", default=0, type=float, help="stop after (0=until SIGINT)")
+    group.add_argument("--seed", metavar="number", type=int, help="random seed for start offsets")
+    group.add_argument("--summary", metavar="format:path", help="session summaries (ndjson:<path> or csv:<path>)")
+    group.add_argument("--store", metavar="filename", help="SQLite result store (see history)")
+
+    p_sweep = subparsers.add_parser("sweep", help="find the largest packet size per path", parents=[debug_parser])
+    group = p_sweep.add_argument_group("Sweep options")
+    group.add_argument("targets", nargs="+", metavar="remote-ip:port", help="reflectors (port default 20001)")
+    group.add_argument(
+        "--min-size", metavar="bytes", default=0, type=int, help="smallest IP packet size (default: no padding)"
+    )
+    group.add_argument("--max-size", metavar="bytes", default=1500, type=int, help="largest IP packet size")
+    group.add_argument("--step", metavar="bytes", default=1, type=int, help="size resolution")
+    group.add_argument("--parallel", metavar="sizes", default=8, type=int, help="sizes per round (1=binary search)")
+    group.add_argument("-c", "--count", metavar="packets", default=3, type=int, help="burst per size")
+    group.add_argument("-i", "--interval", metavar="msec", default=10, type=float, help="within a burst")
+    group.add_argument("--timeout", metavar="seconds", default=1.0, type=float, help="max wait for replies")
+    group.add_argument("--max-sessions", metavar="number", default=256, type=int, help="concurrent bursts")
+    group.add_argument("--tos", metavar="type-of-service", default=0x88, type=int, help="IP TOS value")
+    group.add_argument("--dscp", metavar="dscp-value", help="IP DSCP value")
+    group.add_argument("--ttl", metavar="time-to-live", default=64, type=int, help="[1..128]")
+    group.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="output format")
+
+    p_capacity = subparsers.add_parser(
+        "capacity", help="estimate path capacity with packet trains", parents=[debug_parser]
+    )
+    group = p_capacity.add_argument_group("Capacity options")
+    group.add_argument("far_end", nargs="?", metavar="remote-ip:port", default="127.0.0.1:20001")
+    group.add_argument("near_end", nargs="?", metavar="local-ip:port", default=":0")
+    group.add_argument("--size", metavar="bytes", default=1500, type=int, help="IP packet size")
+    group.add_argument("--train", metavar="packets", default=20, type=int, help="packets per train (2=packet pair)")
+    group.add_argument("--trains", metavar="number", default=5, type=int, help="trains per step")
+    group.add_argument("--gap", metavar="msec", default=100, type=float, help="pause between trains")
+    group.add_argument(
+        "--rates", metavar="rate,...", type=parse_rates, help="rate steps, e.g. 10M,50M,100M (default: back-to-back)"
+    )
+    group.add_argument("--loss", metavar="percent", default=1.0, type=float, help="max loss of a step to count")
+    group.add_argument("--tos", metavar="type-of-service", default=0x88, type=int, help="IP TOS value")
+    group.add_argument("--dscp", metavar="dscp-value", help="IP DSCP value")
+    group.add_argument("--ttl", metavar="time-to-live", default=64, type=int, help="[1..128]")
+    group.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="output format")
+
+    p_mesh = subparsers.add_parser("mesh", help="full-mesh agent: probe all peers of a list", parents=[debug_parser])
+    group = p_mesh.add_argument_group("Mesh options")
+    group.add_argument("peers", metavar="peer-file", help="one 'name address[:port]' per line, shared by all nodes")
+    group.add_argument("--name", required=True, help="this node in the peer file")
+    group.add_argument("--listen", metavar="local-ip:port", help="reflector address (default: from the peer file)")
+    group.add_argument("-i", "--interval", metavar="msec", default=1000, type=float, help="between probes per peer")
+    group.add_argument("--report", metavar="seconds", default=10, type=float, help="matrix interval")
+    group.add_argument("--duration", metavar="seconds", default=0, type=float, help="stop after (0=until SIGINT)")
+    group.add_argument("--padding", metavar="bytes", default=0, type=int, help="size of padding bytes")
+    group.add_argument("--seed", metavar="number", type=int, help="random seed for the start offset")
+    group.add_argument("--tos", metavar="type-of-service", default=0x88, type=int, help="IP TOS value")
+    group.add_argument("--dscp", metavar="dscp-value", help="IP DSCP value")
+    group.add_argument("--ttl", metavar="time-to-live", default=64, type=int, help="[1..128]")
+    group.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="output format")
+
     # methods to call
     p_sender.set_defaults(parseop=True, func=twl_sender)
     p_control.set_defaults(parseop=True, func=twamp_controller)
     p_ctclient.set_defaults(parseop=True, func=twamp_ctclient)
     p_responder.set_defaults(parseop=True, func=twl_responder)
     p_dscptab.set_defaults(parseop=False, func=dscpTable)
+    p_bench.set_defaults(parseop=True, func=twampy_benchmark)
+    p_loadgen.set_defaults(parseop=True, func=twampy_loadgen)
+    p_impair.set_defaults(parseop=True, func=twampy_impair)
+    p_pcap.set_defaults(parseop=True, func=twampy_pcap)
+    p_history.set_defaults(parseop=True, func=twampy_history)
+    p_archive.set_defaults(parseop=True, func=twampy_archive)
+    p_campaign.set_defaults(parseop=True, func=twampy_campaign)
+    p_sweep.set_defaults(parseop=True, func=twampy_sweep)
+    p_capacity.set_defaults(parseop=True, func=twampy_capacity)
+    p_mesh.set_defaults(parseop=True, func=twampy_mesh)
 
     #############################################################################
 
@@ -936,9 +3240,12 @@ def main():
     #   logging.WARNING, logging.INFO, logging.DEBUG
     #############################################################################
 
+    # NDJSON/CSV results on stdout: move logging out of the way
+    if options.logfile is sys.stdout and sinks_on_stdout(options):
+        options.logfile = sys.stderr
+
     if options.quiet:
-        with open(os.devnull, "a") as logfile:
-            loghandler = logging.StreamHandler(logfile)
+        loghandler = logging.NullHandler()
         loglevel = logging.NOTSET
     elif options.debug:
         logformat = "%(asctime)s,%(msecs)-3d %(levelname)-8s %(message)s"
@@ -965,12 +3272,76 @@ def main():
 
     #############################################################################
 
-    if options.dscp:
-        if options.dscp in dscpmap:
-            options.tos = dscpmap[options.dscp]
-        else:
+    if getattr(options, "dscp", None):
+        try:
+            options.tos = dscp_tos(options.dscp)
+        except ValueError:
             parser.error(f"Invalid DSCP Value '{options.dscp}'")
 
+    if getattr(options, "imix", None):
+        try:
+            SizeProfile.parse(options.imix)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if getattr(options, "classes", None):
+        try:
+            ClassProfile.parse(options.classes)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if getattr(options, "flows", 1) < 1:
+        parser.error(f"Invalid --flows '{options.flows}' (at least 1 source port)")
+
+    if getattr(options, "burst", 1) < 1:
+        parser.error(f"Invalid --burst '{options.burst}' (at least 1 packet)")
+    if getattr(options, "burst", 1) > 1 and (options.flows > 1 or options.classes):
+        parser.error("--burst sends from one socket with one TOS, not with --flows or --classes")
+
+    if getattr(options, "ring", 1) < 1:
+        parser.error(f"Invalid --ring '{options.ring}' (at least 1 packet)")
+
+    if options.func is twl_responder:
+        try:
+            Admission.fromargs(options)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if options.func is twampy_sweep:
+        if options.step < 1 or options.parallel < 1 or options.count < 1:
+            parser.error("--step, --parallel and --count must be at least 1")
+        if options.min_size > options.max_size:
+            parser.error(f"--min-size {options.min_size} is above --max-size {options.max_size}")
+
+    if options.func is twampy_capacity and (options.train < 2 or options.trains < 1):
+        parser.error("--train must be at least 2 packets and --trains at least 1")
+
+    if options.func is twampy_mesh and (options.interval <= 0 or options.report <= 0 or options.padding < 0):
+        parser.error("--interval and --report must be positive, --padding not negative")
+
+    if options.func is twampy_impair:
+        try:
+            Impairment.parse_delay(options.delay)
+            Impairment.parse_loss(options.loss)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if getattr(options, "sla", None):
+        try:
+            SlaRule.parse(options.sla)
+        except ValueError as e:
+            parser.error(str(e))
+    if getattr(options, "sla_window", 1) < 1 or getattr(options, "sla_timeout", 1) <= 0:
+        parser.error("--sla-window must be at least 1 packet and --sla-timeout positive")
+
+    for kind in ("packets", "intervals", "summary", "events"):
+        spec = getattr(options, kind, None)
+        if kind == "packets" and spec and spec.partition(":")[0] == "archive":
+            if spec.partition(":")[2] in ("", "-"):
+                parser.error(f"Invalid --packets '{spec}' (archive needs a file name)")
+        elif spec and (spec.partition(":")[0] not in ("ndjson", "csv") or not spec.partition(":")[2]):
+            parser.error(f"Invalid --{kind} '{spec}' (expected ndjson:<path> or csv:<path>)")
+
     # Ensure socket options have valid integer values
     if not hasattr(options, "tos") or options.tos is None:
         options.tos = 0x88
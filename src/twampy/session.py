@@ -0,0 +1,3400 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2013-2026 Nokia
+
+"""
+TWAMP-light test sessions: packet codec, session sender and reflector (threads
+and asyncio protocols), statistics and result writers. This is the library API
+(see twampy/__init__.py); the CLI in twampy/__main__.py is built on it.
+"""
+
+import asyncio
+import binascii
+import collections
+import contextlib
+import cProfile
+import csv
+import ctypes
+import dataclasses
+import errno
+import functools
+import gc
+import ipaddress
+import json
+import logging
+import math
+import os
+import queue
+import random
+import select
+import selectors
+import socket
+import sqlite3
+import statistics
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+#############################################################################
+
+if sys.platform == "win32":
+    time0 = time.time() - time.perf_counter()
+
+# Constants to convert between python timestamps and NTP 8B binary format [RFC1305]
+TIMEOFFSET = 2208988800  # Time Difference: 1-JAN-1900 to 1-JAN-1970
+ALLBITS = 0xFFFFFFFF  # To calculate 32bit fraction of the second
+
+# Module-level logger - configured in main()
+log = logging.getLogger("twampy")
+
+
+def now():
+    if sys.platform == "win32":
+        return time.perf_counter() + time0
+    return time.time()
+
+
+def time_ntp2py(data):
+    """
+    Convert NTP 8 byte binary format [RFC1305] to python timestamp
+    """
+
+    ta, tb = struct.unpack("!2I", data)
+    t = ta - TIMEOFFSET + float(tb) / float(ALLBITS)
+    return t
+
+
+def zeros(nbr):
+    return struct.pack(f"!{nbr}B", *[0 for x in range(nbr)])
+
+
+#############################################################################
+# TWAMP-light test packet codec (unauthenticated mode) [RFC5357 4.1.2, 4.2.1]
+#
+#   Sender request:  seq(4) | T1(8) | error estimate(2) | padding
+#   Reflector reply: rseq(4) | T3(8) | error estimate(2) | MBZ(2) | T2(8) |
+#                    sseq(4) | T1(8) | sender error estimate(2) | padding
+
+REQUEST = struct.Struct("!L2IH")
+REQUEST_DECODE = struct.Struct("!L2I")
+REPLY = struct.Struct("!L2I2H2I")
+REPLY_DECODE = struct.Struct("!L2I4x2IL2I")
+REPLY_TRUNCATED = struct.Struct("!L2I4x2IL")
+REQUEST_MIN = 14  # seq, T1, error estimate: echoed in the reply
+REPLY_MIN = 28  # up to sseq, T1 from the local transmit time (see SendTimes)
+REPLY_ECHO = 36  # up to the sender error estimate, with the echoed T1
+
+# socket errors of a single datagram (buffer full, ICMP errors reported on the
+# socket, firewall rejects): counted and skipped, the session goes on
+TRANSIENT_ERRORS = frozenset(
+    getattr(errno, name)
+    for name in (
+        "ENOBUFS",
+        "EAGAIN",
+        "EWOULDBLOCK",
+        "ECONNREFUSED",
+        "ECONNRESET",
+        "EHOSTUNREACH",
+        "ENETUNREACH",
+        "EHOSTDOWN",
+        "ENETDOWN",
+        "EMSGSIZE",
+        "EPERM",
+    )
+    if hasattr(errno, name)
+)
+
+
+def encode_request(seq: int, t1: float, padding: bytes = b"") -> bytes:
+    return REQUEST.pack(seq, int(TIMEOFFSET + t1), int((t1 - int(t1)) * ALLBITS), 0x3FFF) + padding
+
+
+def decode_request(data: bytes) -> tuple[int, float]:
+    sseq, ta, tb = REQUEST_DECODE.unpack_from(data)
+    return sseq, ta - TIMEOFFSET + float(tb) / float(ALLBITS)
+
+
+def encode_reply(rseq: int, t2: float, request: bytes, padding: bytes = b"") -> bytes:
+    sec = int(TIMEOFFSET + t2)  # seconds since 1-JAN-1900
+    msec = int((t2 - int(t2)) * ALLBITS)  # 32bit fraction of the second
+    return REPLY.pack(rseq, sec, msec, 0x001, 0, sec, msec) + request[0:14] + padding
+
+
+def check_request(data: bytes, address: tuple) -> str | None:
+    """
+    Reason a request cannot be reflected, None if it can
+    """
+
+    if len(data) < REQUEST_MIN:
+        return "short"
+    if not address[1]:
+        return "port"  # no reply possible to source port 0
+    return None
+
+
+def decode_reply(data: bytes) -> tuple[int, int, float | None, float, float]:
+    """
+    Returns rseq, sseq, T1, T2, T3 of a reflected test packet (28 bytes minimum),
+    T1 is None if the reply is truncated before the echoed T1 (below 36 bytes)
+    """
+
+    if len(data) < REPLY_ECHO:
+        rseq, t3a, t3b, t2a, t2b, sseq = REPLY_TRUNCATED.unpack_from(data)
+        t1 = None
+    else:
+        rseq, t3a, t3b, t2a, t2b, sseq, t1a, t1b = REPLY_DECODE.unpack_from(data)
+        t1 = t1a - TIMEOFFSET + float(t1b) / float(ALLBITS)
+    t2 = t2a - TIMEOFFSET + float(t2b) / float(ALLBITS)
+    t3 = t3a - TIMEOFFSET + float(t3b) / float(ALLBITS)
+    return rseq, sseq, t1, t2, t3
+
+
+#############################################################################
+# Frame size profiles (IMIX)
+#
+#   Sizes are L2 frame sizes without FCS: padding = size - 56 (IPv4) or
+#   size - 76 (IPv6), see docs/user-guide/usage.md "Packet Sizing".
+
+
+def alias_table(weights):
+    """
+    Vose's alias method: O(n) setup, O(1) weighted sampling
+    """
+
+    n = len(weights)
+    total = float(sum(weights))
+    prob = [w * n / total for w in weights]
+    alias = list(range(n))
+    small = [i for i, p in enumerate(prob) if p < 1]
+    large = [i for i, p in enumerate(prob) if p >= 1]
+    while small and large:
+        s, g = small.pop(), large.pop()
+        alias[s] = g
+        prob[g] += prob[s] - 1
+        (small if prob[g] < 1 else large).append(g)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+class SizeProfile:
+    """
+    Weighted frame size profile with a precomputed, seedable size sequence and
+    pre-built padding buffers: the size of packet sseq is sequence[sseq % length].
+    """
+
+    NAMED = {
+        "simple": [(64, 7), (590, 4), (1514, 1)],  # simple IMIX 7:4:1
+        "tolly": [(64, 55), (78, 5), (576, 17), (1514, 23)],  # Tolly IMIX
+    }
+    LENGTH = 4096
+
+    def __init__(self, weights, ipversion=4, seed=0, padding=None):
+        self.weights = weights
+        self.sizes = [size for size, _ in weights]
+        overhead = 76 if ipversion == 6 else 56
+        if padding is None:
+            padding = {size: max(0, size - overhead) for size in self.sizes}
+        self.padding = {size: bytes(padding[size]) for size in self.sizes}
+
+        if len(weights) == 1:
+            self.sequence = self.sizes
+        else:
+            rng = random.Random(seed)
+            prob, alias = alias_table([weight for _, weight in weights])
+            self.sequence = []
+            for _ in range(self.LENGTH):
+                i = int(len(prob) * rng.random())
+                self.sequence.append(self.sizes[i if rng.random() < prob[i] else alias[i]])
+        self.length = len(self.sequence)
+        self.buffers = [self.padding[size] for size in self.sequence]
+
+    @property
+    def mixed(self):
+        return len(self.sizes) > 1
+
+    @classmethod
+    def fixed(cls, padding, ipversion=4):
+        size = padding + (76 if ipversion == 6 else 56)
+        return cls([(size, 1)], ipversion, padding={size: padding})
+
+    @classmethod
+    def parse(cls, spec, ipversion=4, seed=0):
+        """
+        Profile by name (simple, tolly), as 'size:weight,...' or from a CSV file with size,weight rows
+        """
+
+        if spec in cls.NAMED:
+            return cls(cls.NAMED[spec], ipversion, seed)
+        if os.path.isfile(spec):
+            with open(spec, newline="") as f:
+                rows = [row for row in csv.reader(f) if row and not row[0].startswith("#")]
+            if rows and not rows[0][0].strip().isdigit():
+                rows = rows[1:]  # header
+            pairs = [(row[0], row[1] if len(row) > 1 else "1") for row in rows]
+        else:
+            pairs = [item.partition(":")[::2] for item in spec.split(",")]
+        try:
+            weights = [(int(size), float(weight or 1)) for size, weight in pairs]
+        except ValueError:
+            raise ValueError(f"invalid size profile '{spec}' (name, size:weight,... or CSV file)") from None
+        if not weights or any(size <= 0 or weight <= 0 for size, weight in weights):
+            raise ValueError(f"invalid size profile '{spec}' (sizes and weights must be positive)")
+        return cls(weights, ipversion, seed)
+
+    @classmethod
+    def fromargs(cls, args, ipversion):
+        spec = getattr(args, "imix", None)
+        if spec is None and args.padding == -1:
+            spec = "simple"
+        if spec:
+            return cls.parse(spec, ipversion, getattr(args, "seed", 0) or 0)
+        return cls.fixed(args.padding, ipversion)
+
+    def counts(self, n):
+        """
+        Number of packets per size among sequence numbers 0..n-1
+        """
+
+        cycles, rest = divmod(n, self.length)
+        counts = dict.fromkeys(self.sizes, 0)
+        for idx, size in enumerate(self.sequence):
+            counts[size] += cycles + (1 if idx < rest else 0)
+        return counts
+
+
+dscpmap = {
+    "be": 0,
+    "cp1": 1,
+    "cp2": 2,
+    "cp3": 3,
+    "cp4": 4,
+    "cp5": 5,
+    "cp6": 6,
+    "cp7": 7,
+    "cs1": 8,
+    "cp9": 9,
+    "af11": 10,
+    "cp11": 11,
+    "af12": 12,
+    "cp13": 13,
+    "af13": 14,
+    "cp15": 15,
+    "cs2": 16,
+    "cp17": 17,
+    "af21": 18,
+    "cp19": 19,
+    "af22": 20,
+    "cp21": 21,
+    "af23": 22,
+    "cp23": 23,
+    "cs3": 24,
+    "cp25": 25,
+    "af31": 26,
+    "cp27": 27,
+    "af32": 28,
+    "cp29": 29,
+    "af33": 30,
+    "cp31": 31,
+    "cs4": 32,
+    "cp33": 33,
+    "af41": 34,
+    "cp35": 35,
+    "af42": 36,
+    "cp37": 37,
+    "af43": 38,
+    "cp39": 39,
+    "cs5": 40,
+    "cp41": 41,
+    "cp42": 42,
+    "cp43": 43,
+    "cp44": 44,
+    "cp45": 45,
+    "ef": 46,
+    "cp47": 47,
+    "nc1": 48,
+    "cp49": 49,
+    "cp50": 50,
+    "cp51": 51,
+    "cp52": 52,
+    "cp53": 53,
+    "cp54": 54,
+    "cp55": 55,
+    "nc2": 56,
+    "cp57": 57,
+    "cp58": 58,
+    "cp59": 59,
+    "cp60": 60,
+    "cp61": 61,
+    "cp62": 62,
+    "cp63": 63,
+}
+
+
+def dscp_tos(value):
+    """
+    TOS byte / traffic class for a DSCP name (ef, af41, ...) or number 0..63:
+    DSCP in the upper six bits, ECN bits zero
+    """
+
+    dscp = dscpmap[value] if value in dscpmap else int(value)
+    if not 0 <= dscp <= 63:
+        raise ValueError(f"invalid DSCP value '{value}'")
+    return dscp << 2
+
+
+class ClassProfile:
+    """
+    DSCP classes mixed per packet by smooth weighted round-robin: packet sseq is
+    sent with TOS byte tos[sseq % length] and belongs to class names[sseq % length]
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.classes = {name: dscp_tos(dscp) for name, dscp, _ in weights}
+        total = sum(weight for _, _, weight in weights)
+        current = [0] * len(weights)
+        self.names = []
+        for _ in range(total):
+            for i, (_, _, weight) in enumerate(weights):
+                current[i] += weight
+            pick = current.index(max(current))
+            current[pick] -= total
+            self.names.append(weights[pick][0])
+        self.tos = [self.classes[name] for name in self.names]
+        self.length = len(self.names)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Classes as 'dscp[:weight],...', dscp by name (ef, af41, ...) or number
+        """
+
+        weights = []
+        for item in spec.split(","):
+            name, _, weight = item.strip().lower().partition(":")
+            try:
+                dscp = dscpmap[name] if name in dscpmap else int(name)
+                weight = int(weight or 1)
+            except ValueError:
+                raise ValueError(f"invalid classes '{spec}' (dscp[:weight],... e.g. ef,af41:2,be)") from None
+            if not 0 <= dscp <= 63 or weight < 1:
+                raise ValueError(f"invalid classes '{spec}' (DSCP 0..63, weights at least 1)")
+            if any(name == other for other, _, _ in weights):
+                raise ValueError(f"invalid classes '{spec}' ({name} given twice)")
+            weights.append((name, dscp, weight))
+        return cls(weights)
+
+    def counts(self, n):
+        """
+        Number of packets per class among sequence numbers 0..n-1
+        """
+
+        cycles, rest = divmod(n, self.length)
+        counts = dict.fromkeys(self.classes, 0)
+        for idx, name in enumerate(self.names):
+            counts[name] += cycles + (1 if idx < rest else 0)
+        return counts
+
+
+def dp(ms):
+    if abs(ms) > 60000:
+        return f"{float(ms / 60000):7.1f}min"
+    if abs(ms) > 10000:
+        return f"{float(ms / 1000):7.1f}sec"
+    if abs(ms) > 1000:
+        return f"{float(ms / 1000):7.2f}sec"
+    if abs(ms) > 1:
+        return f"{ms:8.2f}ms"
+    return f"{int(ms * 1000):8d}us"
+
+
+def parse_addr(addr, default_port=20000):
+    if addr == "":
+        # no address given (default: localhost IPv4 or IPv6)
+        return "", default_port, 0
+    elif "]:" in addr:
+        # IPv6 address with port
+        ip, port = addr.rsplit(":", 1)
+        return ip.strip("[]"), int(port), 6
+    elif "]" in addr:
+        # IPv6 address without port
+        return addr.strip("[]"), default_port, 6
+    elif addr.count(":") > 1:
+        # IPv6 address without port
+        return addr, default_port, 6
+    elif ":" in addr:
+        # IPv4 address with port
+        ip, port = addr.split(":")
+        return ip, int(port), 4
+    else:
+        # IPv4 address without port
+        return addr, default_port, 4
+
+
+#############################################################################
+
+TOS_CMSG = ((socket.IPPROTO_IP, socket.IP_TOS), (socket.IPPROTO_IPV6, socket.IPV6_TCLASS))
+
+
+def udp_socket(addr, port, tos, ttl, df, ipversion=4):
+    """
+    Bound UDP socket with TOS/traffic class, TTL/hop limit and (IPv4) do-not-fragment.
+    No SO_REUSEADDR for port 0: Linux may then hand out one ephemeral port to
+    several sockets, and replies end up in the wrong session.
+    """
+
+    if ipversion == 6:
+        log.debug("bind6(addr=%s, port=%d, tos=%d, ttl=%d)", addr, port, tos, ttl)
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_TCLASS, tos)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+        if port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((addr, port))
+        return sock
+
+    log.debug("bind(addr=%s, port=%d, tos=%d, ttl=%d)", addr, port, tos, ttl)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    if port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((addr, port))
+    # Set TTL and TOS after binding (required for Windows compatibility)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, tos)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+    if df:
+        if sys.platform == "linux":
+            sock.setsockopt(socket.SOL_IP, 10, 2)
+        elif sys.platform == "win32":
+            # Windows: SOL_IP+14 (IP_DONTFRAGMENT) can raise WSAEINVAL (10022).
+            # Use IPPROTO_IP + IPV6_DONTFRAG; it works for IPv4 UDP on Windows.
+            opt = getattr(socket, "IPV6_DONTFRAG", 14)
+            sock.setsockopt(socket.IPPROTO_IP, opt, 1)
+        elif sys.platform == "darwin":
+            log.error("do-not-fragment can not be set on darwin")
+        else:
+            log.error("unsupported OS, ignore do-not-fragment option")
+    else:
+        if sys.platform == "linux":
+            sock.setsockopt(socket.SOL_IP, 10, 0)
+    return sock
+
+
+class UdpSession(threading.Thread):
+    def __init__(self, addr="", port=20000, tos=0, ttl=64, do_not_fragment=False, ipversion=4):
+        threading.Thread.__init__(self)
+        if ipversion == 6:
+            self.bind6(addr, port, tos, ttl)
+        else:
+            self.bind(addr, port, tos, ttl, do_not_fragment)
+        self.sockets = [self.socket]  # more than one for source port spreading, see TwampySessionSender
+        self.running = True
+        self.drops = 0
+        self.malformed = collections.Counter()  # datagrams rejected by validation, per reason
+        self.errors = collections.Counter()  # transient socket errors, per errno name
+        self._overflow = {}  # SO_RXQ_OVFL counter per socket
+        self.ipversion = ipversion
+        self.last_tos = 0  # TOS/traffic class of the last datagram received, see watch_tos()
+        self._ancsize = 0
+        self._cmsgs = {}
+
+    def bind(self, addr, port, tos, ttl, df):
+        self.socket = udp_socket(addr, port, tos, ttl, df, 4)
+
+    def bind6(self, addr, port, tos, ttl):
+        self.socket = udp_socket(addr, port, tos, ttl, False, 6)
+        log.info("Wait to receive test packets on [%s]:%d", addr, port)
+
+    def sendto(self, data, address, sock=None):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("transmit: %s", binascii.hexlify(data))
+        (sock or self.socket).sendto(data, address)
+
+    def sendto_tos(self, data, address, tos, sock=None):
+        """
+        Send with a per-packet TOS (IPv4) or traffic class (IPv6) as ancillary data,
+        or by changing the socket option where sendmsg() is not available
+        """
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("transmit: %s tos=%d", binascii.hexlify(data), tos)
+        cmsg = self._cmsgs.get(tos)
+        if cmsg is None:
+            level, kind = (
+                (socket.IPPROTO_IPV6, socket.IPV6_TCLASS) if self.ipversion == 6 else (socket.IPPROTO_IP, socket.IP_TOS)
+            )
+            cmsg = self._cmsgs[tos] = [(level, kind, struct.pack("i", tos))]
+        sock = sock or self.socket
+        if hasattr(sock, "sendmsg"):
+            sock.sendmsg([data], cmsg, 0, address)
+        else:
+            level, kind, _ = cmsg[0]
+            sock.setsockopt(level, kind, tos)
+            sock.sendto(data, address)
+
+    def recvfrom(self, sock=None):
+        data, address = (sock or self.socket).recvfrom(9216)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("received: %s", binascii.hexlify(data))
+        return data, address
+
+    def transient(self, error):
+        """
+        Count a socket error that only affects one datagram (True); False if it is fatal
+        """
+
+        if error.errno not in TRANSIENT_ERRORS:
+            return False
+        self.errors[errno.errorcode[error.errno]] += 1
+        return True
+
+    def watch_tos(self):
+        """
+        Record the TOS/traffic class of received datagrams in last_tos (IP_RECVTOS, IPV6_RECVTCLASS)
+        """
+
+        try:
+            for sock in self.sockets:
+                if self.ipversion == 6:
+                    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_RECVTCLASS, 1)
+                else:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_RECVTOS, 1)
+        except (OSError, AttributeError) as e:
+            log.warning("received TOS not available: %s", e)
+            return False
+        self._ancsize += socket.CMSG_SPACE(4)
+        self.recvfrom = self._recvmsg
+        return True
+
+    def watch_drops(self):
+        """
+        Track datagrams dropped by the kernel on this socket (Linux SO_RXQ_OVFL)
+        """
+
+        if sys.platform != "linux":
+            return
+        try:
+            for sock in self.sockets:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except OSError as e:
+            log.debug("SO_RXQ_OVFL not available: %s", e)
+            return
+        self._ancsize += socket.CMSG_SPACE(4)
+        self.recvfrom = self._recvmsg
+
+    def _recvmsg(self, sock=None):
+        sock = sock or self.socket
+        data, ancdata, flags, address = sock.recvmsg(9216, self._ancsize)
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                # cumulative counter per socket, only attached once non-zero
+                overflow = struct.unpack("I", value[:4])[0]
+                self.drops += overflow - self._overflow.get(sock, 0)
+                self._overflow[sock] = overflow
+            elif (level, kind) in TOS_CMSG:
+                # IP_TOS: one byte, IPV6_TCLASS: int
+                self.last_tos = value[0] if len(value) == 1 else struct.unpack("i", value[:4])[0]
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("received: %s", binascii.hexlify(data))
+        return data, address
+
+    def tune(self, args):
+        """
+        Apply the low-latency profile (if any) to the socket and to run()
+        """
+
+        self.tuning = LowLatency.fromargs(args)
+        if self.tuning:
+            for sock in self.sockets:
+                self.tuning.socket(sock)
+            self.run = self.tuning.wrap(self.run)
+
+    @property
+    def local_address(self):
+        return self.socket.getsockname()
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            log.info("SIGINT received: Stop TWL session reflector")
+        else:
+            log.info("Stop TWL session")
+        self.running = False
+        # wakes up a blocking recvfrom(), but raises ENOTCONN for unconnected UDP on Linux
+        with contextlib.suppress(OSError):
+            self.socket.shutdown(socket.SHUT_RDWR)
+        self.socket.close()
+
+
+@dataclasses.dataclass
+class DirectionResult:
+    """
+    Delay statistics of one direction, values in milliseconds, loss in percent
+    """
+
+    min: float
+    max: float
+    avg: float
+    jitter: float
+    loss: float | None  # None for per-size results (round-trip loss only)
+
+
+@dataclasses.dataclass
+class SessionResult:
+    """
+    Structured result of a test session (directions are None at 100% loss)
+    """
+
+    sent: int
+    received: int
+    outbound: DirectionResult | None = None
+    inbound: DirectionResult | None = None
+    roundtrip: DirectionResult | None = None
+    sizes: dict[int, "SessionResult"] = dataclasses.field(default_factory=dict)  # by frame size (IMIX)
+    classes: dict[str, "SessionResult"] = dataclasses.field(default_factory=dict)  # by DSCP class (--classes)
+    remarked: int = 0  # replies not carrying the DSCP they were sent with (--classes)
+    flows: dict[int, "SessionResult"] = dataclasses.field(default_factory=dict)  # by source port (--flows)
+    unattributed: int = 0  # requests lost on flows without any reply, direction unknown (--flows)
+    malformed: dict[str, int] = dataclasses.field(default_factory=dict)  # replies rejected, by reason
+    echo_mismatch: int = 0  # replies whose echoed T1 differs from the local transmit time
+    expired: int = 0  # replies older than the transmit time table, delays from the echoed T1
+    truncated: int = 0  # replies cut before the echoed T1 (28-35 bytes), delays from the local transmit time
+    socket_errors: dict[str, int] = dataclasses.field(default_factory=dict)  # transient, by errno name
+    socket_drops: int = 0  # replies dropped by the local kernel (receive buffer full)
+    ring_overflow: int = 0  # replies dropped by twampy (statistics thread too slow)
+
+    def asdict(self):
+        return dataclasses.asdict(self)
+
+
+class LowLatency:
+    """
+    Low-latency run profile: socket buffers, busy polling, socket priority, CPU pinning,
+    real-time scheduling and GC control. Records which settings actually applied.
+    """
+
+    PROFILE = {"rcvbuf": 4 << 20, "sndbuf": 4 << 20, "busy_poll": 50, "priority": 6, "gc": "off"}
+
+    def __init__(self, rcvbuf=None, sndbuf=None, busy_poll=None, priority=None, cpus=None, realtime=None, gc="on"):
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.busy_poll = busy_poll
+        self.priority = priority
+        self.cpus = cpus
+        self.realtime = realtime
+        self.gc = gc
+        self.report = []  # (setting, requested, applied)
+
+    @classmethod
+    def fromargs(cls, args):
+        """
+        LowLatency from --low-latency and the individual options (None if nothing requested)
+        """
+
+        settings = dict(cls.PROFILE) if getattr(args, "low_latency", False) else {"gc": "on"}
+        for name in ("rcvbuf", "sndbuf", "busy_poll", "priority", "cpus", "realtime", "gc"):
+            value = getattr(args, name, None)
+            if value is not None:
+                settings[name] = value
+        if len(settings) == 1 and settings["gc"] == "on":
+            return None
+        return cls(**settings)
+
+    def _record(self, setting, requested, applied):
+        self.report.append((setting, requested, applied))
+        if str(applied).startswith(("failed", "not supported")):
+            log.warning("low-latency: %s=%s %s", setting, requested, applied)
+
+    def _setsockopt(self, sock, setting, level, option, value, force=None):
+        try:
+            sock.setsockopt(level, option, value)
+            actual = sock.getsockopt(level, option)
+            if force is not None and actual < value:
+                # above net.core.[rw]mem_max: *BUFFORCE works with CAP_NET_ADMIN
+                with contextlib.suppress(OSError):
+                    sock.setsockopt(level, force, value)
+                    actual = sock.getsockopt(level, option)
+            note = " (capped by sysctl net.core.*mem_max)" if force is not None and actual < value else ""
+            self._record(setting, value, f"{actual}{note}")
+        except OSError as e:
+            self._record(setting, value, f"failed: {e}")
+
+    def socket(self, sock):
+        linux = sys.platform == "linux"
+        if self.rcvbuf:
+            self._setsockopt(sock, "SO_RCVBUF", socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf, 33 if linux else None)
+        if self.sndbuf:
+            self._setsockopt(sock, "SO_SNDBUF", socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf, 32 if linux else None)
+        if self.busy_poll is not None:
+            if linux:
+                self._setsockopt(sock, "SO_BUSY_POLL", socket.SOL_SOCKET, 46, self.busy_poll)
+            else:
+                self._record("SO_BUSY_POLL", self.busy_poll, f"not supported on {sys.platform}")
+        if self.priority is not None:
+            if linux:
+                self._setsockopt(sock, "SO_PRIORITY", socket.SOL_SOCKET, 12, self.priority)
+            else:
+                self._record("SO_PRIORITY", self.priority, f"not supported on {sys.platform}")
+
+    def wrap(self, run):
+        """
+        Wrap a session run() method: pin/schedule the session thread, control GC while it runs
+        """
+
+        def wrapper():
+            if self.cpus:
+                try:
+                    os.sched_setaffinity(0, self.cpus)
+                    self._record("CPU affinity", format_cpus(self.cpus), format_cpus(os.sched_getaffinity(0)))
+                except (AttributeError, OSError) as e:
+                    self._record("CPU affinity", format_cpus(self.cpus), f"failed: {e}")
+            if self.realtime:
+                try:
+                    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime))
+                    self._record("SCHED_FIFO", self.realtime, os.sched_getparam(0).sched_priority)
+                except (AttributeError, OSError) as e:
+                    self._record("SCHED_FIFO", self.realtime, f"failed: {e}")
+            enabled = gc.isenabled()
+            if self.gc == "off":
+                gc.collect()
+                gc.disable()
+                self._record("GC", self.gc, "disabled while running")
+            elif self.gc == "freeze":
+                gc.collect()
+                gc.freeze()
+                self._record("GC", self.gc, f"{gc.get_freeze_count()} objects frozen while running")
+            try:
+                run()
+            finally:
+                if self.gc == "off" and enabled:
+                    gc.enable()
+                elif self.gc == "freeze":
+                    gc.unfreeze()
+
+        return wrapper
+
+    def dump(self):
+        print("===============================================================================")
+        print("Low-latency setting     Requested     Applied")
+        print("-------------------------------------------------------------------------------")
+        for setting, requested, applied in self.report:
+            print(f"  {setting:20s}  {requested!s:12s}  {applied}")
+        print("===============================================================================")
+        sys.stdout.flush()
+
+
+def parse_cpus(value):
+    """
+    CPU list like '2' or '0,2-3' as set of integers (argparse type)
+    """
+
+    cpus = set()
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpus(cpus):
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+#############################################################################
+
+
+class TwampStatistics:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, delayRT, delayOB, delayIB, rseq, sseq):
+        if self.count == 0:
+            self.minOB = delayOB
+            self.minIB = delayIB
+            self.minRT = delayRT
+
+            self.maxOB = delayOB
+            self.maxIB = delayIB
+            self.maxRT = delayRT
+
+            self.sumOB = delayOB
+            self.sumIB = delayIB
+            self.sumRT = delayRT
+
+            self.lossIB = rseq
+            self.lossOB = sseq - rseq
+
+            self.jitterOB = 0
+            self.jitterIB = 0
+            self.jitterRT = 0
+
+            self.lastOB = delayOB
+            self.lastIB = delayIB
+            self.lastRT = delayRT
+        else:
+            self.minOB = min(self.minOB, delayOB)
+            self.minIB = min(self.minIB, delayIB)
+            self.minRT = min(self.minRT, delayRT)
+
+            self.maxOB = max(self.maxOB, delayOB)
+            self.maxIB = max(self.maxIB, delayIB)
+            self.maxRT = max(self.maxRT, delayRT)
+
+            self.sumOB += delayOB
+            self.sumIB += delayIB
+            self.sumRT += delayRT
+
+            self.lossIB = rseq - self.count
+            self.lossOB = sseq - rseq
+
+            if self.count == 1:
+                self.jitterOB = abs(self.lastOB - delayOB)
+                self.jitterIB = abs(self.lastIB - delayIB)
+                self.jitterRT = abs(self.lastRT - delayRT)
+            else:
+                self.jitterOB = self.jitterOB + (abs(self.lastOB - delayOB) - self.jitterOB) / 16
+                self.jitterIB = self.jitterIB + (abs(self.lastIB - delayIB) - self.jitterIB) / 16
+                self.jitterRT = self.jitterRT + (abs(self.lastRT - delayRT) - self.jitterRT) / 16
+
+            self.lastOB = delayOB
+            self.lastIB = delayIB
+            self.lastRT = delayRT
+
+        self.count += 1
+
+    def result(self, total):
+        result = SessionResult(sent=total, received=self.count)
+        if self.count > 0:
+            self.lossRT = total - self.count
+            result.outbound = DirectionResult(
+                self.minOB, self.maxOB, self.sumOB / self.count, self.jitterOB, 100 * float(self.lossOB) / total
+            )
+            result.inbound = DirectionResult(
+                self.minIB, self.maxIB, self.sumIB / self.count, self.jitterIB, 100 * float(self.lossIB) / total
+            )
+            result.roundtrip = DirectionResult(
+                self.minRT, self.maxRT, self.sumRT / self.count, self.jitterRT, 100 * float(self.lossRT) / total
+            )
+        return result
+
+    def dump(self, total):
+        dump_result(self.result(total))
+
+
+def dump_result(result):
+    print("===============================================================================")
+    print("Direction         Min         Max         Avg          Jitter     Loss")
+    print("-------------------------------------------------------------------------------")
+    if result.received > 0:
+        for name, d in (
+            ("Outbound:", result.outbound),
+            ("Inbound:", result.inbound),
+            ("Roundtrip:", result.roundtrip),
+        ):
+            print(f"  {name:13s}{dp(d.min)}  {dp(d.max)}  {dp(d.avg)}  {dp(d.jitter)}    {d.loss:5.1f}%")
+    else:
+        print("  NO STATS AVAILABLE (100% loss)")
+    print("-------------------------------------------------------------------------------")
+    print("                                                    Jitter Algorithm [RFC1889]")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+class Histogram:
+    """
+    Log-linear histogram (8 buckets per power of two, ~9% resolution) with bounded memory
+    """
+
+    BUCKETS = 8 * 40
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[min(self.BUCKETS - 1, int(math.log2(value + 1) * 8)) if value > 0 else 0] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for idx, count in enumerate(other.counts):
+            self.counts[idx] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0.0
+        rank = pct * self.count / 100
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                # upper bound of the bucket, clipped to the observed range
+                return max(self.min, min(self.max, 2 ** ((idx + 1) / 8) - 1))
+        return self.max
+
+    def todict(self):
+        return {"counts": self.counts, "count": self.count, "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def fromdict(cls, data):
+        hist = cls()
+        hist.counts = list(data["counts"])
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        return hist
+
+
+class StageTimers:
+    """
+    Per-stage hot-path timers, histograms in microseconds
+    """
+
+    STAGES = ("receive", "timestamp", "decode", "stats", "encode", "send")
+
+    def __init__(self):
+        self.hist = {stage: Histogram() for stage in self.STAGES}
+
+    def add(self, stage, start, end):
+        self.hist[stage].add(1e6 * (end - start))
+
+    def dump(self):
+        print("===============================================================================")
+        print("Stage             Count         Min         p50         p99         Max         Avg")
+        print("-------------------------------------------------------------------------------")
+        for stage, hist in self.hist.items():
+            if hist.count:
+                print(
+                    f"  {stage:10s}  {hist.count:9d} {dp(hist.min / 1000)}  {dp(hist.percentile(50) / 1000)}"
+                    f"  {dp(hist.percentile(99) / 1000)}  {dp(hist.max / 1000)}  {dp(hist.total / hist.count / 1000)}"
+                )
+        print("-------------------------------------------------------------------------------")
+        print("                                                      Per-stage hot-path timers")
+        print("===============================================================================")
+        sys.stdout.flush()
+
+
+def profiled(run, filename):
+    """
+    Wrap a session run() method to execute under cProfile and write pstats to filename
+    """
+
+    def wrapper():
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filename)
+            log.info("Profile written to %s", filename)
+
+    return wrapper
+
+
+#############################################################################
+# Streaming SLA evaluation, O(1) per sample
+#
+#   rtt, ob, ib, jitter: means over the last --sla-window replies (jitter: mean
+#                        |RTT difference| of consecutive replies)
+#   loss:                percent of the last --sla-window packets without reply
+#                        --sla-timeout seconds after they were sent
+#   Breaches are raised above the threshold and cleared below the clear level
+#   (hysteresis). The change detector runs a two-sided CUSUM of the round-trip
+#   delay against an EWMA baseline and reports level shifts.
+
+SLA_METRICS = ("rtt", "ob", "ib", "jitter", "loss")
+SLA_FIELDS = ["time", "event", "metric", "value", "threshold", "sseq"]
+SLA_MIN_SAMPLES = 10  # a window is evaluated from this many samples on
+SLA_CLEAR = 0.9  # default clear level, relative to the threshold
+CUSUM_WARMUP = 20  # samples for the baseline after start and after a change
+CUSUM_ALPHA = 0.05  # EWMA weight of the baseline
+CUSUM_K = 0.5  # drift allowance, in standard deviations
+CUSUM_H = 8.0  # decision threshold, in standard deviations
+CUSUM_Z = 4.0  # single samples are capped: a spike alone is no change
+
+
+class SlaRule:
+    """
+    Threshold on one metric with hysteresis: 'metric>raise[:clear]'
+    """
+
+    def __init__(self, metric, threshold, clear=None):
+        self.metric = metric
+        self.threshold = threshold
+        self.clear = threshold * SLA_CLEAR if clear is None else clear
+        self.active = False
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Rules from 'rtt>20,jitter>5:3,loss>1' (msec, loss in percent)
+        """
+
+        rules = []
+        for item in spec.split(","):
+            metric, sep, levels = item.strip().partition(">")
+            if metric not in SLA_METRICS or not sep:
+                raise ValueError(f"invalid SLA rule '{item}' (expected <{'|'.join(SLA_METRICS)}>threshold[:clear])")
+            try:
+                values = [float(value) for value in levels.split(":")]
+            except ValueError:
+                raise ValueError(f"invalid SLA threshold '{item}'") from None
+            if len(values) > 2 or (len(values) == 2 and values[1] > values[0]):
+                raise ValueError(f"invalid SLA rule '{item}' (clear level above the threshold)")
+            rules.append(cls(metric, *values))
+        return rules
+
+
+class SlaMonitor:
+    """
+    Evaluates SLA rules and change detection on live samples; reply() and sent()
+    return the events they caused, as records with SLA_FIELDS. The sender calls
+    them next to TwampStatistics.add() (sent() from its I/O loop, reply() from
+    the ring consumer), so a breach is raised with the packet that caused it.
+    """
+
+    def __init__(self, rules=(), window=100, timeout=1.0, detect=False, on_breach=None):
+        self.lock = threading.Lock()  # sent() and reply() run in different threads
+        self.rules = list(rules)
+        self.window = window
+        self.timeout = timeout
+        self.on_breach = on_breach
+        self.breaches = 0
+        # delay window: last replies and running sums of rtt, ob, ib, |ipdv|
+        self.samples = collections.deque()
+        self.sums = [0.0, 0.0, 0.0, 0.0]
+        self.last = None
+        # loss window: packets waiting for their reply (send order), outcomes of the last ones
+        self.pending = collections.OrderedDict()
+        self.outcomes = collections.deque()
+        self.lost = 0
+        # change detection
+        self.detect = detect
+        self._restart()
+
+    def _restart(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.high = 0.0
+        self.low = 0.0
+
+    def metric(self, name):
+        if name == "loss":
+            return 100 * self.lost / len(self.outcomes) if self.outcomes else None
+        if not self.samples:
+            return None
+        return self.sums[("rtt", "ob", "ib", "jitter").index(name)] / len(self.samples)
+
+    def sent(self, sseq, t1):
+        """
+        A request was sent; packets older than the timeout count as lost
+        """
+
+        pending = self.pending
+        events = []
+        with self.lock:
+            pending[sseq] = t1
+            while pending:
+                first = next(iter(pending))
+                if pending[first] + self.timeout > t1:
+                    break
+                del pending[first]
+                self._outcome(1, t1, first, events)
+        return events
+
+    def reply(self, t4, delayRT, delayOB, delayIB, sseq):
+        """
+        A reply arrived (delays in msec)
+        """
+
+        events = []
+        with self.lock:
+            self._reply(t4, delayRT, delayOB, delayIB, sseq, events)
+        return events
+
+    def _reply(self, t4, delayRT, delayOB, delayIB, sseq, events):
+        if self.pending.pop(sseq, None) is not None:
+            self._outcome(0, t4, sseq, events)
+
+        ipdv = abs(delayRT - self.last) if self.last is not None else 0.0
+        self.last = delayRT
+        sample = (delayRT, delayOB, delayIB, ipdv)
+        samples, sums = self.samples, self.sums
+        samples.append(sample)
+        for i in range(4):
+            sums[i] += sample[i]
+        if len(samples) > self.window:
+            old = samples.popleft()
+            for i in range(4):
+                sums[i] -= old[i]
+        if len(samples) >= min(self.window, SLA_MIN_SAMPLES):
+            for rule in self.rules:
+                if rule.metric != "loss":
+                    self._evaluate(rule, t4, sseq, events)
+        if self.detect:
+            self._change(delayRT, t4, sseq, events)
+
+    def finish(self, t):
+        """
+        The session ended: packets still without reply are lost
+        """
+
+        events = []
+        with self.lock:
+            while self.pending:
+                sseq, _ = self.pending.popitem(last=False)
+                self._outcome(1, t, sseq, events)
+        return events
+
+    def _outcome(self, lost, t, sseq, events):
+        outcomes = self.outcomes
+        outcomes.append(lost)
+        self.lost += lost
+        if len(outcomes) > self.window:
+            self.lost -= outcomes.popleft()
+        if len(outcomes) >= min(self.window, SLA_MIN_SAMPLES):
+            for rule in self.rules:
+                if rule.metric == "loss":
+                    self._evaluate(rule, t, sseq, events)
+
+    def _evaluate(self, rule, t, sseq, events):
+        value = self.metric(rule.metric)
+        if not rule.active and value > rule.threshold:
+            rule.active = True
+            self.breaches += 1
+            self._emit(events, t, "breach", rule.metric, value, rule.threshold, sseq)
+            if self.on_breach:
+                self.on_breach()
+        elif rule.active and value < rule.clear:
+            rule.active = False
+            self._emit(events, t, "clear", rule.metric, value, rule.clear, sseq)
+
+    def _change(self, x, t, sseq, events):
+        if self.count < CUSUM_WARMUP:
+            # baseline: plain mean and variance of the first samples
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.var += (delta * (x - self.mean) - self.var) / self.count
+            return
+        std = max(math.sqrt(self.var), 0.01 * self.mean, 0.001)
+        z = max(-CUSUM_Z, min(CUSUM_Z, (x - self.mean) / std))
+        self.high = max(0.0, self.high + z - CUSUM_K)
+        self.low = max(0.0, self.low - z - CUSUM_K)
+        if self.high > CUSUM_H or self.low > CUSUM_H:
+            event = "change up" if self.high > CUSUM_H else "change down"
+            self._emit(events, t, event, "rtt", x, self.mean, sseq)
+            self._restart()
+            return
+        # the baseline follows the capped sample, spikes do not drag it along
+        delta = z * std
+        self.mean += CUSUM_ALPHA * delta
+        self.var = (1 - CUSUM_ALPHA) * (self.var + CUSUM_ALPHA * delta * delta)
+
+    def _emit(self, events, t, event, metric, value, threshold, sseq):
+        unit = "%" if metric == "loss" else "ms"
+        if event == "breach":
+            log.warning("SLA breach: %s %.3f%s above %.3f%s [sseq=%d]", metric, value, unit, threshold, unit, sseq)
+        elif event == "clear":
+            log.warning("SLA clear: %s %.3f%s below %.3f%s [sseq=%d]", metric, value, unit, threshold, unit, sseq)
+        else:
+            log.warning("SLA %s: rtt %.3fms, baseline %.3fms [sseq=%d]", event, value, threshold, sseq)
+        events.append(
+            {"time": t, "event": event, "metric": metric, "value": value, "threshold": threshold, "sseq": sseq}
+        )
+
+
+#############################################################################
+# Receive ring: the I/O loop only stores what it received, decoding,
+# statistics and logging run in a consumer thread
+
+SO_RXQ_OVFL = 40  # Linux, not exported by the socket module
+
+
+class PacketRing:
+    """
+    Preallocated single-producer/single-consumer ring of received packets.
+
+    The producer stores the first 'header' bytes (copied straight from the datagram
+    by struct.pack_into(), zero-filled if it is shorter), a timestamp, the datagram
+    size, the source address and the received TOS byte into fixed slots; no buffer
+    is allocated per packet. When the consumer falls behind by 'capacity' packets
+    new packets are dropped and counted in 'overflow'. Head and tail are only
+    written by one side each, which is safe under the GIL.
+    """
+
+    def __init__(self, capacity=16384, header=36):
+        self.capacity = 1 << max(0, capacity - 1).bit_length()  # power of two
+        self.mask = self.capacity - 1
+        self.header = header
+        self.data = bytearray(self.capacity * header)
+        self.view = memoryview(self.data)
+        self.slot = struct.Struct(f"{header}s").pack_into
+        self.stamps = array("d", bytes(8 * self.capacity))
+        self.sizes = array("L", [0]) * self.capacity
+        self.sources = [None] * self.capacity
+        self.marks = array("B", bytes(self.capacity))
+        self.head = 0  # written by the producer
+        self.tail = 0  # written by the consumer
+        self.overflow = 0
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def put(self, stamp, data, source, mark=0):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.overflow += 1
+            return False
+        slot = head & self.mask
+        self.slot(self.data, slot * self.header, data)
+        self.stamps[slot] = stamp
+        self.sizes[slot] = len(data)
+        self.sources[slot] = source
+        self.marks[slot] = mark
+        self.head = head + 1
+        if not self.ready.is_set():
+            self.ready.set()
+        return True
+
+    def drain(self, handler):
+        """
+        Call handler(header, stamp, size, source, mark) for all pending packets
+        """
+
+        tail, head = self.tail, self.head
+        while tail != head:
+            slot = tail & self.mask
+            offset = slot * self.header
+            handler(
+                self.view[offset : offset + self.header],
+                self.stamps[slot],
+                self.sizes[slot],
+                self.sources[slot],
+                self.marks[slot],
+            )
+            self.sources[slot] = None
+            tail += 1
+            self.tail = tail
+        return head - tail
+
+
+class RingConsumer(threading.Thread):
+    """
+    Drains a PacketRing into handler() until stopped; stop() returns after the
+    packets still in the ring are processed
+    """
+
+    def __init__(self, ring, handler, name="ring_consumer"):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.ring = ring
+        self.handler = handler
+        self.stopping = False
+
+    def run(self):
+        ring = self.ring
+        while not self.stopping:
+            ring.ready.wait(0.1)
+            ring.ready.clear()
+            ring.drain(self.handler)
+        ring.drain(self.handler)
+
+    def stop(self):
+        self.stopping = True
+        self.ring.ready.set()
+        if self.is_alive():
+            self.join()
+
+
+SEND_TIMES = 65536  # transmit times kept per sender (1 MiB)
+ECHO_TOLERANCE = 1e-6  # seconds, the echoed T1 is a 32.32 NTP timestamp
+
+
+class SendTimes:
+    """
+    Local transmit times of the last 'capacity' requests by sseq, so delays do not
+    depend on the T1 the reflector echoes. Written by the sender loop before a
+    request leaves, read by the statistics thread for its reply.
+    """
+
+    def __init__(self, capacity=SEND_TIMES):
+        self.capacity = max(1, capacity)
+        self.stamps = array("d", bytes(8 * self.capacity))
+        self.seqs = array("q", [-1]) * self.capacity
+        self.mismatched = 0  # echoed T1 differs from the local transmit time
+        self.expired = 0  # slot reused, the echoed T1 is used
+        self.truncated = 0  # no echoed T1 in the reply, the local transmit time is used
+
+    def put(self, sseq, t1):
+        slot = sseq % self.capacity
+        self.stamps[slot] = t1
+        self.seqs[slot] = sseq
+
+    def get(self, sseq):
+        """
+        Transmit time of sseq, None once its slot was reused (or it was never sent)
+        """
+
+        slot = sseq % self.capacity
+        return self.stamps[slot] if self.seqs[slot] == sseq else None
+
+    def match(self, sseq, echoed):
+        """
+        T1 for the delays of a reply with the echoed T1 (None: truncated reply):
+        the local transmit time, or the echo once the slot was reused. None if
+        neither is known.
+        """
+
+        sent = self.get(sseq)
+        if echoed is None:
+            if sent is not None:
+                self.truncated += 1
+        elif sent is None:
+            self.expired += 1
+            return echoed
+        elif abs(echoed - sent) > ECHO_TOLERANCE:
+            # corrupted echo: the local transmit time is authoritative
+            self.mismatched += 1
+        return sent
+
+
+def reply_delays(data, t4, sent, sendtimes, malformed):
+    """
+    Validate and decode a reply to one of the first 'sent' requests of a session:
+    returns rseq, sseq, T1, T2, T3 and the round-trip, outbound and inbound delay
+    (msec) with T1 matched in 'sendtimes', or None if the reply is rejected
+    (counted in 'malformed' by reason). Shared by all senders.
+    """
+
+    if len(data) < REPLY_MIN:
+        malformed["short"] += 1
+        return None
+    rseq, sseq, t1, t2, t3 = decode_reply(data)
+    if sseq >= sent:
+        # not a reply to a request of this session
+        malformed["sseq"] += 1
+        return None
+    t1 = sendtimes.match(sseq, t1)
+    if t1 is None:
+        malformed["short"] += 1  # truncated and too old for the transmit time table
+        return None
+    delayRT = max(0, 1000 * (t4 - t1 + t2 - t3))  # round-trip delay
+    delayOB = max(0, 1000 * (t2 - t1))  # out-bound delay
+    delayIB = max(0, 1000 * (t4 - t3))  # in-bound delay
+    return rseq, sseq, t1, t2, t3, delayRT, delayOB, delayIB
+
+
+#############################################################################
+# Streaming result sinks, written from a background thread
+#
+#   packets:   one record per reflected test packet
+#   intervals: summary every --report-interval seconds
+#   summary:   final session summary
+
+PACKET_FIELDS = ["sseq", "rseq", "t1", "t2", "t3", "t4", "rtt", "outbound", "inbound", "bytes", "reflector"]
+SESSION_FIELDS = ["started", "ended", "far_end", "near_end", "interval", "count"]
+SUMMARY_FIELDS = [
+    f"{d}_{m}" for d in ("rt", "ob", "ib") for m in ("min", "max", "avg", "jitter", "loss")
+]  # delays in msec, loss in percent
+DROP_FIELDS = ["socket_drops", "ring_overflow"]  # local receive path, see PacketRing
+
+
+def flatten_result(result):
+    record = {"sent": result.sent, "received": result.received}
+    for prefix, direction in (("rt", result.roundtrip), ("ob", result.outbound), ("ib", result.inbound)):
+        for field in ("min", "max", "avg", "jitter", "loss"):
+            record[f"{prefix}_{field}"] = getattr(direction, field) if direction else None
+    return record
+
+
+class NdjsonSink:
+    def __init__(self, kind, stream):
+        self.kind = kind
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+
+
+class CsvSink(NdjsonSink):
+    def __init__(self, kind, stream, fieldnames):
+        NdjsonSink.__init__(self, kind, stream)
+        self.writer = csv.DictWriter(stream, fieldnames=fieldnames, extrasaction="ignore")
+        self.header = False
+
+    def write(self, record):
+        if not self.header:
+            self.writer.writeheader()
+            self.header = True
+        self.writer.writerow(record)
+
+
+def open_sink(kind, spec):
+    """
+    Create a sink from 'ndjson:<path>' or 'csv:<path>', path '-' is stdout;
+    packets also to 'archive:<path>' (see ArchiveSink)
+    """
+
+    fmt, _, path = spec.partition(":")
+    if kind == "packets" and fmt == "archive" and path not in ("", "-"):
+        return ArchiveSink(path)
+    if fmt not in ("ndjson", "csv") or not path:
+        raise ValueError(f"invalid output '{spec}' (expected ndjson:<path> or csv:<path>)")
+    # the sink owns (and closes) the file
+    stream = sys.stdout if path == "-" else open(path, "w", newline="" if fmt == "csv" else None)  # noqa: SIM115
+    if fmt == "ndjson":
+        return NdjsonSink(kind, stream)
+    if kind == "packets":
+        return CsvSink(kind, stream, PACKET_FIELDS)
+    if kind == "intervals":
+        return CsvSink(kind, stream, ["start", "end", "sent", "received"] + SUMMARY_FIELDS)
+    if kind == "events":
+        return CsvSink(kind, stream, SLA_FIELDS)
+    return CsvSink(kind, stream, SESSION_FIELDS + ["sent", "received"] + SUMMARY_FIELDS + DROP_FIELDS)
+
+
+#############################################################################
+# Result store (SQLite): sessions with their final summary, plus intervals
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL, ended REAL, probe TEXT, far_end TEXT, near_end TEXT, tos INTEGER, padding INTEGER, imix TEXT,
+    interval REAL, count INTEGER, sent INTEGER, received INTEGER, {summary},
+    socket_drops INTEGER, ring_overflow INTEGER
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    session INTEGER REFERENCES sessions(id), start REAL, end REAL, sent INTEGER, received INTEGER, {summary}
+);
+CREATE INDEX IF NOT EXISTS sessions_far_end ON sessions(far_end, started);
+CREATE INDEX IF NOT EXISTS sessions_tos ON sessions(tos, started);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions(started);
+CREATE INDEX IF NOT EXISTS intervals_session ON intervals(session, start);
+CREATE INDEX IF NOT EXISTS intervals_start ON intervals(start);
+""".format(summary=", ".join(f"{field} REAL" for field in SUMMARY_FIELDS))
+STORE_SESSION = ["started", "ended", "probe", "far_end", "near_end", "tos", "padding", "imix", "interval", "count"]
+STORE_RESULT = ["sent", "received"] + SUMMARY_FIELDS + DROP_FIELDS
+STORE_INTERVAL = ["session", "start", "end", "sent", "received"] + SUMMARY_FIELDS
+
+
+class ResultStore:
+    """
+    SQLite database (WAL mode) of sessions and interval summaries. Rows are collected
+    and written in one transaction per ResultWriter batch.
+    """
+
+    def __init__(self, path):
+        self.name = path
+        # only used by the result writer thread once opened
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(STORE_SCHEMA)
+        self.session = None  # row id of the running session
+        self.intervals = []
+
+    def add(self, kind, record):
+        if kind == "intervals":
+            self.intervals.append(tuple(record.get(f) for f in STORE_INTERVAL[1:]))
+            return
+        # session records come before its intervals, but intervals must keep their session
+        self.commit()
+        if kind == "session" or self.session is None:
+            fields = STORE_SESSION + (STORE_RESULT if kind == "summary" else [])
+            cursor = self.db.execute(
+                f"INSERT INTO sessions ({','.join(fields)}) VALUES ({','.join('?' * len(fields))})",
+                [record.get(f) for f in fields],
+            )
+            self.session = cursor.lastrowid
+        if kind == "summary":
+            fields = ["ended"] + STORE_RESULT
+            self.db.execute(
+                f"UPDATE sessions SET {','.join(f + '=?' for f in fields)} WHERE id=?",
+                [record.get(f) for f in fields] + [self.session],
+            )
+            self.session = None
+
+    def commit(self):
+        if self.intervals:
+            self.db.executemany(
+                f"INSERT INTO intervals VALUES ({','.join('?' * len(STORE_INTERVAL))})",
+                [(self.session,) + row for row in self.intervals],
+            )
+            self.intervals = []
+        self.db.commit()
+
+    def close(self):
+        if self.db:
+            self.commit()
+            self.db.close()
+            self.db = None
+
+
+class StoreSink:
+    """
+    Result writer sink of one record kind, backed by a shared ResultStore
+    """
+
+    def __init__(self, kind, store):
+        self.kind = kind
+        self.store = store
+        self.stream = store  # name for log messages
+
+    def write(self, record):
+        try:
+            self.store.add(self.kind, record)
+        except sqlite3.Error as e:
+            raise OSError(str(e)) from e
+
+    def flush(self):
+        try:
+            self.store.commit()
+        except sqlite3.Error as e:
+            raise OSError(str(e)) from e
+
+    def close(self):
+        self.store.close()
+
+
+def open_store(path):
+    store = ResultStore(path)
+    return [StoreSink(kind, store) for kind in ("session", "intervals", "summary")]
+
+
+#############################################################################
+# Packet archive: compressed columnar per-packet results (--packets archive:<path>)
+#
+#   file:   header, blocks, block index, footer
+#   block:  up to ARCHIVE_BLOCK packets, one zlib stream of varint columns:
+#           sseq, rseq (deltas), t1 (delta of delta), t2-t1, t3-t2, t4-t3 (deltas
+#           to the previous packet), bytes (deltas), reflector (per-block table)
+#   Timestamps are integer nanoseconds, rtt/outbound/inbound are derived again
+#   when reading. The index holds offset and t1 range per block for time range
+#   reads; an archive without index (writer killed) is read block by block.
+
+ARCHIVE_MAGIC = b"TWAMPYA1"
+ARCHIVE_INDEX = b"TWAMPYI1"
+ARCHIVE_BLOCK = 4096  # packets
+ARCHIVE_AGE = 60.0  # seconds, a block is written at the latest after this time
+NS = 1_000_000_000  # int / int division rounds correctly, int / 1e9 does not
+BLOCK_HEADER = struct.Struct("<4sIIIdd")  # magic, packets, length, crc32, t1 min, t1 max
+INDEX_ENTRY = struct.Struct("<QIdd")  # offset, packets, t1 min, t1 max
+INDEX_FOOTER = struct.Struct("<QI8s")  # index offset, blocks, magic
+
+
+def varint_encode(values, out):
+    """
+    Append zigzag varints of signed integers to a bytearray
+    """
+
+    for value in values:
+        value = value << 1 if value >= 0 else (-value << 1) - 1
+        while value > 0x7F:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def varint_decode(data, pos, count):
+    """
+    Decode count zigzag varints from data at pos, return (values, new pos)
+    """
+
+    values = []
+    append = values.append
+    for _ in range(count):
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(value >> 1 if not value & 1 else -(value >> 1) - 1)
+    return values, pos
+
+
+def nanoseconds(t):
+    # t * 1e9 would round to 256ns steps at today's epoch times
+    seconds = int(t)
+    return seconds * NS + round((t - seconds) * 1e9)
+
+
+def delta(values, previous=0):
+    out = []
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def undelta(values, previous=0):
+    out = []
+    for value in values:
+        previous += value
+        out.append(previous)
+    return out
+
+
+class ArchiveSink:
+    """
+    Result writer sink for packet records, appends compressed blocks to an archive
+    """
+
+    def __init__(self, path):
+        self.kind = "packets"
+        self.stream = open(path, "wb")  # noqa: SIM115 (the sink owns the file)
+        self.stream.write(ARCHIVE_MAGIC)
+        self.index = []
+        self.started = None
+        self._clear()
+
+    def _clear(self):
+        self.columns = ([], [], [], [], [], [], [], [])  # sseq, rseq, t1..t4, bytes, reflector
+
+    def write(self, record):
+        sseq, rseq, t1, t2, t3, t4, size, reflector = self.columns
+        sseq.append(record["sseq"])
+        rseq.append(record["rseq"])
+        t1.append(nanoseconds(record["t1"]))
+        t2.append(nanoseconds(record["t2"]))
+        t3.append(nanoseconds(record["t3"]))
+        t4.append(nanoseconds(record["t4"]))
+        size.append(record["bytes"])
+        reflector.append(record["reflector"])
+        if self.started is None:
+            self.started = now()
+        if len(sseq) >= ARCHIVE_BLOCK:
+            self._block()
+
+    def flush(self):
+        if self.started is not None and now() - self.started > ARCHIVE_AGE:
+            self._block()
+        self.stream.flush()
+
+    def close(self):
+        if self.stream.closed:
+            return
+        self._block()
+        offset = self.stream.tell()
+        for entry in self.index:
+            self.stream.write(INDEX_ENTRY.pack(*entry))
+        self.stream.write(INDEX_FOOTER.pack(offset, len(self.index), ARCHIVE_INDEX))
+        self.stream.close()
+
+    def _block(self):
+        sseq, rseq, t1, t2, t3, t4, size, reflector = self.columns
+        if not sseq:
+            return
+        table = list(dict.fromkeys(reflector))
+        names = {name: idx for idx, name in enumerate(table)}
+        payload = bytearray()
+        varint_encode([len(table)], payload)
+        for name in table:
+            encoded = name.encode()
+            varint_encode([len(encoded)], payload)
+            payload += encoded
+        varint_encode(delta(sseq), payload)
+        varint_encode(delta(rseq), payload)
+        varint_encode([t1[0]] + delta(delta(t1[1:], t1[0])), payload)
+        for later, earlier in ((t2, t1), (t3, t2), (t4, t3)):
+            varint_encode(delta([b - a for a, b in zip(earlier, later, strict=True)]), payload)
+        varint_encode(delta(size), payload)
+        varint_encode([names[name] for name in reflector], payload)
+        data = zlib.compress(payload, 6)
+        header = BLOCK_HEADER.pack(b"BLK1", len(sseq), len(data), zlib.crc32(data), min(t1) / NS, max(t1) / NS)
+        self.index.append((self.stream.tell(), len(sseq), min(t1) / NS, max(t1) / NS))
+        self.stream.write(header + data)
+        self.started = None
+        self._clear()
+
+
+class PacketArchive:
+    """
+    Reader of a packet archive: blocks overlapping a t1 range are read and
+    decoded one at a time
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")  # noqa: SIM115 (closed in close())
+        if self.file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            self.file.close()
+            raise ValueError("not a twampy packet archive")
+        self.index = self._index()
+
+    def _index(self):
+        size = self.file.seek(0, os.SEEK_END)
+        if size >= len(ARCHIVE_MAGIC) + INDEX_FOOTER.size:
+            self.file.seek(size - INDEX_FOOTER.size)
+            offset, blocks, magic = INDEX_FOOTER.unpack(self.file.read(INDEX_FOOTER.size))
+            if magic == ARCHIVE_INDEX:
+                self.file.seek(offset)
+                data = self.file.read(blocks * INDEX_ENTRY.size)
+                return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(blocks)]
+        # no index: the writer did not close the archive, scan the complete blocks
+        log.warning("%s: archive has no index (not closed), scanning blocks", self.file.name)
+        index = []
+        offset = len(ARCHIVE_MAGIC)
+        while offset + BLOCK_HEADER.size <= size:
+            self.file.seek(offset)
+            magic, count, length, _, low, high = BLOCK_HEADER.unpack(self.file.read(BLOCK_HEADER.size))
+            if magic != b"BLK1" or offset + BLOCK_HEADER.size + length > size:
+                break
+            index.append((offset, count, low, high))
+            offset += BLOCK_HEADER.size + length
+        return index
+
+    @property
+    def packets(self):
+        return sum(entry[1] for entry in self.index)
+
+    def blocks(self, start=None, end=None):
+        """
+        Decoded blocks with packets sent in [start, end) as column tuples
+        (sseq, rseq, t1, t2, t3, t4, bytes, reflector), timestamps in nanoseconds
+        """
+
+        for offset, _, low, high in self.index:
+            if (start is not None and high < start) or (end is not None and low >= end):
+                continue
+            self.file.seek(offset)
+            magic, count, length, crc, _, _ = BLOCK_HEADER.unpack(self.file.read(BLOCK_HEADER.size))
+            data = self.file.read(length)
+            if magic != b"BLK1" or zlib.crc32(data) != crc:
+                raise ValueError(f"corrupt block at offset {offset}")
+            yield self._decode(zlib.decompress(data), count)
+
+    @staticmethod
+    def _decode(payload, count):
+        (entries,), pos = varint_decode(payload, 0, 1)
+        table = []
+        for _ in range(entries):
+            (length,), pos = varint_decode(payload, pos, 1)
+            table.append(payload[pos : pos + length].decode())
+            pos += length
+        columns = []
+        for _ in range(8):
+            values, pos = varint_decode(payload, pos, count)
+            columns.append(values)
+        sseq, rseq, t1, d2, d3, d4, size, reflector = columns
+        sseq = undelta(sseq)
+        rseq = undelta(rseq)
+        t1 = [t1[0]] + undelta(undelta(t1[1:]), t1[0])
+        t2 = [a + b for a, b in zip(t1, undelta(d2), strict=True)]
+        t3 = [a + b for a, b in zip(t2, undelta(d3), strict=True)]
+        t4 = [a + b for a, b in zip(t3, undelta(d4), strict=True)]
+        return sseq, rseq, t1, t2, t3, t4, undelta(size), [table[idx] for idx in reflector]
+
+    def records(self, start=None, end=None):
+        """
+        Packet records (see PACKET_FIELDS) sent in [start, end)
+        """
+
+        lower = -math.inf if start is None else nanoseconds(start)
+        upper = math.inf if end is None else nanoseconds(end)
+        for columns in self.blocks(start, end):
+            for sseq, rseq, t1, t2, t3, t4, size, reflector in zip(*columns, strict=True):
+                if lower <= t1 < upper:
+                    yield {
+                        "sseq": sseq,
+                        "rseq": rseq,
+                        "t1": t1 / NS,
+                        "t2": t2 / NS,
+                        "t3": t3 / NS,
+                        "t4": t4 / NS,
+                        "rtt": max(0, (t4 - t1 + t2 - t3) / 1e6),
+                        "outbound": max(0, (t2 - t1) / 1e6),
+                        "inbound": max(0, (t4 - t3) / 1e6),
+                        "bytes": size,
+                        "reflector": reflector,
+                    }
+
+    def sessions(self, start=None, end=None, reflector=None):
+        """
+        Statistics per session, streamed from the blocks: a session of a reflector
+        starts again at sseq 0 (as the reflector resets rseq). Returns a list of
+        [started, reflector, TwampStatistics, first sseq, highest sseq].
+        """
+
+        lower = -math.inf if start is None else nanoseconds(start)
+        upper = math.inf if end is None else nanoseconds(end)
+        running = {}
+        sessions = []
+        for columns in self.blocks(start, end):
+            for sseq, rseq, t1, t2, t3, t4, _, source in zip(*columns, strict=True):
+                if not lower <= t1 < upper or (reflector and source != reflector):
+                    continue
+                session = running.get(source)
+                if session is None or sseq == 0:
+                    session = running[source] = [t1 / NS, source, TwampStatistics(), sseq, sseq]
+                    sessions.append(session)
+                delayRT = max(0, (t4 - t1 + t2 - t3) / 1e6)
+                session[2].add(delayRT, max(0, (t2 - t1) / 1e6), max(0, (t4 - t3) / 1e6), rseq, sseq)
+                session[4] = max(session[4], sseq)
+        return sessions
+
+    def close(self):
+        self.file.close()
+
+
+class ResultWriter(threading.Thread):
+    """
+    Formats and writes result records in the background; the packet loop only enqueues
+    tuples and never blocks on file or pipe backpressure (records are dropped and
+    counted when the queue is full). 'sla' is the SlaMonitor the sender feeds
+    directly, its events are queued without ever being dropped.
+    """
+
+    def __init__(self, sinks, interval=10.0, batch=512, maxsize=65536, offline=False, sla=None):
+        threading.Thread.__init__(self, name="result_writer", daemon=True)
+        # offline: records carry their own (capture) time, block instead of dropping
+        # and never close intervals by wall clock
+        self.offline = offline
+        self.sinks = {
+            kind: [s for s in sinks if s.kind == kind]
+            for kind in ("session", "packets", "intervals", "summary", "events")
+        }
+        self.interval = interval if self.sinks["intervals"] else 0
+        self.batch = batch
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.metadata = {}
+        self._tx = 0
+        self._stats = TwampStatistics()
+        self._start = None
+        self._last = None
+        self.sla = sla
+
+    def sent(self, sseq, t1):
+        if self.interval:
+            self._put(("tx", sseq, t1))
+
+    def reply(self, rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, size, address):
+        self._put(("rx", rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, size, address))
+
+    def session(self, **metadata):
+        self.queue.put(("session", metadata))
+
+    def events(self, events):
+        if events:
+            self.queue.put(("events", events))
+
+    def summary(self, result, **metadata):
+        if self.sla:
+            # packets still without reply are lost
+            self.events(self.sla.finish(metadata.get("ended") or now()))
+        self.queue.put(("summary", result, metadata))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.dropped:
+            log.warning("Result writer could not keep up, %d records dropped", self.dropped)
+
+    def _put(self, item):
+        if self.offline:
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, kind, record):
+        for sink in list(self.sinks[kind]):
+            try:
+                sink.write(record)
+            except OSError as e:
+                self._drop_sink(kind, sink, e)
+
+    def _drop_sink(self, kind, sink, error):
+        log.warning("Output %s closed (%s), stop writing %s", getattr(sink.stream, "name", "?"), error, kind)
+        self.sinks[kind].remove(sink)
+        if sink.stream is sys.stdout and isinstance(error, BrokenPipeError):
+            # reader of the pipe went away: discard what is still buffered for stdout
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+
+    def _interval(self, end):
+        result = self._stats.result(max(self._tx, self._stats.count))
+        record = {"start": self._start, "end": end}
+        record.update(flatten_result(result))
+        # interval loss: replies received vs. requests sent within the interval
+        loss = 100 * max(0, self._tx - self._stats.count) / self._tx if self._tx else 0.0
+        for prefix in ("rt", "ob", "ib"):
+            if record[f"{prefix}_loss"] is not None:
+                record[f"{prefix}_loss"] = loss
+        record["sent"] = self._tx
+        self._write("intervals", record)
+        self._start = end
+        self._tx = 0
+        self._stats = TwampStatistics()
+
+    def _advance(self, t):
+        self._last = t
+        if self._start is None:
+            self._start = t
+        while t >= self._start + self.interval:
+            self._interval(self._start + self.interval)
+
+    def _handle(self, item):
+        if item[0] == "rx":
+            _, rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, size, address = item
+            if self.interval:
+                self._advance(t4)
+                self._stats.add(delayRT, delayOB, delayIB, rseq, sseq)
+            if self.sinks["packets"]:
+                self._write(
+                    "packets",
+                    {
+                        "sseq": sseq,
+                        "rseq": rseq,
+                        "t1": t1,
+                        "t2": t2,
+                        "t3": t3,
+                        "t4": t4,
+                        "rtt": delayRT,
+                        "outbound": delayOB,
+                        "inbound": delayIB,
+                        "bytes": size,
+                        "reflector": address,
+                    },
+                )
+        elif item[0] == "tx":
+            if self.interval:
+                self._advance(item[2])
+                self._tx += 1
+        elif item[0] == "events":
+            for event in item[1]:
+                self._write("events", event)
+        elif item[0] == "session":
+            self._write("session", dict(item[1]))
+        elif item[0] == "summary":
+            _, result, metadata = item
+            if self.interval and self._start is not None and (self._tx or self._stats.count):
+                self._interval(self._last if self.offline else now())
+            record = dict(metadata)
+            record.update(flatten_result(result))
+            record.update(socket_drops=result.socket_drops, ring_overflow=result.ring_overflow)
+            self._write("summary", record)
+
+    def run(self):
+        stop = False
+        while not stop:
+            timeout = None
+            if self.interval and self._start is not None and not self.offline:
+                timeout = max(0.01, self._start + self.interval - now())
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    stop = True
+                else:
+                    self._handle(item)
+            if self.interval and self._start is not None and not batch and not self.offline:
+                self._advance(now())
+            for kind, sinks in self.sinks.items():
+                for sink in list(sinks):
+                    try:
+                        sink.flush()
+                    except OSError as e:
+                        self._drop_sink(kind, sink, e)
+        for sinks in self.sinks.values():
+            for sink in sinks:
+                with contextlib.suppress(OSError):
+                    sink.close()
+
+
+def result_writer(args, offline=False):
+    """
+    Build a ResultWriter from --packets/--intervals/--summary/--events options and
+    the --sla monitor (None if unused)
+    """
+
+    sinks = [
+        open_sink(kind, spec)
+        for kind, spec in (
+            ("packets", getattr(args, "packets", None)),
+            ("intervals", getattr(args, "intervals", None)),
+            ("summary", getattr(args, "summary", None)),
+            ("events", getattr(args, "events", None)),
+        )
+        if spec
+    ]
+    if getattr(args, "store", None):
+        sinks += open_store(args.store)
+    sla = None
+    if getattr(args, "sla", None) or getattr(args, "detect", False):
+        sla = SlaMonitor(
+            SlaRule.parse(args.sla) if args.sla else [],
+            window=getattr(args, "sla_window", 100),
+            timeout=getattr(args, "sla_timeout", 1.0),
+            detect=getattr(args, "detect", False),
+            on_breach=getattr(args, "on_breach", None),
+        )
+    if not sinks and not sla:
+        return None
+    return ResultWriter(sinks, interval=getattr(args, "report_interval", 10.0), offline=offline, sla=sla)
+
+
+def dump_sizes(result):
+    print("===============================================================================")
+    print("Frame size     Sent   Rcvd       Min         Max         Avg      Jitter   Loss")
+    print("-------------------------------------------------------------------------------")
+    for size, sized in sorted(result.sizes.items()):
+        rt = sized.roundtrip
+        if rt:
+            print(
+                f"  {size:5d}B  {sized.sent:7d}{sized.received:7d}  {dp(rt.min)}  {dp(rt.max)}  {dp(rt.avg)}"
+                f"  {dp(rt.jitter)} {rt.loss:5.1f}%"
+            )
+        else:
+            print(f"  {size:5d}B  {sized.sent:7d}{sized.received:7d}    NO STATS AVAILABLE (100% loss)")
+    print("-------------------------------------------------------------------------------")
+    print("                                                 Roundtrip delay per frame size")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+def dump_classes(result):
+    print("===============================================================================")
+    print("Class     Sent   Rcvd  Remark       Min         Max         Avg      Jitter   Loss")
+    print("-------------------------------------------------------------------------------")
+    for name, sized in result.classes.items():
+        rt = sized.roundtrip
+        if rt:
+            print(
+                f"  {name:6s}{sized.sent:6d}{sized.received:7d}{sized.remarked:8d}  {dp(rt.min)}  {dp(rt.max)}"
+                f"  {dp(rt.avg)}  {dp(rt.jitter)} {rt.loss:5.1f}%"
+            )
+        else:
+            print(f"  {name:6s}{sized.sent:6d}{sized.received:7d}           NO STATS AVAILABLE (100% loss)")
+    print("-------------------------------------------------------------------------------")
+    print("                  Roundtrip delay per DSCP class (Remark: reply DSCP differs)")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+FLOW_SLOW = 1.25  # average RTT above this factor times the median of the flows
+FLOW_SLOW_MIN = 0.2  # msec, ignore smaller differences (host scheduling noise)
+FLOW_LOSSY = 1.0  # percent loss above the median of the flows
+
+
+def flow_flags(result):
+    """
+    Source ports whose path is slow or lossy compared to the other flows, {port: flag}
+    """
+
+    flows = result.flows
+    avgs = [flow.roundtrip.avg for flow in flows.values() if flow.roundtrip]
+    losses = [100 * (flow.sent - flow.received) / flow.sent for flow in flows.values() if flow.sent]
+    if not losses:
+        return {}
+    median_avg = statistics.median(avgs) if avgs else 0.0
+    median_loss = statistics.median(losses)
+    flags = {}
+    for port, flow in flows.items():
+        flag = []
+        rt = flow.roundtrip
+        if rt and rt.avg > FLOW_SLOW * median_avg and rt.avg - median_avg > FLOW_SLOW_MIN:
+            flag.append("slow")
+        if flow.sent and 100 * (flow.sent - flow.received) / flow.sent > median_loss + FLOW_LOSSY:
+            flag.append("lossy")
+        if flag:
+            flags[port] = ",".join(flag)
+    return flags
+
+
+def dump_flows(result, metadata):
+    flags = flow_flags(result)
+    print("===============================================================================")
+    print(f"Flows udp {metadata['near_end'].rsplit(':', 1)[0]}:<port> -> {metadata['far_end']}")
+    print("Port      Sent   Rcvd       Min         Max         Avg      Jitter   Loss")
+    print("-------------------------------------------------------------------------------")
+    for port, flow in result.flows.items():
+        rt = flow.roundtrip
+        if rt:
+            print(
+                f"  {port:<6d}{flow.sent:6d}{flow.received:7d}  {dp(rt.min)}  {dp(rt.max)}"
+                f"  {dp(rt.avg)}  {dp(rt.jitter)} {rt.loss:5.1f}%  {flags.get(port, '')}"
+            )
+        else:
+            print(
+                f"  {port:<6d}{flow.sent:6d}{flow.received:7d}   NO STATS AVAILABLE (100% loss)  {flags.get(port, '')}"
+            )
+    print("-------------------------------------------------------------------------------")
+    if flags:
+        print(f"  {len(flags)} of {len(result.flows)} hashed paths slow or lossy compared to the median flow")
+    else:
+        print(f"  {len(result.flows)} hashed paths, none slow or lossy compared to the median flow")
+    if result.unattributed:
+        print(f"  {result.unattributed} requests lost on flows without any reply (direction unknown)")
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Burst transmit (--burst): a batch of requests per system call
+#
+#   gso:      one sendmsg() with UDP_SEGMENT, the kernel cuts the buffer into
+#             datagrams of one size (Linux 4.18+, fixed packet size only)
+#   sendmmsg: one sendmmsg() call through ctypes, any sizes (Linux)
+#   sendto:   one sendto() per request (other systems)
+#
+#   Padding is all zeros and written once; per request only the sequence number
+#   and T1 are written into its slot. With gso the kernel cuts the datagrams
+#   apart at once, they share the T1 taken right before the system call. With
+#   sendmmsg the kernel sends one datagram after the other: request i of a
+#   burst gets the time the call starts plus i times the time per datagram,
+#   both predicted from the previous bursts (EWMA), so T1 does not drift by
+#   tens of microseconds over the burst (the first burst shares one T1). With
+#   sendto every request gets the T1 taken right before its own system call.
+#   The remaining spread per mode is measured by 'benchmark --only burst'.
+
+UDP_SEGMENT = 103  # Linux, not exported by the socket module
+GSO_SEGMENTS = 64  # kernel limit of datagrams per UDP_SEGMENT send
+BURST_MODES = ("gso", "sendmmsg", "sendto")
+REQUEST_SEQ = struct.Struct("!L")
+REQUEST_T1 = struct.Struct("!2I")
+SPACING_ALPHA = 0.1  # EWMA weight of the time per datagram of the last sendmmsg() call
+
+
+class Iovec(ctypes.Structure):
+    _fields_ = [("base", ctypes.c_void_p), ("len", ctypes.c_size_t)]
+
+
+class Msghdr(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_void_p),
+        ("namelen", ctypes.c_uint32),
+        ("iov", ctypes.POINTER(Iovec)),
+        ("iovlen", ctypes.c_size_t),
+        ("control", ctypes.c_void_p),
+        ("controllen", ctypes.c_size_t),
+        ("flags", ctypes.c_int),
+    ]
+
+
+class Mmsghdr(ctypes.Structure):
+    _fields_ = [("hdr", Msghdr), ("len", ctypes.c_uint)]
+
+
+@functools.cache
+def libc_sendmmsg():
+    """
+    sendmmsg() of the C library, None where it does not exist
+    """
+
+    if sys.platform != "linux":
+        return None
+    try:
+        func = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]  # struct mmsghdr *
+    func.restype = ctypes.c_int
+    return func
+
+
+def sockaddr(family, address):
+    """
+    struct sockaddr_in/sockaddr_in6 (Linux layout) of an address tuple
+    """
+
+    info = socket.getaddrinfo(address[0], address[1], family, socket.SOCK_DGRAM)[0][4]
+    host = socket.inet_pton(family, info[0].partition("%")[0])
+    if family == socket.AF_INET6:
+        return struct.pack("=H", family) + struct.pack("!HI", info[1], info[2]) + host + struct.pack("=I", info[3])
+    return struct.pack("=H", family) + struct.pack("!H", info[1]) + host + bytes(8)
+
+
+class BurstSender:
+    """
+    Sends requests first..first+count-1 to one address with as few system calls as
+    the mode allows
+    """
+
+    def __init__(self, sock, address, size, profile, mode=None):
+        self.sock = sock
+        self.address = address
+        self.profile = profile
+        if mode is None:
+            mode = "gso" if self.gso_capable(profile) else "sendmmsg" if libc_sendmmsg() else "sendto"
+        self.mode = mode
+        # measured for sendmmsg(): seconds from T1 to the system call (writing the
+        # stamps) and per datagram within the call
+        self.lead = 0.0
+        self.spacing = 0.0
+        self.setup(size)
+
+    @staticmethod
+    def gso_capable(profile):
+        return sys.platform == "linux" and not profile.mixed and hasattr(socket, "SOL_UDP")
+
+    def setup(self, size):
+        self.lengths = [REQUEST.size + len(padding) for padding in self.profile.buffers]
+        step = max(self.lengths)
+        if self.mode == "gso":
+            size = max(1, min(size, GSO_SEGMENTS, 65507 // step))
+            self.buffer = bytearray(size * step)
+            self.cmsg = [(socket.SOL_UDP, UDP_SEGMENT, struct.pack("=H", step))]
+        elif self.mode == "sendmmsg":
+            self.buffer = (ctypes.c_char * (size * step))()
+            name = sockaddr(self.sock.family, self.address)
+            self.name = (ctypes.c_char * len(name)).from_buffer_copy(name)
+            self.iovs = (Iovec * size)()
+            self.msgs = (Mmsghdr * size)()
+            base = ctypes.addressof(self.buffer)
+            for i in range(size):
+                self.iovs[i].base = base + i * step
+                hdr = self.msgs[i].hdr
+                hdr.name = ctypes.addressof(self.name)
+                hdr.namelen = len(name)
+                hdr.iov = ctypes.pointer(self.iovs[i])
+                hdr.iovlen = 1
+            self.sendmmsg = libc_sendmmsg()
+        else:
+            self.buffer = bytearray(size * step)
+        self.view = memoryview(self.buffer).cast("B")
+        for i in range(size):
+            REQUEST.pack_into(self.buffer, i * step, 0, 0, 0, 0x3FFF)
+        self.step = step
+        self.size = size
+
+    def send(self, first, count, sendtimes=None):
+        """
+        Write and send 'count' (at most size) requests; returns the T1 of each (see
+        above for the modes). Raises OSError like sendto().
+        """
+
+        buffer = self.buffer
+        view = self.view
+        step = self.step
+        pack = REQUEST_SEQ.pack_into
+        for i in range(count):
+            pack(buffer, i * step, first + i)
+        if self.mode == "sendto":
+            return self.sendto(first, count, sendtimes)
+        t1 = now()
+        if self.mode == "gso" or not self.spacing:
+            stamps = [t1] * count
+            stamp = REQUEST_T1.pack(int(TIMEOFFSET + t1), int((t1 - int(t1)) * ALLBITS))
+            for offset in range(4, count * step, step):
+                view[offset : offset + 8] = stamp
+        else:
+            spacing = self.spacing
+            start = t1 + self.lead
+            stamps = [start + i * spacing for i in range(count)]
+            pack_t1 = REQUEST_T1.pack_into
+            for i, t in enumerate(stamps):
+                pack_t1(buffer, i * step + 4, int(TIMEOFFSET + t), int((t - int(t)) * ALLBITS))
+        if sendtimes:
+            for i, t in enumerate(stamps):
+                sendtimes.put(first + i, t)
+
+        lengths = self.lengths
+        length = len(lengths)
+        if self.mode == "gso":
+            try:
+                self.sock.sendmsg([view[: count * step]], self.cmsg, 0, self.address)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP):
+                    raise
+                # no UDP_SEGMENT on this kernel or device: nothing was sent, the next
+                # best mode from now on (with a new T1)
+                self.mode = "sendmmsg" if libc_sendmmsg() else "sendto"
+                log.info("UDP GSO not available (%s), using %s", e, self.mode)
+                self.setup(self.size)
+                return self.send(first, count, sendtimes)
+        else:
+            iovs = self.iovs
+            for i in range(count):
+                iovs[i].len = lengths[(first + i) % length]
+            fileno = self.sock.fileno()
+            msgs = ctypes.addressof(self.msgs)
+            done = 0
+            called = now()
+            while done < count:
+                sent = self.sendmmsg(fileno, msgs + done * ctypes.sizeof(Mmsghdr), count - done, 0)
+                if sent < 0:
+                    code = ctypes.get_errno()
+                    raise OSError(code, os.strerror(code))
+                done += sent
+            if count > 1:
+                spacing = (now() - called) / count
+                lead = called - t1
+                if self.spacing:
+                    self.spacing += SPACING_ALPHA * (spacing - self.spacing)
+                    self.lead += SPACING_ALPHA * (lead - self.lead)
+                else:
+                    self.spacing, self.lead = spacing, lead
+        return stamps
+
+    def sendto(self, first, count, sendtimes):
+        """
+        One sendto() per request, each with its own T1
+        """
+
+        view = self.view
+        step = self.step
+        lengths = self.lengths
+        length = len(lengths)
+        sock = self.sock
+        address = self.address
+        stamps = []
+        for i in range(count):
+            offset = i * step
+            t1 = now()
+            REQUEST_T1.pack_into(view, offset + 4, int(TIMEOFFSET + t1), int((t1 - int(t1)) * ALLBITS))
+            if sendtimes:
+                sendtimes.put(first + i, t1)
+            sock.sendto(view[offset : offset + lengths[(first + i) % length]], address)
+            stamps.append(t1)
+        return stamps
+
+
+#############################################################################
+
+# after the last request, wait DRAIN_FACTOR times the longest reply time seen
+# (at least DRAIN_MIN), or DRAIN_TIMEOUT seconds if nothing came back yet
+DRAIN_FACTOR = 4
+DRAIN_MIN = 0.05
+DRAIN_TIMEOUT = 5.0
+
+
+def drain_timeout(wait_max):
+    if not wait_max:
+        return DRAIN_TIMEOUT
+    return max(DRAIN_MIN, DRAIN_FACTOR * wait_max)
+
+
+class TwampySessionSender(UdpSession):
+    def __init__(self, args):
+        # Session Sender / Session Reflector:
+        #   get Address, UDP port, IP version from near_end/far_end attributes
+        sip, spt, sipv = parse_addr(args.near_end, 20000)
+        rip, rpt, ripv = parse_addr(args.far_end, 20001)
+        self.burst = getattr(args, "burst", 1) or 1  # requests per system call, see BurstSender
+        if self.burst > 1 and (getattr(args, "classes", None) or (getattr(args, "flows", 1) or 1) > 1):
+            raise ValueError("burst sends from one socket with one TOS, not with classes or flows")
+
+        ipversion = 6 if (sipv == 6) or (ripv == 6) else 4
+        UdpSession.__init__(self, sip, spt, args.tos, args.ttl, args.do_not_fragment, ipversion)
+        # source port spreading: packet sseq leaves from socket sseq % flows, on consecutive
+        # ports from near_end (ephemeral ports for port 0); each port hashes to its own path
+        flows = getattr(args, "flows", 1) or 1
+        for i in range(1, flows):
+            port = spt + i if spt else 0
+            self.sockets.append(udp_socket(sip, port, args.tos, args.ttl, args.do_not_fragment, ipversion))
+        self.flowstats = [TwampStatistics() for _ in range(flows)] if flows > 1 else None
+        self.flowports = [sock.getsockname()[1] for sock in self.sockets]
+
+        self.remote_addr = rip
+        self.remote_port = rpt
+        self.interval = float(args.interval) / 1000
+        self.count = args.count
+        self.sent = 0
+        self.sendtimes = SendTimes(min(self.count, SEND_TIMES))
+        self.wait_max = 0.0  # longest T4-T1, sizes the drain timeout
+        self.wakeup = None  # socketpair, ends a select() in transmit() early
+        self.stats = TwampStatistics()
+        self.timers = StageTimers() if getattr(args, "timers", False) else None
+        self.writer = getattr(args, "writer", None)
+        self.sla = self.writer.sla if self.writer else None  # fed here, not by the writer thread
+        self.args = args
+        self.tune(args)
+
+        self.profile = SizeProfile.fromargs(args, ipversion)
+        self.sizestats = {size: TwampStatistics() for size in self.profile.sizes} if self.profile.mixed else None
+        spec = getattr(args, "classes", None)
+        self.classes = ClassProfile.parse(spec) if spec else None
+        self.classstats = {name: TwampStatistics() for name in self.classes.classes} if self.classes else None
+        self.remarked = dict.fromkeys(self.classes.classes, 0) if self.classes else None
+        self.ring = PacketRing(getattr(args, "ring", 16384), 36)
+        self.watch_drops()
+        if self.classes:
+            self.watch_tos()
+
+    def process(self, data, t4, size, address, mark=0):
+        """
+        Decode a reply and update statistics and sinks (runs in the ring consumer)
+        """
+
+        timers = self.timers
+        if timers:
+            p0 = time.perf_counter()
+        # the ring slot holds the first 36 bytes, zero-filled after a shorter reply
+        reply = reply_delays(data if size >= REPLY_ECHO else data[:size], t4, self.sent, self.sendtimes, self.malformed)
+        if reply is None:
+            return
+        rseq, sseq, t1, t2, t3, delayRT, delayOB, delayIB = reply
+        if timers:
+            p1 = time.perf_counter()
+            timers.add("decode", p0, p1)
+
+        log.info(
+            "Reply from %s [rseq=%d sseq=%d rtt=%.2fms outbound=%.2fms inbound=%.2fms]",
+            address[0],
+            rseq,
+            sseq,
+            delayRT,
+            delayOB,
+            delayIB,
+        )
+        if self.flowstats:
+            # the reflector counts rseq per source port: use the sequence number within the flow
+            flows = len(self.flowstats)
+            self.flowstats[sseq % flows].add(delayRT, delayOB, delayIB, rseq, sseq // flows)
+        self.stats.add(delayRT, delayOB, delayIB, rseq, sseq)
+        if t4 - t1 > self.wait_max:
+            self.wait_max = t4 - t1
+        if self.sizestats:
+            profile = self.profile
+            self.sizestats[profile.sequence[sseq % profile.length]].add(delayRT, delayOB, delayIB, rseq, sseq)
+        if self.classstats:
+            classes = self.classes
+            name = classes.names[sseq % classes.length]
+            self.classstats[name].add(delayRT, delayOB, delayIB, rseq, sseq)
+            # both are TOS bytes (dscp_tos), the ECN bits may change on the way
+            if (mark ^ classes.tos[sseq % classes.length]) & 0xFC:
+                self.remarked[name] += 1
+        if self.sla:
+            self.writer.events(self.sla.reply(t4, delayRT, delayOB, delayIB, sseq))
+        if self.writer:
+            self.writer.reply(rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, size, address[0])
+        if timers:
+            timers.add("stats", p1, time.perf_counter())
+
+        if sseq + 1 == self.count:
+            log.info("All packets received back")
+            self.running = False
+            self.wake()
+
+    def drain_timeout(self):
+        return drain_timeout(self.wait_max)
+
+    def wake(self):
+        wakeup = self.wakeup
+        if wakeup:
+            with contextlib.suppress(OSError):
+                wakeup[1].send(b"\0")
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            log.info("SIGINT received: Stop TWL session sender")
+        else:
+            log.info("Stop TWL session")
+        self.running = False
+        self.wake()
+
+    def run(self):
+        self.wakeup = socket.socketpair()
+        consumer = RingConsumer(self.ring, self.process, name="sender_stats")
+        consumer.start()
+        try:
+            self.transmit()
+        finally:
+            consumer.stop()
+            wakeup, self.wakeup = self.wakeup, None
+            for sock in wakeup:
+                sock.close()
+            for sock in self.sockets[1:]:
+                sock.close()
+
+    def transmit(self):
+        schedule = last = now()
+        timers = self.timers
+        writer = self.writer
+        sla = self.sla
+        clock = time.perf_counter
+        ring = self.ring
+        buffers = self.profile.buffers
+        length = self.profile.length
+        classes = self.classes
+        sendtimes = self.sendtimes
+        sockets = self.sockets
+        flows = len(sockets)
+        far_end = (self.remote_addr, self.remote_port)
+        burst = BurstSender(sockets[0], far_end, self.burst, self.profile) if self.burst > 1 else None
+        waiting = sockets + [self.wakeup[0]]
+        if flows > 1:
+            # epoll/kqueue: the cost per reply does not grow with the number of flows, waits
+            # select() on the epoll descriptor (epoll_wait() has millisecond timeouts only)
+            selector = selectors.DefaultSelector()
+            for sock in sockets:
+                selector.register(sock, selectors.EVENT_READ)
+            if hasattr(selector, "fileno"):
+                waiting = [selector, self.wakeup[0]]
+
+            def readable():
+                return [key.fileobj for key, _ in selector.select(0)]
+
+        else:
+
+            def readable():
+                return select.select(sockets, [], [], 0)[0]
+
+        idx = 0
+        while self.running:
+            ready = readable()
+            while ready:
+                for sock in ready:
+                    if timers:
+                        p0 = clock()
+                    t4 = now()
+                    if timers:
+                        p1 = clock()
+                        timers.add("timestamp", p0, p1)
+                    try:
+                        data, address = self.recvfrom(sock)
+                    except OSError as e:
+                        if self.transient(e):
+                            continue
+                        raise
+                    if timers:
+                        timers.add("receive", p1, clock())
+                    ring.put(t4, data, address, self.last_tos)
+                ready = readable()
+
+            t1 = now()
+            if (t1 >= schedule) and (idx < self.count) and burst:
+                # a burst of requests per system call, same average rate
+                n = min(burst.size, self.count - idx)
+                schedule = schedule + n * self.interval
+                if timers:
+                    p0 = clock()
+                try:
+                    stamps = burst.send(idx, n, sendtimes)
+                except OSError as e:
+                    # the requests are counted as sent (and lost)
+                    if not self.transient(e):
+                        raise
+                    stamps = [now()] * n
+                if timers:
+                    timers.add("send", p0, clock())
+                if writer:
+                    for i, t1 in enumerate(stamps):
+                        writer.sent(idx + i, t1)
+                        if sla:
+                            writer.events(sla.sent(idx + i, t1))
+                t1 = stamps[-1]
+                log.info("Sent to %s [sseq=%d..%d]", self.remote_addr, idx, idx + n - 1)
+
+                idx = idx + n
+                self.sent = idx
+                if idx == self.count:
+                    last = t1
+                elif schedule > t1:
+                    select.select(waiting, [], [], schedule - t1)
+
+            elif (t1 >= schedule) and (idx < self.count):
+                schedule = schedule + self.interval
+
+                if timers:
+                    p0 = clock()
+                data = encode_request(idx, t1, buffers[idx % length])
+                sendtimes.put(idx, t1)
+                if timers:
+                    p1 = clock()
+                    timers.add("encode", p0, p1)
+
+                sock = sockets[idx % flows]
+                try:
+                    if classes:
+                        self.sendto_tos(data, far_end, classes.tos[idx % classes.length], sock)
+                    else:
+                        self.sendto(data, far_end, sock)
+                except OSError as e:
+                    # the request is counted as sent (and lost)
+                    if not self.transient(e):
+                        raise
+                if timers:
+                    timers.add("send", p1, clock())
+                if writer:
+                    writer.sent(idx, t1)
+                    if sla:
+                        writer.events(sla.sent(idx, t1))
+                log.info("Sent to %s [sseq=%d]", self.remote_addr, idx)
+
+                idx = idx + 1
+                self.sent = idx
+                if idx == self.count:
+                    last = t1
+                elif schedule > t1:
+                    select.select(waiting, [], [], schedule - t1)
+
+            elif idx == self.count:
+                # all sent: wait for replies, process() or stop() ends the wait early
+                remaining = last + self.drain_timeout() - t1
+                if remaining <= 0:
+                    log.info("Receive timeout for last packet (don't wait anymore)")
+                    self.running = False
+                else:
+                    select.select(waiting, [], [], remaining)
+        if flows > 1:
+            selector.close()
+
+    def result(self):
+        result = self.stats.result(self.sent)
+        result.socket_drops = self.drops
+        result.ring_overflow = self.ring.overflow
+        result.malformed = dict(self.malformed)
+        result.socket_errors = dict(self.errors)
+        result.echo_mismatch = self.sendtimes.mismatched
+        result.expired = self.sendtimes.expired
+        result.truncated = self.sendtimes.truncated
+        if self.sizestats:
+            for size, sent in self.profile.counts(self.sent).items():
+                sized = self.sizestats[size].result(sent)
+                for direction in (sized.outbound, sized.inbound):
+                    if direction:
+                        direction.loss = None
+                result.sizes[size] = sized
+        if self.classstats:
+            for name, sent in self.classes.counts(self.sent).items():
+                sized = self.classstats[name].result(sent)
+                for direction in (sized.outbound, sized.inbound):
+                    if direction:
+                        direction.loss = None
+                sized.remarked = self.remarked[name]
+                result.classes[name] = sized
+            result.remarked = sum(self.remarked.values())
+        if self.flowstats:
+            flows = len(self.flowstats)
+            for i, (stats, port) in enumerate(zip(self.flowstats, self.flowports, strict=True)):
+                result.flows[port] = stats.result(self.sent // flows + (i < self.sent % flows))
+            # rseq of the whole session is meaningless: directional loss is the sum over the flows;
+            # a flow without any reply has no rseq at all, its requests count in the round-trip loss only
+            result.unattributed = sum(flow.sent for flow in result.flows.values() if not flow.received)
+            if result.outbound:
+                for direction in ("outbound", "inbound"):
+                    lost = sum(
+                        flow.sent * getattr(flow, direction).loss for flow in result.flows.values() if flow.received
+                    )
+                    getattr(result, direction).loss = lost / self.sent
+        return result
+
+    def metadata(self):
+        return {
+            "far_end": f"{self.remote_addr}:{self.remote_port}",
+            "near_end": "{}:{}".format(*self.local_address[:2]),
+            "interval": self.interval * 1000,
+            "count": self.count,
+            "tos": self.args.tos,
+            "padding": self.args.padding,
+            "imix": getattr(self.args, "imix", None),
+            "classes": getattr(self.args, "classes", None),
+            "flows": len(self.sockets),
+        }
+
+    def dump(self):
+        if self.flowstats:
+            dump_result(self.result())
+        else:
+            self.stats.dump(self.sent)
+        if self.sizestats:
+            dump_sizes(self.result())
+        if self.classstats:
+            dump_classes(self.result())
+        if self.flowstats:
+            dump_flows(self.result(), self.metadata())
+        if self.drops or self.ring.overflow:
+            print(f"Local receive drops: {self.drops} socket buffer, {self.ring.overflow} ring overflow")
+            print("  (included in the loss above, not caused by the network)")
+            print("===============================================================================")
+            sys.stdout.flush()
+        sendtimes = self.sendtimes
+        if sendtimes.mismatched or sendtimes.expired or sendtimes.truncated:
+            print(f"Echoed T1: {sendtimes.mismatched} replies differ from the local transmit time (local time used)")
+            if sendtimes.expired:
+                print(f"  {sendtimes.expired} replies older than the last {sendtimes.capacity} requests (echo used)")
+            if sendtimes.truncated:
+                print(f"  {sendtimes.truncated} replies truncated before the echoed T1 (local time used)")
+            print("===============================================================================")
+            sys.stdout.flush()
+        dump_rejected("replies", self.malformed, self.errors)
+        if self.timers:
+            self.timers.dump()
+        if self.tuning:
+            self.tuning.dump()
+
+
+def dump_rejected(what, malformed, errors):
+    if not malformed and not errors:
+        return
+    if malformed:
+        reasons = ", ".join(f"{count} {reason}" for reason, count in sorted(malformed.items()))
+        print(f"Malformed {what} dropped: {reasons}")
+    if errors:
+        print("Transient socket errors: " + ", ".join(f"{count} {name}" for name, count in sorted(errors.items())))
+    print("===============================================================================")
+    sys.stdout.flush()
+
+
+#############################################################################
+# Reflector admission control
+#
+#   Checked per request before it is decoded. Decisions and token buckets are
+#   kept per source address, so the prefix lookup runs once per new source.
+
+
+class PrefixTrie:
+    """
+    Binary trie of IPv4/IPv6 prefixes; lookup() returns the value of the longest
+    matching prefix. Nodes are [child0, child1, has_value, value].
+    """
+
+    def __init__(self):
+        self.roots = {4: [None, None, False, None], 6: [None, None, False, None]}
+
+    def insert(self, prefix, value):
+        network = ipaddress.ip_network(prefix, strict=False)
+        bits = network.max_prefixlen
+        key = int(network.network_address)
+        node = self.roots[network.version]
+        for i in range(network.prefixlen):
+            bit = (key >> (bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False, None]
+            node = node[bit]
+        node[2] = True
+        node[3] = value
+
+    def lookup(self, address, default=None):
+        address = ipaddress.ip_address(address)
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        bits = address.max_prefixlen
+        key = int(address)
+        node = self.roots[address.version]
+        found = default
+        for i in range(bits + 1):
+            if node[2]:
+                found = node[3]
+            if i == bits:
+                break
+            node = node[(key >> (bits - 1 - i)) & 1]
+            if node is None:
+                break
+        return found
+
+
+class Admission:
+    """
+    Allow/deny prefixes (longest match wins, everything else is allowed unless
+    there is an allow list), a token bucket per source address and a global pps
+    cap. Per source: [tokens, last seen, allowed, admitted, dropped].
+    """
+
+    SOURCES = 65536  # tracked source addresses, idle ones are forgotten first
+    IDLE = 60.0
+
+    def __init__(self, allow=(), deny=(), rate=0.0, burst=0.0, max_pps=0.0):
+        self.acl = PrefixTrie()
+        for prefix in allow:
+            self.acl.insert(prefix, True)
+        for prefix in deny:
+            self.acl.insert(prefix, False)
+        self.default = not allow
+        self.rate = rate
+        self.burst = burst or max(1.0, rate / 10)  # 100ms worth of packets
+        self.max_pps = max_pps
+        self.global_burst = max(1.0, max_pps / 10)
+        self.tokens = self.global_burst
+        self.stamp = 0.0
+        self.sources = {}
+        self.admitted = 0
+        self.forgotten = 0
+        self.dropped = {"denied": 0, "rate": 0, "global": 0}
+
+    @classmethod
+    def fromargs(cls, args):
+        allow = getattr(args, "allow", None) or ()
+        deny = getattr(args, "deny", None) or ()
+        rate = getattr(args, "source_rate", 0.0)
+        max_pps = getattr(args, "max_pps", 0.0)
+        if not (allow or deny or rate or max_pps):
+            return None
+        return cls(allow, deny, rate, getattr(args, "source_burst", 0.0), max_pps)
+
+    def admit(self, source, t):
+        state = self.sources.get(source)
+        if state is None:
+            state = self.track(source, t)
+        if not state[2]:
+            state[1] = t
+            state[4] += 1
+            self.dropped["denied"] += 1
+            return False
+        rate = self.rate
+        if rate:
+            tokens = state[0] + (t - state[1]) * rate
+            if tokens > self.burst:
+                tokens = self.burst
+            state[1] = t
+            if tokens < 1:
+                if not state[4]:
+                    log.warning("admission: %s above %g pps, dropping requests", source, rate)
+                state[0] = tokens
+                state[4] += 1
+                self.dropped["rate"] += 1
+                return False
+            state[0] = tokens - 1
+        else:
+            state[1] = t
+        if self.max_pps:
+            tokens = self.tokens + (t - self.stamp) * self.max_pps
+            if tokens > self.global_burst:
+                tokens = self.global_burst
+            self.stamp = t
+            if tokens < 1:
+                self.tokens = tokens
+                state[4] += 1
+                self.dropped["global"] += 1
+                return False
+            self.tokens = tokens - 1
+        state[3] += 1
+        self.admitted += 1
+        return True
+
+    def track(self, source, t):
+        if len(self.sources) >= self.SOURCES:
+            self.forget(t)
+        try:
+            allowed = self.acl.lookup(source, self.default)
+        except ValueError:
+            allowed = False
+        if not allowed:
+            log.info("admission: %s denied", source)
+        state = self.sources[source] = [self.burst, t, allowed, 0, 0]
+        return state
+
+    def forget(self, t):
+        sources = self.sources
+        idle = [source for source, state in sources.items() if t - state[1] > self.IDLE]
+        if len(idle) < len(sources) // 4:
+            idle = sorted(sources, key=lambda source: sources[source][1])[: len(sources) // 4]
+        for source in idle:
+            del sources[source]
+        self.forgotten += len(idle)
+
+    def dump(self, top=20):
+        print("===============================================================================")
+        print("Source                                      Admitted     Dropped")
+        print("-------------------------------------------------------------------------------")
+        ranked = sorted(self.sources.items(), key=lambda item: (-item[1][4], -item[1][3]))
+        for source, state in ranked[:top]:
+            note = "" if state[2] else "  (denied)"
+            print(f"  {source:40s} {state[3]:10d}  {state[4]:10d}{note}")
+        if len(ranked) > top:
+            print(f"  ... {len(ranked) - top} more sources")
+        print("-------------------------------------------------------------------------------")
+        dropped = ", ".join(f"{count} {reason}" for reason, count in self.dropped.items())
+        print(f"Admitted {self.admitted}, dropped {dropped}")
+        print("===============================================================================")
+        sys.stdout.flush()
+
+
+SESSION_TIMEOUT = 30.0  # seconds without requests, then a sender starts over at rseq 0
+
+
+class SenderIndex:
+    """
+    Reflector sequence numbers (rseq) per sender address: counting from 0 for a
+    new sender, after SESSION_TIMEOUT seconds without its requests and when it
+    starts over at sseq 0. Shared by all reflectors.
+    """
+
+    def __init__(self, timeout=SESSION_TIMEOUT):
+        self.timeout = timeout
+        self.rseq = {}
+        self.expires = {}
+
+    def next(self, address, sseq, t2):
+        """
+        rseq for the reply to request sseq from 'address' received at t2
+        """
+
+        idx = 0
+        if address not in self.rseq:
+            log.info("set rseq:=0     (new remote address/port)")
+        elif self.expires[address] < t2:
+            log.info("reset rseq:=0   (session timeout, %dsec)", self.timeout)
+        elif sseq == 0:
+            log.info("reset rseq:=0   (received sseq==0)")
+        else:
+            idx = self.rseq[address]
+        self.rseq[address] = idx + 1
+        self.expires[address] = t2 + self.timeout
+        return idx
+
+
+class TwampySessionReflector(UdpSession):
+    def __init__(self, args):
+        addr, port, ipversion = parse_addr(args.near_end, 20001)
+        self.profile = SizeProfile.fromargs(args, ipversion)
+
+        UdpSession.__init__(self, addr, port, args.tos, args.ttl, args.do_not_fragment, ipversion)
+        self.timers = StageTimers() if getattr(args, "timers", False) else None
+        self.admission = Admission.fromargs(args)
+        self.tune(args)
+        # requests are only queued for the logging thread if they would be logged
+        self.ring = PacketRing(getattr(args, "ring", 16384), 14) if log.isEnabledFor(logging.INFO) else None
+        self.watch_drops()
+        # reply with the TOS each request arrived with, count requests per received DSCP
+        self.reflect_tos = getattr(args, "reflect_tos", False) and self.watch_tos()
+        self.received_tos = collections.Counter()
+
+    def process(self, data, t2, size, address, mark=0):
+        sseq, t1 = decode_request(data)
+        log.info("Request from %s:%d [sseq=%d outbound=%.2fms]", address[0], address[1], sseq, 1000 * (t2 - t1))
+
+    def dump_tos(self):
+        names = {dscp: name for name, dscp in dscpmap.items()}
+        print("===============================================================================")
+        print("Received DSCP    Requests")
+        print("-------------------------------------------------------------------------------")
+        for dscp, count in sorted(self.received_tos.items()):
+            print(f"  {names.get(dscp, dscp)!s:6s} ({dscp:2d}) {count:10d}")
+        print("===============================================================================")
+        sys.stdout.flush()
+
+    def run(self):
+        consumer = None
+        if self.ring:
+            consumer = RingConsumer(self.ring, self.process, name="reflector_log")
+            consumer.start()
+        try:
+            self.reflect()
+        finally:
+            if consumer:
+                consumer.stop()
+        if self.drops:
+            log.warning("%d requests dropped by the kernel (socket receive buffer)", self.drops)
+        if self.ring and self.ring.overflow:
+            log.warning("%d requests not logged (ring overflow)", self.ring.overflow)
+        if self.admission and any(self.admission.dropped.values()):
+            log.warning("%d requests dropped by admission control", sum(self.admission.dropped.values()))
+        if self.malformed:
+            log.warning("%d malformed requests dropped", sum(self.malformed.values()))
+        if self.errors:
+            log.warning("%d transient socket errors", sum(self.errors.values()))
+        log.info("TWL session reflector stopped")
+
+    def reflect(self):
+        index = SenderIndex()
+        timers = self.timers
+        clock = time.perf_counter
+        buffers = self.profile.buffers
+        length = self.profile.length
+        ring = self.ring
+        admission = self.admission
+        reflect_tos = self.reflect_tos
+        received_tos = self.received_tos
+        malformed = self.malformed
+        count = 0
+
+        while self.running:
+            try:
+                if timers:
+                    # time the receive call only, not the wait for the next packet
+                    select.select([self.socket], [], [])
+                    p0 = clock()
+                data, address = self.recvfrom()
+                if timers:
+                    p1 = clock()
+                    timers.add("receive", p0, p1)
+
+                t2 = now()
+                if admission and not admission.admit(address[0], t2):
+                    continue
+                if timers:
+                    p0 = clock()
+                    timers.add("timestamp", p1, p0)
+                if len(data) < REQUEST_MIN or not address[1]:
+                    if not self.running:
+                        break  # empty read after stop()
+                    malformed[check_request(data, address)] += 1
+                    continue
+                sseq, t1 = decode_request(data)
+                if timers:
+                    p1 = clock()
+                    timers.add("decode", p0, p1)
+
+                if ring:
+                    ring.put(t2, data, address, self.last_tos)
+                idx = index.next(address, sseq, t2)
+
+                if timers:
+                    p0 = clock()
+                    timers.add("stats", p1, p0)
+                rdata = encode_reply(idx, t2, data, buffers[count % length])
+                count += 1
+                if timers:
+                    p1 = clock()
+                    timers.add("encode", p0, p1)
+                if reflect_tos:
+                    tos = self.last_tos
+                    received_tos[tos >> 2] += 1
+                    self.sendto_tos(rdata, address, tos)
+                else:
+                    self.sendto(rdata, address)
+                if timers:
+                    timers.add("send", p1, clock())
+
+            except OSError as e:
+                # stop() closes the socket; a full send buffer or an ICMP error reported
+                # on the socket only costs the datagram at hand
+                if not self.running:
+                    break
+                if self.transient(e):
+                    continue
+                log.error("TWL session reflector failed: %s", e)
+                break
+            except Exception as e:
+                if self.running:
+                    log.error("TWL session reflector failed: %s", e)
+                break
+
+
+#############################################################################
+# Library API (see twampy/__init__.py)
+
+
+@dataclasses.dataclass
+class SenderConfig:
+    """
+    Session sender settings, same meaning as the CLI options of 'twampy sender'
+    """
+
+    far_end: str = "127.0.0.1:20001"
+    near_end: str = ":0"  # ephemeral local port, so many probes can run in one process
+    tos: int = 0x88
+    ttl: int = 64
+    padding: int = 0
+    imix: str | None = None  # frame size profile, see SizeProfile.parse()
+    seed: int = 0
+    classes: str | None = None  # DSCP per packet, see ClassProfile.parse()
+    flows: int = 1  # source ports, packets round-robin (ECMP/LAG path spreading)
+    burst: int = 1  # requests per system call (sendmmsg/UDP GSO), see BurstSender
+    do_not_fragment: bool = False
+    interval: float = 100  # msec
+    count: int = 100
+    timers: bool = False
+    low_latency: bool = False
+    ring: int = 16384  # receive ring capacity (packets), see PacketRing
+    writer: ResultWriter | None = None  # started by the caller, see ResultWriter
+
+
+@dataclasses.dataclass
+class ReflectorConfig:
+    """
+    Session reflector settings, same meaning as the CLI options of 'twampy responder'
+    """
+
+    near_end: str = ":20001"
+    tos: int = 0x88
+    ttl: int = 64
+    padding: int = 0
+    imix: str | None = None
+    seed: int = 0
+    do_not_fragment: bool = False
+    timers: bool = False
+    low_latency: bool = False
+    ring: int = 16384
+    reflect_tos: bool = False  # reply with the received TOS (per-class probing)
+    allow: tuple[str, ...] = ()  # prefixes, see Admission
+    deny: tuple[str, ...] = ()
+    source_rate: float = 0.0  # pps per source address, 0 for no limit
+    source_burst: float = 0.0
+    max_pps: float = 0.0
+
+
+def run_sender(config: SenderConfig) -> SessionResult:
+    """
+    Run a TWAMP-light test session in the calling thread and return its result
+    """
+
+    sender = TwampySessionSender(config)
+    try:
+        sender.run()
+    finally:
+        sender.socket.close()
+    return sender.result()
+
+
+def start_reflector(config: ReflectorConfig) -> "TwampySessionReflector":
+    """
+    Start a TWAMP-light reflector thread; call stop() and join() to end it
+    """
+
+    reflector = TwampySessionReflector(config)
+    reflector.daemon = True
+    reflector.name = "twl_responder"
+    reflector.start()
+    return reflector
+
+
+#############################################################################
+# asyncio protocols: sessions as DatagramProtocols on the caller's event loop,
+# paced by loop timers, no threads and no signal handlers
+
+# SenderConfig settings of the threaded sender only, with their "off" value
+ASYNC_UNSUPPORTED = {"classes": None, "flows": 1, "burst": 1, "timers": False}
+
+
+class SenderProtocol(asyncio.DatagramProtocol):
+    """
+    TWAMP-light session sender; 'done' is a future with the SessionResult,
+    set when the last reply arrived or the drain timeout expired (at most
+    'timeout' seconds after the last request). Settings of the threaded sender
+    only (ASYNC_UNSUPPORTED) raise ValueError. Transient socket errors are
+    counted, others end the session and are kept in 'error'; errnos in 'fatal'
+    are never transient.
+    """
+
+    def __init__(self, config, far_end, ipversion=4, timeout=None, fatal=()):
+        unsupported = [name for name, off in ASYNC_UNSUPPORTED.items() if (getattr(config, name) or off) != off]
+        if unsupported:
+            raise ValueError(f"not supported by the asyncio sender: {', '.join(unsupported)} (use run_sender())")
+        self.loop = asyncio.get_running_loop()
+        self.config = config
+        self.far_end = far_end
+        self.timeout = timeout
+        self.fatal = frozenset(fatal)
+        self.interval = float(config.interval) / 1000
+        self.count = config.count
+        self.profile = SizeProfile.fromargs(config, ipversion)
+        self.stats = TwampStatistics()
+        self.sizestats = {size: TwampStatistics() for size in self.profile.sizes} if self.profile.mixed else None
+        self.sent = 0
+        self.sendtimes = SendTimes(min(self.count, SEND_TIMES))
+        self.wait_max = 0.0
+        self.malformed = collections.Counter()
+        self.errors = collections.Counter()  # transient socket errors, per errno name
+        self.error = None  # the socket error that ended the session
+        self.writer = config.writer
+        self.transport = None
+        self.timer = None
+        self.done = self.loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.started = self.loop.time()
+        self.send()
+
+    def send(self):
+        idx = self.sent
+        profile = self.profile
+        t1 = now()
+        self.sendtimes.put(idx, t1)
+        self.transport.sendto(encode_request(idx, t1, profile.buffers[idx % profile.length]), self.far_end)
+        if self.done.done():
+            return  # ended by a socket error, see error_received()
+        if self.writer:
+            self.writer.sent(idx, t1)
+            if self.writer.sla:
+                self.writer.events(self.writer.sla.sent(idx, t1))
+        self.sent = idx + 1
+        if self.sent < self.count:
+            self.timer = self.loop.call_at(self.started + self.sent * self.interval, self.send)
+        else:
+            wait = drain_timeout(self.wait_max)
+            self.timer = self.loop.call_later(wait if self.timeout is None else min(wait, self.timeout), self.finish)
+
+    def datagram_received(self, data, address):
+        t4 = now()
+        reply = reply_delays(data, t4, self.sent, self.sendtimes, self.malformed)
+        if reply is None:
+            return
+        rseq, sseq, t1, t2, t3, delayRT, delayOB, delayIB = reply
+        self.stats.add(delayRT, delayOB, delayIB, rseq, sseq)
+        if self.sizestats:
+            profile = self.profile
+            self.sizestats[profile.sequence[sseq % profile.length]].add(delayRT, delayOB, delayIB, rseq, sseq)
+        self.wait_max = max(self.wait_max, t4 - t1)
+        if self.writer:
+            if self.writer.sla:
+                self.writer.events(self.writer.sla.reply(t4, delayRT, delayOB, delayIB, sseq))
+            self.writer.reply(rseq, sseq, t1, t2, t3, t4, delayRT, delayOB, delayIB, len(data), address[0])
+        if sseq + 1 == self.count:
+            self.finish()
+
+    def error_received(self, exc):
+        # sendto() errors and ICMP errors reported on the socket
+        if exc.errno in TRANSIENT_ERRORS and exc.errno not in self.fatal:
+            self.errors[errno.errorcode[exc.errno]] += 1
+            return
+        log.debug("sender: %s", exc)
+        self.error = exc
+        self.finish()
+
+    def connection_lost(self, exc):
+        self.finish()
+
+    def finish(self):
+        self.close()
+        if not self.done.done():
+            self.done.set_result(self.result())
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+        if self.transport:
+            self.transport.close()
+
+    def result(self):
+        result = self.stats.result(self.sent)
+        result.malformed = dict(self.malformed)
+        result.socket_errors = dict(self.errors)
+        result.echo_mismatch = self.sendtimes.mismatched
+        result.expired = self.sendtimes.expired
+        result.truncated = self.sendtimes.truncated
+        if self.sizestats:
+            for size, sent in self.profile.counts(self.sent).items():
+                sized = self.sizestats[size].result(sent)
+                for direction in (sized.outbound, sized.inbound):
+                    if direction:
+                        direction.loss = None
+                result.sizes[size] = sized
+        return result
+
+    def metadata(self):
+        return {
+            "far_end": "{}:{}".format(*self.far_end),
+            "near_end": "{}:{}".format(*self.transport.get_extra_info("sockname")[:2]),
+            "interval": self.interval * 1000,
+            "count": self.count,
+            "tos": self.config.tos,
+            "padding": self.config.padding,
+            "imix": self.config.imix,
+            "classes": None,
+            "flows": 1,
+        }
+
+
+class ReflectorProtocol(asyncio.DatagramProtocol):
+    """
+    TWAMP-light session reflector; close() stops it, 'closed' is a future set
+    when the transport is gone
+    """
+
+    def __init__(self, config, ipversion=4):
+        self.profile = SizeProfile.fromargs(config, ipversion)
+        self.admission = Admission.fromargs(config)
+        self.index = SenderIndex()
+        self.reflected = 0
+        self.malformed = collections.Counter()
+        self.transport = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    @property
+    def local_address(self):
+        return self.transport.get_extra_info("sockname")
+
+    def datagram_received(self, data, address):
+        t2 = now()
+        if self.admission and not self.admission.admit(address[0], t2):
+            return
+        reason = check_request(data, address)
+        if reason:
+            self.malformed[reason] += 1
+            return
+        sseq, t1 = decode_request(data)
+        idx = self.index.next(address, sseq, t2)
+        profile = self.profile
+        self.transport.sendto(encode_reply(idx, t2, data, profile.buffers[self.reflected % profile.length]), address)
+        self.reflected += 1
+
+    def error_received(self, exc):
+        log.debug("reflector: %s", exc)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(self.reflected)
+
+    def close(self):
+        self.transport.close()
+
+
+async def start_sender_async(config: SenderConfig, timeout=None, fatal=()) -> SenderProtocol:
+    """
+    Start a TWAMP-light test session on the running event loop; await its 'done'
+    future for the result, close() ends it early. See SenderProtocol for
+    'timeout' and 'fatal'.
+    """
+
+    sip, spt, sipv = parse_addr(config.near_end, 20000)
+    rip, rpt, ripv = parse_addr(config.far_end, 20001)
+    ipversion = 6 if (sipv == 6) or (ripv == 6) else 4
+    protocol = SenderProtocol(config, (rip, rpt), ipversion, timeout, fatal)
+    sock = udp_socket(sip, spt, config.tos, config.ttl, config.do_not_fragment, ipversion)
+    tuning = LowLatency.fromargs(config)
+    if tuning:
+        tuning.socket(sock)
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+    return protocol
+
+
+async def run_sender_async(config: SenderConfig) -> SessionResult:
+    """
+    Run a TWAMP-light test session on the running event loop and return its
+    result; cancelling the awaiting task ends the session
+    """
+
+    protocol = await start_sender_async(config)
+    try:
+        return await protocol.done
+    finally:
+        protocol.close()
+
+
+async def start_reflector_async(config: ReflectorConfig) -> ReflectorProtocol:
+    """
+    Start a TWAMP-light reflector on the running event loop; call close() and
+    await its 'closed' future to end it
+    """
+
+    addr, port, ipversion = parse_addr(config.near_end, 20001)
+    sock = udp_socket(addr, port, config.tos, config.ttl, config.do_not_fragment, ipversion)
+    tuning = LowLatency.fromargs(config)
+    if tuning:
+        tuning.socket(sock)
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(lambda: ReflectorProtocol(config, ipversion), sock=sock)
+    return protocol
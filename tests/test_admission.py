@@ -0,0 +1,62 @@
+"""Tests for reflector admission control."""
+
+import socket
+import time
+
+import twampy
+from twampy.session import Admission, PrefixTrie, encode_request, now
+
+
+def test_prefix_trie_longest_match():
+    """The most specific prefix wins, IPv4-mapped IPv6 sources match IPv4 prefixes"""
+    trie = PrefixTrie()
+    for prefix in ("10.0.0.0/8", "10.1.0.0/16", "10.1.2.3/32", "2001:db8::/32"):
+        trie.insert(prefix, prefix)
+
+    assert trie.lookup("10.1.2.3") == "10.1.2.3/32"
+    assert trie.lookup("10.1.2.4") == "10.1.0.0/16"
+    assert trie.lookup("10.200.0.1") == "10.0.0.0/8"
+    assert trie.lookup("::ffff:10.1.9.9") == "10.1.0.0/16"
+    assert trie.lookup("2001:db8:1::1") == "2001:db8::/32"
+    assert trie.lookup("192.0.2.1", "none") == "none"
+
+
+def test_admission_limits_each_source_separately():
+    """A flooding source uses up its own bucket only; denied sources are counted per source"""
+    admission = Admission(allow=["192.0.2.0/24"], deny=["192.0.2.66/32"], rate=100, burst=5)
+
+    flood = [admission.admit("192.0.2.1", 1.0) for _ in range(50)]
+    assert flood.count(True) == 5
+    assert admission.admit("192.0.2.2", 1.0)
+    assert admission.admit("192.0.2.1", 1.02)  # two tokens refilled after 20ms
+    assert not admission.admit("192.0.2.66", 1.0)
+    assert not admission.admit("198.51.100.1", 1.0)
+
+    assert admission.sources["192.0.2.1"][3:] == [6, 45]
+    assert admission.sources["192.0.2.66"][3:] == [0, 1]
+    assert admission.dropped == {"denied": 2, "rate": 45, "global": 0}
+
+    capped = Admission(max_pps=1000)
+    assert sum(capped.admit(f"192.0.2.{n}", 5.0) for n in range(200)) == 100
+
+
+def test_reflector_keeps_serving_other_sources_during_a_flood():
+    """A source above --source-rate is dropped while a regular sender gets all replies"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0", source_rate=200))
+    try:
+        port = reflector.local_address[1]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as flood:
+            flood.bind(("127.0.0.2", 0))
+            for seq in range(2000):
+                flood.sendto(encode_request(seq, now()), ("127.0.0.1", port))
+        result = twampy.run_sender(twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=20, interval=5))
+        time.sleep(0.1)
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert result.received == 20
+    flooder = reflector.admission.sources["127.0.0.2"]
+    assert flooder[4] > 0
+    assert flooder[3] + flooder[4] <= 2000
+    assert reflector.admission.sources["127.0.0.1"][4] == 0
@@ -0,0 +1,313 @@
+"""
+Tests for the importable library API
+"""
+
+import subprocess
+import sys
+
+import twampy
+
+
+def test_import_is_lightweight():
+    """Importing twampy must not load the implementation or build the CLI"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, twampy; print('twampy.__main__' in sys.modules, 'argparse' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        timeout=10,
+    )
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_library_api_does_not_load_the_cli():
+    """The first use of the API loads twampy.session only, not the CLI module"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, twampy; twampy.SenderConfig; print(*(m in sys.modules for m in "
+            "('twampy.session', 'twampy.__main__', 'argparse')))",
+        ],
+        capture_output=True,
+        text=True,
+        timeout=10,
+    )
+    assert result.stdout.split() == ["True", "False", "False"]
+
+
+def test_run_sender_against_in_process_reflector():
+    """Start a reflector in-process and get a structured result from a sender run"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        result = twampy.run_sender(twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=20, interval=5))
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert not reflector.is_alive()
+    assert isinstance(result, twampy.SessionResult)
+    assert result.sent == 20
+    assert result.received == 20
+    assert result.roundtrip.loss == 0.0
+    assert result.roundtrip.min <= result.roundtrip.avg <= result.roundtrip.max
+    assert result.asdict()["outbound"]["jitter"] >= 0
+    assert result.socket_drops == 0
+    assert result.ring_overflow == 0
+
+
+def test_packet_ring_counts_overflow():
+    """A full receive ring drops new packets and counts them, draining keeps order"""
+    from twampy.session import PacketRing
+
+    ring = PacketRing(capacity=4, header=4)
+    for seq in range(6):
+        ring.put(float(seq), seq.to_bytes(4, "big") + b"padding", ("127.0.0.1", seq))
+    assert len(ring) == 4
+    assert ring.overflow == 2
+
+    seen = []
+    ring.drain(lambda header, stamp, size, source, mark: seen.append((int.from_bytes(header, "big"), stamp, size)))
+    assert seen == [(0, 0.0, 11), (1, 1.0, 11), (2, 2.0, 11), (3, 3.0, 11)]
+    assert len(ring) == 0
+    assert ring.put(9.0, b"\0\0\0\x09", None)
+    assert ring.put(10.0, b"\x0a", None)  # shorter than the header: the rest of the slot is zeroed
+
+    seen = []
+    ring.drain(lambda header, stamp, size, source, mark: seen.append((bytes(header), size)))
+    assert seen == [(b"\0\0\0\x09", 4), (b"\x0a\0\0\0", 1)]
+
+
+def test_low_latency_profile_reports_settings():
+    """The low-latency profile records which settings applied and restores the GC afterwards"""
+    import gc
+
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=5, interval=5, low_latency=True)
+        sender = twampy.TwampySessionSender(config)
+        sender.run()
+        sender.socket.close()
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    settings = {setting: applied for setting, requested, applied in sender.tuning.report}
+    assert "SO_RCVBUF" in settings
+    assert settings["GC"] == "disabled while running"
+    assert gc.isenabled()
+    assert sender.result().received == 5
+
+
+def test_size_profile_is_deterministic_and_weighted():
+    """Seeded IMIX sequences repeat exactly and follow the configured weights"""
+    first = twampy.SizeProfile.parse("64:7,590:4,1514:1", seed=3)
+    second = twampy.SizeProfile.parse("64:7,590:4,1514:1", seed=3)
+    assert first.sequence == second.sequence
+    assert first.sequence != twampy.SizeProfile.parse("64:7,590:4,1514:1", seed=4).sequence
+
+    counts = first.counts(first.length)
+    assert abs(counts[64] / first.length - 7 / 12) < 0.05
+    assert abs(counts[1514] / first.length - 1 / 12) < 0.03
+    # padding buffers are pre-built per size: frame size minus IPv4/UDP/TWAMP/Ethernet headers
+    assert len(first.padding[590]) == 534
+    assert len(twampy.SizeProfile.parse("simple", ipversion=6).padding[590]) == 514
+
+
+def test_run_sender_reports_statistics_per_frame_size():
+    """Mixed frame sizes produce a per-size breakdown that adds up to the totals"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        result = twampy.run_sender(
+            twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=40, interval=2, imix="tolly", seed=1)
+        )
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert set(result.sizes) <= {64, 78, 576, 1514}
+    assert sum(sized.sent for sized in result.sizes.values()) == result.sent
+    assert sum(sized.received for sized in result.sizes.values()) == result.received
+
+
+def test_sender_drain_timeout_follows_reply_times():
+    """The wait for late replies scales with the reply times seen; stop() ends it at once"""
+    import socket
+    import time
+
+    from twampy.session import DRAIN_FACTOR, DRAIN_MIN, DRAIN_TIMEOUT
+
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        sender = twampy.TwampySessionSender(twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=10, interval=2))
+        sender.run()
+        sender.socket.close()
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert 0 < sender.wait_max < 1
+    assert sender.drain_timeout() == max(DRAIN_MIN, DRAIN_FACTOR * sender.wait_max)
+
+    # a silent far end: no replies, the sender waits DRAIN_TIMEOUT unless stopped
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent:
+        silent.bind(("127.0.0.1", 0))
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{silent.getsockname()[1]}", count=2, interval=1)
+        sender = twampy.TwampySessionSender(config)
+        assert sender.drain_timeout() == DRAIN_TIMEOUT
+        sender.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        sender.stop()
+        sender.join(timeout=DRAIN_TIMEOUT)
+        assert not sender.is_alive()
+        assert time.monotonic() - started < 1
+        sender.socket.close()
+    assert sender.result().sent == 2
+
+
+def test_class_profile_interleaves_weighted_classes():
+    """Smooth weighted round-robin spreads each class over the cycle"""
+    profile = twampy.ClassProfile.parse("ef,af41:2,be")
+    assert profile.names == ["af41", "ef", "be", "af41"]
+    assert profile.tos == [136, 184, 0, 136]
+    assert profile.counts(10) == {"ef": 3, "af41": 5, "be": 2}
+
+
+def test_run_sender_reports_statistics_per_class():
+    """Per-packet DSCP over one socket; replies with another DSCP count as remarked"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0", reflect_tos=True))
+    try:
+        port = reflector.local_address[1]
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=30, interval=2, classes="ef,af41,be")
+        result = twampy.run_sender(config)
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert {name: sized.received for name, sized in result.classes.items()} == {"ef": 10, "af41": 10, "be": 10}
+    assert result.remarked == 0
+    assert reflector.received_tos == {46: 10, 34: 10, 0: 10}
+
+    # a reflector with a fixed TOS (0x88, DSCP af41) "remarks" every other class
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=30, interval=2, classes="ef,af41,be")
+        result = twampy.run_sender(config)
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert {name: sized.remarked for name, sized in result.classes.items()} == {"ef": 10, "af41": 0, "be": 10}
+
+
+def test_run_sender_spreads_flows_over_source_ports():
+    """Each source port is a flow with its own statistics; a lossy hashed path is flagged"""
+    import socket
+    import threading
+
+    from twampy.session import encode_reply, flow_flags, now
+
+    reflector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    reflector.bind(("127.0.0.1", 0))
+    reflector.settimeout(0.2)
+    stopped = threading.Event()
+    rseq = {}
+    dropped = []
+
+    def reflect():
+        # drops every other request of the first source port seen, like a lossy ECMP member
+        while not stopped.is_set():
+            try:
+                data, address = reflector.recvfrom(9216)
+            except TimeoutError:
+                continue
+            if not dropped:
+                dropped.append(address[1])
+            idx = rseq.get(address, 0)
+            rseq[address] = idx + 1
+            if address[1] == dropped[0] and idx % 2:
+                continue
+            reflector.sendto(encode_reply(idx, now(), data), address)
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    try:
+        config = twampy.SenderConfig(
+            far_end=f"127.0.0.1:{reflector.getsockname()[1]}", near_end="127.0.0.1:0", count=80, interval=2, flows=4
+        )
+        result = twampy.run_sender(config)
+    finally:
+        stopped.set()
+        thread.join()
+        reflector.close()
+
+    assert len(result.flows) == 4
+    assert {flow.sent for flow in result.flows.values()} == {20}
+    assert result.flows[dropped[0]].received == 10
+    assert sum(flow.received for flow in result.flows.values()) == result.received == 70
+    # the reflector counts rseq per source port: losses are on the inbound side (except
+    # the last one, which no later rseq reveals)
+    assert result.inbound.loss == 100 * 9 / 80
+    assert result.outbound.loss == 0
+    assert flow_flags(result)[dropped[0]] == "lossy"
+
+    result.flows = {
+        port: twampy.SessionResult(100, received, roundtrip=twampy.DirectionResult(1.0, 9.0, avg, 0.1, 0.0))
+        for port, received, avg in ((1, 100, 2.0), (2, 100, 2.1), (3, 99, 3.5), (4, 90, 1.9))
+    }
+    assert flow_flags(result) == {3: "slow", 4: "lossy"}
+
+
+def test_dead_flow_counts_as_unattributed_loss():
+    """A flow without any reply has no rseq: its requests are lost, direction unknown"""
+    import socket
+    import threading
+
+    from twampy.session import encode_reply, flow_flags, now
+
+    reflector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    reflector.bind(("127.0.0.1", 0))
+    reflector.settimeout(0.2)
+    stopped = threading.Event()
+    rseq = {}
+    dropped = []
+
+    def reflect():
+        # drops every request of the first source port seen, like a dead ECMP member
+        while not stopped.is_set():
+            try:
+                data, address = reflector.recvfrom(9216)
+            except TimeoutError:
+                continue
+            if not dropped:
+                dropped.append(address[1])
+            if address[1] == dropped[0]:
+                continue
+            idx = rseq.get(address, 0)
+            rseq[address] = idx + 1
+            reflector.sendto(encode_reply(idx, now(), data), address)
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    try:
+        config = twampy.SenderConfig(
+            far_end=f"127.0.0.1:{reflector.getsockname()[1]}", near_end="127.0.0.1:0", count=80, interval=2, flows=4
+        )
+        result = twampy.run_sender(config)
+    finally:
+        stopped.set()
+        thread.join()
+        reflector.close()
+
+    assert result.flows[dropped[0]].received == 0
+    assert result.received == 60
+    assert result.roundtrip.loss == 25.0
+    assert result.unattributed == 20
+    assert result.outbound.loss == result.inbound.loss == 0
+    assert flow_flags(result)[dropped[0]] == "lossy"
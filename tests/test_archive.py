@@ -0,0 +1,108 @@
+"""Tests for the compressed packet archive."""
+
+import json
+import os
+import random
+
+import pytest
+
+import twampy.session
+from twampy.session import ArchiveSink, PacketArchive, TwampStatistics
+
+
+def packet_records(count, seed=1):
+    """Replies of two sessions at 10 pps with delay variation, reordering and loss"""
+    rng = random.Random(seed)
+    records = []
+    for reflector, start in (("192.0.2.1", 1.76e9), ("2001:db8::2", 1.76e9 + 0.05)):
+        for sseq in range(count):
+            if rng.random() < 0.01:
+                continue
+            t1 = start + sseq * 0.1 + rng.uniform(0, 2e-5)
+            t2 = t1 + rng.uniform(0.010, 0.012)
+            t3 = t2 + 3e-5
+            t4 = t3 + rng.uniform(0.010, 0.011)
+            records.append(
+                {
+                    "sseq": sseq,
+                    "rseq": len(records) % count,
+                    "t1": t1,
+                    "t2": t2,
+                    "t3": t3,
+                    "t4": t4,
+                    "bytes": 1000 if sseq % 7 else 1500,
+                    "reflector": reflector,
+                }
+            )
+    records.sort(key=lambda record: record["t4"])
+    records[10], records[11] = records[11], records[10]
+    return records
+
+
+def write_archive(path, records, close=True):
+    sink = ArchiveSink(path)
+    for record in records:
+        sink.write(record)
+    if close:
+        sink.close()
+    else:
+        sink._block()
+        sink.stream.close()
+
+
+def test_archive_round_trip_and_time_range(tmp_path, monkeypatch):
+    """Records come back exactly (nanoseconds), ranges only decode overlapping blocks"""
+    monkeypatch.setattr(twampy.session, "ARCHIVE_BLOCK", 100)
+    records = packet_records(1000)
+    path = tmp_path / "packets.twa"
+    write_archive(path, records)
+
+    archive = PacketArchive(path)
+    assert archive.packets == len(records)
+    assert len(archive.index) == (len(records) + 99) // 100
+    decoded = list(archive.records())
+    assert len(decoded) == len(records)
+    for original, record in zip(records, decoded, strict=True):
+        for field in ("sseq", "rseq", "bytes", "reflector"):
+            assert record[field] == original[field]
+        for field in ("t1", "t2", "t3", "t4"):
+            assert record[field] == pytest.approx(original[field], abs=1e-9)
+        assert record["rtt"] == pytest.approx(
+            1000 * (original["t4"] - original["t1"] - original["t3"] + original["t2"]), abs=1e-5
+        )
+
+    start, end = 1.76e9 + 20, 1.76e9 + 30
+    blocks = list(archive.blocks(start, end))
+    assert 2 <= len(blocks) <= 5
+    window = list(archive.records(start, end))
+    assert window == [record for record in decoded if start <= record["t1"] < end]
+    archive.close()
+
+    # an order of magnitude below the NDJSON records
+    ndjson = sum(len(json.dumps(record)) + 1 for record in decoded)
+    assert os.path.getsize(path) * 10 < ndjson
+
+
+def test_archive_statistics_match_and_unclosed_archive(tmp_path):
+    """Session statistics stream from the blocks; archives without index are scanned"""
+    records = packet_records(300)
+    path = tmp_path / "packets.twa"
+    write_archive(path, records, close=False)
+
+    archive = PacketArchive(path)
+    sessions = archive.sessions(reflector="192.0.2.1")
+    archive.close()
+    ((started, reflector, stats, first, last),) = sessions
+    expected = TwampStatistics()
+    for record in records:
+        if record["reflector"] == "192.0.2.1":
+            t1, t2, t3, t4 = record["t1"], record["t2"], record["t3"], record["t4"]
+            expected.add(1000 * (t4 - t1 + t2 - t3), 1000 * (t2 - t1), 1000 * (t4 - t3), record["rseq"], record["sseq"])
+    assert stats.count == expected.count
+    assert (first, last) == (0, 299)
+    assert stats.result(300).roundtrip.avg == pytest.approx(expected.result(300).roundtrip.avg, abs=1e-6)
+    assert stats.result(300).roundtrip.jitter == pytest.approx(expected.result(300).roundtrip.jitter, abs=1e-6)
+
+    path.write_bytes(b"not an archive")
+    with pytest.raises(ValueError):
+        PacketArchive(path)
@@ -0,0 +1,62 @@
+"""Tests for the asyncio sender and reflector protocols."""
+
+import asyncio
+import contextlib
+import random
+import socket
+
+import pytest
+
+import twampy
+
+
+def test_many_sessions_share_one_loop():
+    """Hundreds of concurrent sessions on one loop, each gets exactly its own replies"""
+
+    async def session(port, delay):
+        await asyncio.sleep(delay)
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=10, interval=20)
+        return await twampy.run_sender_async(config)
+
+    async def main():
+        config = twampy.ReflectorConfig(near_end="127.0.0.1:0", low_latency=True)
+        reflector = await twampy.start_reflector_async(config)
+        port = reflector.local_address[1]
+        results = await asyncio.gather(*(session(port, random.uniform(0, 0.02)) for _ in range(300)))
+        reflector.close()
+        return results, await reflector.closed
+
+    results, reflected = asyncio.run(main())
+    assert reflected == 3000
+    assert all(result.sent == 10 and result.received == 10 for result in results)
+    assert all(result.roundtrip.loss == 0.0 for result in results)
+
+
+def test_cancelling_a_session_closes_its_socket():
+    """A session waiting for a silent far end ends on cancellation, without leaking the socket"""
+
+    async def main(port):
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=3, interval=1)
+        task = asyncio.create_task(twampy.run_sender_async(config))
+        await asyncio.sleep(0.2)
+        assert not task.done()  # no replies: waits up to the drain timeout
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return task
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent:
+        silent.bind(("127.0.0.1", 0))
+        task = asyncio.run(main(silent.getsockname()[1]))
+    assert task.cancelled()
+
+
+def test_threaded_sender_settings_are_rejected():
+    """classes, flows, burst and timers need the threaded sender: ValueError instead of being ignored"""
+
+    async def main(**settings):
+        return await twampy.run_sender_async(twampy.SenderConfig(far_end="127.0.0.1:9", count=1, **settings))
+
+    for settings in ({"classes": "ef,be"}, {"flows": 2}, {"burst": 8}, {"timers": True}):
+        with pytest.raises(ValueError, match=next(iter(settings))):
+            asyncio.run(main(**settings))
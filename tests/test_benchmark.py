@@ -0,0 +1,47 @@
+"""
+Tests for the loopback benchmark suite
+"""
+
+import json
+import subprocess
+import sys
+
+
+def test_benchmark_writes_json_and_compares(tmp_path):
+    """Run the in-process benchmarks, store results and compare them against themselves"""
+    output = tmp_path / "bench.json"
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "twampy",
+            "benchmark",
+            "--quick",
+            "--only",
+            "codec",
+            "stats",
+            "burst",
+            "-o",
+            str(output),
+        ],
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, f"Benchmark failed:\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}"
+
+    with open(output) as f:
+        data = json.load(f)
+    assert "codec.decode_reply" in data["results"]
+    assert data["results"]["stats.add"]["better"] == "higher"
+    assert data["results"]["burst.single.pps"]["value"] > 0
+    if sys.platform == "linux":
+        assert data["results"]["burst.sendto.skew"]["better"] == "lower"
+
+    result = subprocess.run(
+        [sys.executable, "-m", "twampy", "benchmark", "--quick", "--only", "codec", "--baseline", str(output)],
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert "regression(s)" in result.stdout
@@ -0,0 +1,87 @@
+"""Tests for burst transmission (sendmmsg, UDP GSO)."""
+
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import twampy
+from twampy.session import BURST_MODES, BurstSender, SendTimes, SizeProfile, decode_request, libc_sendmmsg
+
+
+def available(mode, profile):
+    return (mode != "gso" or BurstSender.gso_capable(profile)) and (mode != "sendmmsg" or libc_sendmmsg())
+
+
+@pytest.mark.parametrize("mode", BURST_MODES)
+@pytest.mark.parametrize("imix", [None, "64:1,1518:1"])
+def test_burst_sends_one_datagram_per_request(mode, imix):
+    """Every request arrives as its own datagram, in order, with its size and its T1"""
+    profile = SizeProfile.parse(imix) if imix else SizeProfile.fixed(100)
+    if mode == "gso" and profile.mixed:
+        pytest.skip("UDP GSO needs one packet size")
+    if not available(mode, profile):
+        pytest.skip(f"{mode} not available")
+    with (
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink,
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock,
+    ):
+        sink.bind(("127.0.0.1", 0))
+        sink.settimeout(1)
+        burst = BurstSender(sock, sink.getsockname(), 16, profile, mode)
+        sendtimes = SendTimes(64)
+        stamps = burst.send(0, 16, sendtimes) + burst.send(16, 10, sendtimes)
+        packets = [sink.recv(9216) for _ in range(26)]
+
+    assert burst.mode == mode
+    assert [decode_request(data)[0] for data in packets] == list(range(26))
+    assert [len(data) for data in packets] == [14 + len(profile.buffers[sseq % profile.length]) for sseq in range(26)]
+    assert len(stamps) == 26
+    if mode == "sendto":
+        # one system call per request, each with its own T1
+        assert stamps == sorted(stamps) and stamps[0] < stamps[15]
+    elif mode == "gso":
+        # the kernel cuts the datagrams of a burst apart at once: one T1 per burst
+        assert len(set(stamps[:16])) == 1 and len(set(stamps[16:])) == 1
+    else:
+        # sendmmsg sends one datagram after the other: from the second burst on each
+        # request gets its own T1, spaced by the time per datagram measured before
+        assert len(set(stamps[:16])) == 1
+        assert all(a < b for a, b in zip(stamps[16:], stamps[17:], strict=False))
+        assert 0 < burst.spacing < 0.01
+    for sseq, data in enumerate(packets):
+        t1 = stamps[sseq]
+        assert decode_request(data)[1] == pytest.approx(t1, abs=1e-6)
+        assert sendtimes.get(sseq) == t1
+        assert data[12:14] == b"\x3f\xff"
+
+
+def test_run_sender_in_bursts():
+    """A session in bursts of 16 keeps the average rate and gets every reply"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        port = reflector.local_address[1]
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=400, interval=0.5, burst=16)
+        result = twampy.run_sender(config)
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert result.sent == 400
+    assert result.received == 400
+    assert result.echo_mismatch == 0 and result.malformed == {}
+
+
+def test_burst_rejects_flows_and_classes():
+    """All requests of a burst leave from one socket with one TOS"""
+    out = subprocess.run(
+        [sys.executable, "-m", "twampy", "sender", "127.0.0.1:9", "--burst", "8", "--flows", "2"],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    assert out.returncode == 2
+    assert "--burst" in out.stderr
+    with pytest.raises(ValueError, match="burst"):
+        twampy.run_sender(twampy.SenderConfig(far_end="127.0.0.1:9", burst=8, classes="ef,be"))
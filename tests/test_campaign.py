@@ -0,0 +1,149 @@
+"""
+Tests for probe campaigns
+"""
+
+import asyncio
+import json
+import subprocess
+import sys
+
+import pytest
+
+import twampy
+from twampy.__main__ import Campaign, load_campaign
+
+
+def test_load_campaign_toml_with_defaults(tmp_path):
+    path = tmp_path / "campaign.toml"
+    path.write_text(
+        """
+[scheduler]
+max_sessions = 4
+
+[defaults]
+interval = 50
+period = 60
+
+[[probe]]
+name = "core"
+target = "192.0.2.1:862"
+dscp = "ef"
+
+[[probe]]
+target = "192.0.2.2"
+count = 10
+period = 30
+"""
+    )
+    probes, scheduler = load_campaign(str(path))
+    assert scheduler == {"max_sessions": 4}
+    assert [p.name for p in probes] == ["core", "192.0.2.2"]
+    assert probes[0].config.far_end == "192.0.2.1:862"
+    assert probes[0].config.tos == 0xB8  # DSCP 46 in the upper six bits
+    assert probes[0].config.interval == 50
+    assert probes[0].period == 60
+    assert probes[1].config.count == 10
+    assert probes[1].period == 30
+    assert probes[1].pps == 20
+
+
+@pytest.mark.parametrize(
+    "campaign, error",
+    [
+        ({"probe": [{"target": "192.0.2.1", "colour": "red"}]}, "unknown setting 'colour'"),
+        ({"probe": [{"name": "x"}]}, "missing target"),
+        ({"probe": [{"target": "192.0.2.1", "count": "many"}]}, "invalid value for 'count'"),
+        ({"probe": [{"target": "192.0.2.1", "dscp": "xx"}]}, "invalid DSCP value"),
+        ({"probe": []}, "no probes defined"),
+    ],
+)
+def test_load_campaign_rejects_invalid_files(tmp_path, campaign, error):
+    path = tmp_path / "campaign.json"
+    path.write_text(json.dumps(campaign))
+    with pytest.raises(ValueError, match=error):
+        load_campaign(str(path))
+
+
+def test_campaign_respects_session_limit(tmp_path):
+    """With max_sessions=1 probes run one after another, all on one event loop"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    port = reflector.local_address[1]
+    path = tmp_path / "campaign.json"
+    path.write_text(
+        json.dumps(
+            {
+                "defaults": {"interval": 10, "count": 5, "period": 0.2},
+                "probe": [{"name": f"p{i}", "target": f"127.0.0.1:{port}"} for i in range(3)],
+            }
+        )
+    )
+    probes, _ = load_campaign(str(path))
+    campaign = Campaign(probes, max_sessions=1, runs=2, seed=1)
+
+    concurrent = []
+    session = campaign.session
+
+    async def tracked(probe):
+        concurrent.append(len(campaign.active))
+        await session(probe)
+
+    campaign.session = tracked
+    try:
+        asyncio.run(asyncio.wait_for(campaign.run(), 20))
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert [p.runs for p in probes] == [2, 2, 2]
+    assert campaign.sessions == 6
+    assert max(concurrent) == 1
+
+
+def test_campaign_probe_dscp_on_the_wire(tmp_path):
+    """The dscp of a probe is carried in the TOS byte of its requests"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0", reflect_tos=True))
+    port = reflector.local_address[1]
+    path = tmp_path / "campaign.json"
+    path.write_text(
+        json.dumps(
+            {
+                "defaults": {"interval": 10, "count": 5, "period": 0.2},
+                "probe": [{"name": "ef", "target": f"127.0.0.1:{port}", "dscp": "ef"}],
+            }
+        )
+    )
+    probes, _ = load_campaign(str(path))
+    try:
+        asyncio.run(asyncio.wait_for(Campaign(probes, runs=1, seed=1).run(), 20))
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert reflector.received_tos == {46: 5}
+
+
+def test_campaign_cli_runs_once(tmp_path):
+    responder = subprocess.Popen([sys.executable, "-m", "twampy", "responder", "127.0.0.1:40881", "--quiet"])
+    path = tmp_path / "campaign.json"
+    path.write_text(
+        json.dumps(
+            {
+                "defaults": {"interval": 10, "count": 5, "period": 1},
+                "probe": [{"name": "one", "target": "127.0.0.1:40881"}, {"name": "two", "target": "127.0.0.1:40881"}],
+            }
+        )
+    )
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "twampy", "campaign", str(path), "--runs", "1", "--summary", f"ndjson:{tmp_path}/s"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    finally:
+        responder.kill()
+        responder.wait()
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert sorted(line.split()[2] for line in result.stdout.splitlines() if " sent " in line) == ["one", "two"]
+    summaries = [json.loads(line) for line in (tmp_path / "s").read_text().splitlines()]
+    assert sorted(s["probe"] for s in summaries) == ["one", "two"]
+    assert all(s["received"] == 5 for s in summaries)
@@ -0,0 +1,66 @@
+"""Tests for the packet-train capacity mode."""
+
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+from twampy.__main__ import parse_rates, train_rates
+
+
+def test_train_rates_from_sender_and_reflector_spacing():
+    """Offered rate from T1 spacing, received rate from T2 spacing (reordering ignored)"""
+    # 1000 byte packets sent 1ms apart, arriving 2ms apart: 8 Mbit/s offered, 4 Mbit/s received
+    replies = {seq: (seq * 0.001, 10 + seq * 0.002, 0.005) for seq in range(5)}
+    replies[1], replies[2] = (0.001, 10.004, 0.005), (0.002, 10.002, 0.005)
+    offered, received = train_rates(replies, 1000)
+    assert offered == pytest.approx(8e6)
+    assert received == pytest.approx(4e6)
+    assert train_rates({0: (0.0, 1.0, 0.001)}, 1000) == (None, None)
+    assert parse_rates("500k,10M,1G") == [5e5, 1e7, 1e9]
+
+
+def test_capacity_through_rate_limited_relay():
+    """Back-to-back trains through a 4 Mbit/s bottleneck estimate about 4 Mbit/s"""
+    responder = subprocess.Popen([sys.executable, "-m", "twampy", "responder", "127.0.0.1:40891", "--quiet"])
+    relay = subprocess.Popen(
+        [sys.executable, "-m", "twampy", "impair", "127.0.0.1:40892", "127.0.0.1:40891", "--rate", "4M"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(1)
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "twampy",
+                "capacity",
+                "127.0.0.1:40892",
+                "--size",
+                "1000",
+                "--train",
+                "10",
+                "--trains",
+                "3",
+                "--format",
+                "ndjson",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    finally:
+        relay.kill()
+        responder.kill()
+        relay.wait()
+        responder.wait()
+
+    assert out.returncode == 0, out.stderr
+    (record,) = [json.loads(line) for line in out.stdout.splitlines()]
+    assert record["step"] == "train"
+    assert record["received"] == 30
+    assert 3.4e6 < record["received_rate"] < 4.6e6
+    assert record["offered"] > record["received_rate"]
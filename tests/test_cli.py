@@ -95,3 +95,26 @@ def test_no_arguments():
     # Should either show help (exit 0) or error (exit non-zero)
     # Either is acceptable
     assert "usage" in result.stdout.lower() or "usage" in result.stderr.lower()
+
+
+def test_dscp_option_sets_the_tos_byte():
+    """--dscp ef is sent as TOS 0xB8 (DSCP 46 in the upper six bits), as with --classes"""
+    import twampy
+    from twampy.session import dscp_tos
+
+    assert dscp_tos("ef") == 0xB8 == twampy.ClassProfile.parse("ef").tos[0]
+    assert dscp_tos("af41") == dscp_tos("34") == 0x88
+
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0", reflect_tos=True))
+    try:
+        port = reflector.local_address[1]
+        result = run_twampy("sender", f"127.0.0.1:{port}", "127.0.0.1:0", "--count", "2", "--dscp", "ef")
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert result.returncode == 0, result.stderr
+    assert reflector.received_tos == {46: 2}
+
+    result = run_twampy("sender", "127.0.0.1:862", "--dscp", "xx")
+    assert result.returncode != 0
+    assert "Invalid DSCP Value 'xx'" in result.stderr
@@ -0,0 +1,101 @@
+"""
+Tests for the network impairment relay
+"""
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+from twampy.__main__ import Impairment
+
+
+def test_impairment_is_reproducible_with_seed():
+    """Same seed, same decisions per packet"""
+
+    def run(seed):
+        model = Impairment(delay="uniform:1,9", loss="ge:5,20", duplicate=2, reorder=3, seed=seed)
+        return [model.schedule(i * 0.001, 100) for i in range(2000)]
+
+    assert run(3) == run(3)
+    assert run(3) != run(4)
+
+
+def test_impairment_loss_models():
+    """Bernoulli and Gilbert-Elliott loss approach their configured long-term rates"""
+    bernoulli = Impairment(loss="10", seed=1)
+    for i in range(20000):
+        bernoulli.schedule(i, 100)
+    assert 0.09 < bernoulli.counters["lost"] / 20000 < 0.11
+
+    # stationary probability of the bad state: p / (p + r) = 1 / (1 + 9) with full loss when bad
+    gilbert = Impairment(loss="ge:1,9", seed=1)
+    losses, runs, last = 0, 0, False
+    for i in range(50000):
+        lost = not gilbert.schedule(i, 100)
+        losses += lost
+        runs += lost and not last
+        last = lost
+    assert 0.08 < losses / 50000 < 0.12
+    assert losses / runs > 5  # bursty: mean burst length 1 / r
+
+
+def test_impairment_rate_limit_and_delay():
+    """Rate limit serializes packets and drops beyond the queue limit"""
+    model = Impairment(delay="10", rate=8 * 128 * 1000, limit=5)  # 1000 packets/s of 100 bytes
+    departures = [model.schedule(0.0, 100) for _ in range(8)]
+    assert [len(d) for d in departures] == [1] * 5 + [0] * 3
+    assert departures[0][0] == pytest.approx(0.011)
+    assert departures[4][0] == pytest.approx(0.015)
+    assert model.counters["overflow"] == 3
+
+
+def test_impairment_rejects_invalid_specs():
+    with pytest.raises(ValueError):
+        Impairment(delay="gamma:1,2")
+    with pytest.raises(ValueError):
+        Impairment(loss="ge:1")
+    with pytest.raises(ValueError):
+        Impairment(loss="120")
+
+
+def test_sender_through_impairment_relay():
+    """Relay between sender and responder adds the configured delay in both directions"""
+    responder = subprocess.Popen([sys.executable, "-m", "twampy", "responder", "127.0.0.1:40871", "--quiet"])
+    relay = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "twampy",
+            "impair",
+            "127.0.0.1:40872",
+            "127.0.0.1:40871",
+            "--delay",
+            "20",
+            "--duration",
+            "5",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        time.sleep(1)
+        sender = subprocess.run(
+            [sys.executable, "-m", "twampy", "sender", "127.0.0.1:40872", "--count", "10", "--interval", "50"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+        out, _ = relay.communicate(timeout=30)
+    finally:
+        relay.kill()
+        responder.kill()
+        responder.wait()
+
+    assert sender.returncode == 0, sender.stderr
+    roundtrip = [line for line in sender.stdout.splitlines() if "Roundtrip:" in line][0]
+    assert roundtrip.split()[1].endswith("ms") and float(roundtrip.split()[1][:-2]) >= 40
+    assert roundtrip.split()[-1] == "0.0%"
+    assert "Forward:" in out and "Reverse:" in out
@@ -2,6 +2,8 @@
 Integration test for twampy - tests sender/responder interaction
 """
 
+import contextlib
+import json
 import re
 import signal
 import subprocess
@@ -9,18 +11,13 @@ import sys
 import time
 
 
-def test_sender_responder_integration():
+@contextlib.contextmanager
+def responder(address):
     """
-    Integration test: Start responder, send 100 packets, verify all received.
-
-    Test setup:
-    - Responder on 127.0.0.1:40862
-    - Sender sends 100 packets at 10ms intervals with DSCP 'ef' (Expedited Forwarding)
-    - Verify all 100 packets are reflected back
+    Responder subprocess on address for the duration of the block, stopped gracefully afterwards
     """
-    # Start responder on port 40862
-    responder = subprocess.Popen(
-        [sys.executable, "-m", "twampy", "responder", "127.0.0.1:40862"],
+    process = subprocess.Popen(
+        [sys.executable, "-m", "twampy", "responder", address],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=True,
@@ -30,11 +27,37 @@ def test_sender_responder_integration():
     time.sleep(2)
 
     # Check if responder started successfully
-    if responder.poll() is not None:
-        stdout, stderr = responder.communicate()
+    if process.poll() is not None:
+        stdout, stderr = process.communicate()
         raise AssertionError(f"Responder failed to start:\nSTDOUT: {stdout}\nSTDERR: {stderr}")
 
     try:
+        yield process
+    finally:
+        # Stop responder gracefully
+        if sys.platform == "win32":
+            # Windows doesn't support SIGINT for subprocesses, use terminate instead
+            process.terminate()
+        else:
+            process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            # Force kill if graceful shutdown fails
+            process.kill()
+            process.wait()
+
+
+def test_sender_responder_integration():
+    """
+    Integration test: Start responder, send 100 packets, verify all received.
+
+    Test setup:
+    - Responder on 127.0.0.1:40862
+    - Sender sends 100 packets at 10ms intervals with DSCP 'ef' (Expedited Forwarding)
+    - Verify all 100 packets are reflected back
+    """
+    with responder("127.0.0.1:40862"):
         # Run sender: 100 packets, 10ms interval, DSCP EF
         sender = subprocess.run(
             [
@@ -72,20 +95,6 @@ def test_sender_responder_integration():
         else:
             raise AssertionError(f"Could not find Roundtrip statistics in output:\n{output}")
 
-    finally:
-        # Stop responder gracefully
-        if sys.platform == "win32":
-            # Windows doesn't support SIGINT for subprocesses, use terminate instead
-            responder.terminate()
-        else:
-            responder.send_signal(signal.SIGINT)
-        try:
-            responder.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            # Force kill if graceful shutdown fails
-            responder.kill()
-            responder.wait()
-
 
 def test_sender_do_not_fragment_starts():
     """
@@ -94,17 +103,7 @@ def test_sender_do_not_fragment_starts():
     Starts responder, runs sender with --do-not-fragment and minimal count; verifies sender
     exits successfully. This runs on all OSes in CI (Windows would have failed before the fix).
     """
-    responder = subprocess.Popen(
-        [sys.executable, "-m", "twampy", "responder", "127.0.0.1:40863"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    time.sleep(2)
-    if responder.poll() is not None:
-        stdout, stderr = responder.communicate()
-        raise AssertionError(f"Responder failed to start:\nSTDOUT: {stdout}\nSTDERR: {stderr}")
-    try:
+    with responder("127.0.0.1:40863"):
         sender = subprocess.run(
             [
                 sys.executable,
@@ -129,13 +128,105 @@ def test_sender_do_not_fragment_starts():
             f"Sender with --do-not-fragment failed (e.g. WinError 10022 on Windows):\n"
             f"STDOUT: {sender.stdout}\nSTDERR: {sender.stderr}"
         )
-    finally:
-        if sys.platform == "win32":
-            responder.terminate()
-        else:
-            responder.send_signal(signal.SIGINT)
-        try:
-            responder.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            responder.kill()
-            responder.wait()
+
+
+def test_loadgen_against_loopback_reflector(tmp_path):
+    """
+    Load generator starts its own loopback reflector, drives a few clients and reports results.
+    """
+    output = tmp_path / "loadgen.json"
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "twampy",
+            "loadgen",
+            "--clients",
+            "20",
+            "--pps",
+            "200",
+            "--duration",
+            "2",
+            "--processes",
+            "1",
+            "--output",
+            str(output),
+        ],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, f"Loadgen failed:\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}"
+    assert "Saturation" in result.stdout
+    data = json.loads(output.read_text())
+    assert sum(data["sent"]) > 0
+    assert sum(data["received"]) > 0
+
+
+def test_sender_profile_and_timers(tmp_path):
+    """
+    Sender with --profile writes a pstats file and --timers prints per-stage histograms.
+    """
+    profile = tmp_path / "sender.pstats"
+    with responder("127.0.0.1:40865"):
+        sender = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "twampy",
+                "sender",
+                "127.0.0.1:40865",
+                ":40866",
+                "--count",
+                "20",
+                "--interval",
+                "10",
+                "--timers",
+                "--profile",
+                str(profile),
+            ],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    assert sender.returncode == 0, f"Sender failed:\nSTDOUT: {sender.stdout}\nSTDERR: {sender.stderr}"
+    assert "Per-stage hot-path timers" in sender.stdout
+    assert re.search(r"^\s+send\s+20\s", sender.stdout, re.MULTILINE)
+    assert profile.stat().st_size > 0
+
+
+def test_sender_streams_ndjson_to_pipe(tmp_path):
+    """
+    Per-packet NDJSON goes to stdout (a pipe here), the table to stderr, summary to CSV.
+    """
+    summary = tmp_path / "summary.csv"
+    with responder("127.0.0.1:40867"):
+        sender = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "twampy",
+                "sender",
+                "127.0.0.1:40867",
+                ":40868",
+                "--count",
+                "10",
+                "--interval",
+                "10",
+                "--packets",
+                "ndjson:-",
+                "--summary",
+                f"csv:{summary}",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    assert sender.returncode == 0, f"Sender failed:\nSTDOUT: {sender.stdout}\nSTDERR: {sender.stderr}"
+    records = [json.loads(line) for line in sender.stdout.splitlines()]
+    assert sorted(r["sseq"] for r in records) == list(range(10))
+    assert all(r["rtt"] >= 0 for r in records)
+    assert "Roundtrip:" in sender.stderr
+    lines = summary.read_text().splitlines()
+    assert lines[0].startswith("started,ended,far_end,")
+    assert len(lines) == 2
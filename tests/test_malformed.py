@@ -0,0 +1,188 @@
+"""Tests for malformed packet handling in reflector and sender."""
+
+import errno
+import random
+import socket
+import threading
+
+import pytest
+
+import twampy
+from twampy.session import SendTimes, UdpSession, check_request, decode_request, encode_reply, now
+
+
+def test_check_request_and_transient_errors():
+    """Requests need seq, T1 and error estimate and a source port; only per-datagram errors are transient"""
+    assert check_request(b"\0" * 13, ("192.0.2.1", 862)) == "short"
+    assert check_request(b"", ("192.0.2.1", 862)) == "short"
+    assert check_request(b"\0" * 14, ("192.0.2.1", 0)) == "port"
+    assert check_request(b"\0" * 14, ("192.0.2.1", 862)) is None
+
+    session = UdpSession("127.0.0.1", 0)
+    try:
+        assert session.transient(OSError(errno.ENOBUFS, "No buffer space available"))
+        assert session.transient(ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused"))
+        assert not session.transient(OSError(errno.EBADF, "Bad file descriptor"))
+        assert session.errors == {"ENOBUFS": 1, "ECONNREFUSED": 1}
+    finally:
+        session.socket.close()
+
+
+def test_reflector_keeps_serving_during_fuzzing():
+    """Garbage of every length next to a 1000 pps session: no loss, short requests counted"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    port = reflector.local_address[1]
+    stopped = threading.Event()
+    sent = []
+
+    def fuzz():
+        rng = random.Random(1)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)  # reflected garbage is discarded
+            while not stopped.is_set() and len(sent) < 3000:
+                data = rng.randbytes(rng.choice([0, 1, 5, 12, 13, 14, 36, rng.randrange(1500)]))
+                sent.append(len(data))
+                sock.sendto(data, ("127.0.0.1", port))
+                stopped.wait(0.0002)
+
+    fuzzer = threading.Thread(target=fuzz)
+    fuzzer.start()
+    try:
+        result = twampy.run_sender(twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=500, interval=1))
+    finally:
+        stopped.set()
+        fuzzer.join()
+        alive = reflector.is_alive()
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert alive
+    assert result.received == result.sent == 500
+    assert result.roundtrip.loss == 0.0
+    short = sum(1 for length in sent if length < 14)
+    assert 0 < reflector.malformed["short"] <= short
+    assert reflector.malformed["short"] + reflector.drops >= short
+    assert set(reflector.malformed) == {"short"}
+
+
+@pytest.fixture
+def noisy_reflector():
+    """Reflector that answers every request with a truncated packet, a stray reply and the real reply"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.2)
+    stopped = threading.Event()
+
+    def reflect():
+        rseq = 0
+        while not stopped.is_set():
+            try:
+                data, address = sock.recvfrom(9216)
+            except TimeoutError:
+                continue
+            sseq, _ = decode_request(data)
+            sock.sendto(b"\xff" * 20, address)
+            sock.sendto(encode_reply(0, now(), (sseq + 1000).to_bytes(4, "big") + data[4:]), address)
+            sock.sendto(encode_reply(rseq, now(), data), address)
+            rseq += 1
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stopped.set()
+    thread.join()
+    sock.close()
+
+
+def test_sender_drops_malformed_replies(noisy_reflector):
+    """Short replies and replies to requests never sent are counted, not taken into the statistics"""
+    result = twampy.run_sender(twampy.SenderConfig(far_end=f"127.0.0.1:{noisy_reflector}", count=20, interval=5))
+    assert result.received == 20
+    assert result.roundtrip.loss == 0.0 and result.outbound.loss == 0.0
+    assert result.malformed == {"short": 20, "sseq": 20}
+    assert result.socket_errors == {}
+
+
+def test_send_times_keep_the_last_requests():
+    """Slots are reused after 'capacity' requests; older ones are gone, not mixed up"""
+    times = SendTimes(4)
+    for sseq in range(6):
+        times.put(sseq, 100.0 + sseq)
+    assert [times.get(sseq) for sseq in range(7)] == [None, None, 102.0, 103.0, 104.0, 105.0, None]
+
+
+@pytest.fixture
+def corrupting_reflector():
+    """Reflector that echoes a wrong T1 (one second early) for every even sseq"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.2)
+    stopped = threading.Event()
+
+    def reflect():
+        rseq = 0
+        while not stopped.is_set():
+            try:
+                data, address = sock.recvfrom(9216)
+            except TimeoutError:
+                continue
+            sseq, _ = decode_request(data)
+            if sseq % 2 == 0:
+                data = data[:4] + (int.from_bytes(data[4:8], "big") - 1).to_bytes(4, "big") + data[8:]
+            sock.sendto(encode_reply(rseq, now(), data), address)
+            rseq += 1
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stopped.set()
+    thread.join()
+    sock.close()
+
+
+def test_sender_uses_local_transmit_times(corrupting_reflector):
+    """A corrupted echo is flagged, delays still come from the local transmit time"""
+    result = twampy.run_sender(twampy.SenderConfig(far_end=f"127.0.0.1:{corrupting_reflector}", count=20, interval=5))
+    assert result.received == 20
+    assert result.echo_mismatch == 10
+    assert result.expired == 0
+    assert result.roundtrip.max < 100  # not one second
+    assert result.outbound.max < 100
+
+
+@pytest.fixture
+def truncating_reflector():
+    """Reflector whose replies end after sseq and part of the echoed T1 (28 to 35 bytes)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.2)
+    stopped = threading.Event()
+
+    def reflect():
+        rseq = 0
+        while not stopped.is_set():
+            try:
+                data, address = sock.recvfrom(9216)
+            except TimeoutError:
+                continue
+            sseq, _ = decode_request(data)
+            sock.sendto(encode_reply(rseq, now(), data)[: 28 + sseq % 8], address)
+            rseq += 1
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stopped.set()
+    thread.join()
+    sock.close()
+
+
+def test_sender_accepts_truncated_replies(truncating_reflector):
+    """A reply with sseq, T2 and T3 is enough: T1 comes from the local transmit time"""
+    config = twampy.SenderConfig(far_end=f"127.0.0.1:{truncating_reflector}", count=16, interval=5, padding=64)
+    result = twampy.run_sender(config)
+    assert result.received == 16
+    assert result.truncated == 16
+    assert result.malformed == {} and result.echo_mismatch == 0
+    assert result.roundtrip.loss == 0.0
+    assert 0 < result.roundtrip.max < 100
@@ -0,0 +1,112 @@
+"""Tests for the full-mesh agent."""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+
+import pytest
+
+from twampy.__main__ import MESH_MAGIC, MeshAgent, load_peers, row_reports
+from twampy.session import SenderIndex
+
+
+def mesh_args(**kwargs):
+    defaults = {"interval": 50, "report": 1.0, "listen": None, "padding": 0, "seed": 1, "tos": 0, "ttl": 64}
+    return argparse.Namespace(**dict(defaults, **kwargs))
+
+
+def test_load_peers(tmp_path):
+    """Names with addresses, bare addresses, comments; duplicates are rejected"""
+    path = tmp_path / "peers"
+    path.write_text("# lab\nnyc 192.0.2.1\nlon [2001:db8::1]:862  # v6\n\n198.51.100.7:20002\n")
+    assert load_peers(path) == {
+        "nyc": ("192.0.2.1", 20001, 4),
+        "lon": ("2001:db8::1", 862, 6),
+        "198.51.100.7:20002": ("198.51.100.7", 20002, 4),
+    }
+    path.write_text("a 192.0.2.1\na 192.0.2.2\n")
+    with pytest.raises(ValueError, match="twice"):
+        load_peers(path)
+
+
+def test_row_reports_fit_one_datagram_each():
+    """A row of a large mesh is split into reports of at most 1200 bytes that merge back into the row"""
+    row = {f"node-{i:04d}.example.net": [100, 99, 1.234, 2.345, 30.456] for i in range(500)}
+    row["lost"] = [100, 0, None, None, None]
+    reports = row_reports("a", 7, row)
+    assert len(reports) > 1
+    assert all(len(report) <= 1200 for report in reports)
+    merged = {}
+    for report in reports:
+        data = json.loads(report[len(MESH_MAGIC) :])
+        assert (data["from"], data["interval"]) == ("a", 7)
+        merged.update(data["row"])
+    assert merged == row
+    assert len(row_reports("a", 7, {})) == 1
+
+
+def test_reflector_index_restarts_after_idle():
+    """rseq per source counts on, restarts for sseq 0 and after 30s without requests (responder semantics)"""
+    index = SenderIndex()
+    source = ("192.0.2.1", 20000)
+    assert [index.next(source, sseq, t) for sseq, t in ((5, 0.0), (6, 1.0), (7, 20.0))] == [0, 1, 2]
+    assert index.next(source, 8, 50.5) == 0  # idle for 30.5s
+    assert index.next(source, 9, 51.0) == 1
+    assert index.next(source, 0, 52.0) == 0
+    assert index.next(("192.0.2.2", 20000), 3, 52.0) == 0
+
+
+def test_three_agents_build_the_full_matrix():
+    """Every node measures its row and receives the rows of the others"""
+    peers = {name: ("127.0.0.1", port, 4) for name, port in (("a", 40901), ("b", 40902), ("c", 40903))}
+    matrices = {name: [] for name in peers}
+    agents = [
+        MeshAgent(peers, name, mesh_args(), lambda start, rows, name=name: matrices[name].append(rows))
+        for name in peers
+    ]
+
+    async def run():
+        for agent in agents:
+            await agent.start()
+        await asyncio.sleep(3.6)
+        for agent in agents:
+            agent.close()
+
+    asyncio.run(run())
+
+    for name in peers:
+        # the first interval is partial, the second one is complete on every node
+        rows = matrices[name][1]
+        assert sorted(rows) == ["a", "b", "c"]
+        for node, row in rows.items():
+            assert sorted(row) == sorted(set(peers) - {node})
+            for sent, received, low, avg, high in row.values():
+                assert 15 <= sent <= 25
+                assert received == sent
+                assert 0 <= low <= avg <= high
+
+
+def test_mesh_cli_reports_ndjson(tmp_path):
+    """Two agent processes, one record per direction and interval"""
+    path = tmp_path / "peers"
+    path.write_text("a 127.0.0.1:40904\nb 127.0.0.1:40905\n")
+    command = [sys.executable, "-m", "twampy", "mesh", str(path), "-i", "20", "--report", "1"]
+    other = subprocess.Popen(command + ["--name", "b", "--duration", "5"], stdout=subprocess.DEVNULL)
+    try:
+        out = subprocess.run(
+            command + ["--name", "a", "--duration", "3.5", "--format", "ndjson"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    finally:
+        other.wait(timeout=30)
+
+    assert out.returncode == 0, out.stderr
+    records = [json.loads(line) for line in out.stdout.splitlines()]
+    assert {(record["from"], record["to"]) for record in records} == {("a", "b"), ("b", "a")}
+    complete = [record for record in records if record["time"] == records[-1]["time"]]
+    assert len(complete) == 2
+    assert all(record["sent"] >= 40 and record["loss"] == 0.0 for record in complete)
@@ -0,0 +1,124 @@
+"""
+Tests for offline pcap/pcapng analysis
+"""
+
+import io
+import socket
+import struct
+import subprocess
+import sys
+
+from twampy.__main__ import PcapReader, decode_frame
+from twampy.session import encode_reply, encode_request
+
+
+def udp_frame(src, sport, dst, dport, payload, vlan=None):
+    """Ethernet frame with an IPv4 or IPv6 UDP datagram"""
+    udp = struct.pack("!4H", sport, dport, 8 + len(payload), 0) + payload
+    if ":" in src:
+        ip = struct.pack("!IHBB", 6 << 28, len(udp), 17, 64)
+        ip += socket.inet_pton(socket.AF_INET6, src) + socket.inet_pton(socket.AF_INET6, dst)
+        ethertype = 0x86DD
+    else:
+        ip = struct.pack("!BBHHHBBH", 0x45, 0, 20 + len(udp), 0, 0x4000, 64, 17, 0)
+        ip += socket.inet_aton(src) + socket.inet_aton(dst)
+        ethertype = 0x0800
+    tag = struct.pack("!HH", 0x8100, vlan) if vlan is not None else b""
+    return b"\x00" * 12 + tag + struct.pack("!H", ethertype) + ip + udp
+
+
+def pcap(packets):
+    out = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+    for t, frame in packets:
+        out += struct.pack("<4I", int(t), round((t - int(t)) * 1e6), len(frame), len(frame)) + frame
+    return out
+
+
+def pcapng(packets):
+    def block(kind, body):
+        body += b"\x00" * (-len(body) % 4)
+        return struct.pack("<2I", kind, len(body) + 12) + body + struct.pack("<I", len(body) + 12)
+
+    out = block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    # interface with nanosecond resolution (if_tsresol=9)
+    out += block(1, struct.pack("<HHI", 1, 0, 65535) + struct.pack("<HHB3x", 9, 1, 9) + struct.pack("<HH", 0, 0))
+    for t, frame in packets:
+        ts = round(t * 1e9)
+        out += block(6, struct.pack("<5I", 0, ts >> 32, ts & 0xFFFFFFFF, len(frame), len(frame)) + frame)
+    return out
+
+
+def session(count, lost=(), src="10.0.0.1", dst="10.0.0.2", vlan=None, sport=20000, dport=20001):
+    """Requests every 10ms, reflected after 1ms (outbound) + 0.5ms processing + 1ms (inbound)"""
+    packets = []
+    for seq in range(count):
+        t1 = 1700000000.0 + seq * 0.01
+        request = encode_request(seq, t1)
+        packets.append((t1, udp_frame(src, sport, dst, dport, request, vlan)))
+        if seq in lost:
+            continue
+        reply = encode_reply(seq, t1 + 0.001, request)
+        # the reflector sets T3 = T2 in encode_reply; its processing time is on the wire time only
+        packets.append((t1 + 0.002, udp_frame(dst, dport, src, sport, reply, vlan)))
+    return packets
+
+
+def run_pcap(path, *options):
+    return subprocess.run(
+        [sys.executable, "-m", "twampy", "pcap", str(path), *options], capture_output=True, text=True, timeout=30
+    )
+
+
+def test_reader_and_decoder_pcapng_ipv6_vlan():
+    """pcapng with nanosecond timestamps, 802.1Q tag and IPv6 decodes to the UDP payload"""
+    packets = session(3, src="2001:db8::1", dst="2001:db8::2", vlan=100)
+    records = list(PcapReader(io.BytesIO(pcapng(packets))))
+    assert len(records) == 6
+    t, linktype, frame = records[1]
+    assert abs(t - 1700000000.002) < 1e-6
+    src, sport, dst, dport, payload = decode_frame(linktype, frame)
+    assert (src, sport, dst, dport) == ("2001:db8::2", 20001, "2001:db8::1", 20000)
+    assert len(payload) == 38  # reflected packet with the 14 byte request header
+
+
+def test_pcap_session_statistics(tmp_path):
+    """Requests and reflections pair up, delays use capture timestamps, missing reflections are loss"""
+    path = tmp_path / "twamp.pcap"
+    path.write_bytes(pcap(session(100, lost={10, 20})))
+    result = run_pcap(path)
+    assert result.returncode == 0, result.stderr
+    assert "Session 10.0.0.1:20000 -> 10.0.0.2:20001 (100 requests, 98 reflections, 98 matched)" in result.stdout
+    roundtrip = [line for line in result.stdout.splitlines() if "Roundtrip:" in line][0].split()
+    assert roundtrip[1] == "2.00ms"
+    assert roundtrip[-1] == "2.0%"
+
+
+def test_pcap_symmetric_reflector_ports(tmp_path):
+    """With the reflector port on both ends, the direction of the first packet tells requests from replies"""
+    path = tmp_path / "twamp.pcap"
+    path.write_bytes(pcap(session(50, lost={5}, sport=862, dport=862)))
+    result = run_pcap(path)
+    assert result.returncode == 0, result.stderr
+    assert "Session 10.0.0.1:862 -> 10.0.0.2:862 (50 requests, 49 reflections, 49 matched)" in result.stdout
+    roundtrip = [line for line in result.stdout.splitlines() if "Roundtrip:" in line][0].split()
+    assert roundtrip[1] == "2.00ms"
+    assert roundtrip[-1] == "2.0%"
+
+
+def test_pcapng_summary_sink(tmp_path):
+    """Final summary per session goes to the --summary sink"""
+    path = tmp_path / "twamp.pcapng"
+    path.write_bytes(pcapng(session(20) + session(10, src="10.0.0.3")))
+    result = run_pcap(path, "--summary", "csv:-")
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0].startswith("started,ended,far_end,near_end,interval,count,sent,received,")
+    assert [line.split(",")[3] for line in lines[1:]] == ["10.0.0.1:20000", "10.0.0.3:20000"]
+
+
+def test_pcap_rejects_other_files(tmp_path):
+    path = tmp_path / "junk.pcap"
+    path.write_bytes(b"not a capture file")
+    result = run_pcap(path)
+    assert result.returncode != 0
+    assert "not a pcap or pcapng file" in result.stdout + result.stderr
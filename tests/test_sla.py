@@ -0,0 +1,143 @@
+"""Tests for streaming SLA evaluation and change detection."""
+
+import json
+import random
+import subprocess
+import sys
+import time
+
+import pytest
+
+import twampy
+from twampy.session import ResultWriter, SlaMonitor, SlaRule, open_sink
+
+
+def feed(monitor, delays, start=0):
+    """Send and reply one packet per delay (None: lost), 10ms apart; returns the events"""
+    events = []
+    for sseq, delay in enumerate(delays, start):
+        t1 = sseq * 0.01
+        events += monitor.sent(sseq, t1)
+        if delay is not None:
+            events += monitor.reply(t1 + delay / 1000, delay, delay / 2, delay / 2, sseq)
+    return events
+
+
+def test_sla_rules_parse():
+    """Thresholds with optional clear levels, the default clear level is 90% of the threshold"""
+    rtt, jitter, loss = SlaRule.parse("rtt>20, jitter>5:3,loss>1")
+    assert (rtt.metric, rtt.threshold, rtt.clear) == ("rtt", 20.0, 18.0)
+    assert (jitter.metric, jitter.threshold, jitter.clear) == ("jitter", 5.0, 3.0)
+    assert (loss.metric, loss.threshold) == ("loss", 1.0)
+    for spec in ("rtt<20", "delay>5", "rtt>x", "rtt>5:8"):
+        with pytest.raises(ValueError):
+            SlaRule.parse(spec)
+
+
+def test_sla_breach_and_clear_with_hysteresis():
+    """One breach per excursion: values between the clear level and the threshold change nothing"""
+    breaches = []
+    monitor = SlaMonitor(SlaRule.parse("rtt>20:10"), window=10, on_breach=lambda: breaches.append(1))
+    assert feed(monitor, [5] * 10) == []
+    events = feed(monitor, [40] * 10, 10)
+    assert [e["event"] for e in events] == ["breach"]
+    assert events[0]["sseq"] == 14  # window mean 5 + 5 * 35 / 10 = 22.5 > 20
+    assert events[0]["metric"] == "rtt" and events[0]["threshold"] == 20
+    assert feed(monitor, [15] * 10, 20) == []  # mean 15: below 20, not below 10
+    events = feed(monitor, [5] * 10, 30)
+    assert [(e["event"], e["sseq"]) for e in events] == [("clear", 35)]  # mean 15 - 6 = 9 < 10
+    assert monitor.breaches == 1 and len(breaches) == 1
+    assert monitor.metric("rtt") == pytest.approx(5)
+
+
+def test_sla_loss_after_timeout():
+    """A packet is lost once later requests are sent --sla-timeout after it, or at the end"""
+    monitor = SlaMonitor(SlaRule.parse("loss>5"), window=20, timeout=0.1)
+    delays = [1.0] * 30
+    delays[12] = delays[13] = None
+    events = feed(monitor, delays)
+    assert [(e["event"], e["metric"], e["sseq"], e["value"]) for e in events] == [("breach", "loss", 13, 10.0)]
+    assert monitor.metric("loss") == 10.0
+    assert feed(monitor, [1.0] * 10, 30) == []  # both losses still in the window
+    assert [e["event"] for e in feed(monitor, [1.0] * 10, 40)] == ["clear"]
+    assert monitor.finish(1.0) == [] and not monitor.pending
+
+
+def test_change_detection_finds_level_shift_not_spikes():
+    """CUSUM reports a sustained 2ms shift, not isolated 50ms spikes in noise"""
+    rng = random.Random(7)
+    monitor = SlaMonitor(detect=True)
+    noise = [10 + rng.gauss(0, 0.2) for _ in range(500)]
+    for sseq in range(50, 500, 50):
+        noise[sseq] = 60.0
+    assert feed(monitor, noise) == []
+
+    events = feed(monitor, [12 + rng.gauss(0, 0.2) for _ in range(100)], 500)
+    assert [e["event"] for e in events] == ["change up"]
+    assert 500 <= events[0]["sseq"] < 510
+    assert events[0]["threshold"] == pytest.approx(10, abs=0.2)  # the old baseline
+    events = feed(monitor, [8 + rng.gauss(0, 0.2) for _ in range(100)], 600)
+    assert [e["event"] for e in events] == ["change down"]
+
+
+def test_sender_stops_on_first_breach():
+    """--sla-exit ends the session at the first breach, events go to stdout, exit status 3"""
+    responder = subprocess.Popen([sys.executable, "-m", "twampy", "responder", "127.0.0.1:40941", "--quiet"])
+    try:
+        time.sleep(1)
+        started = time.time()
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "twampy",
+                "sender",
+                "127.0.0.1:40941",
+                ":0",
+                "--count",
+                "1000",
+                "--interval",
+                "10",
+                "--sla",
+                "rtt>0.001",
+                "--events",
+                "ndjson:-",
+                "--sla-exit",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    finally:
+        responder.kill()
+        responder.wait()
+
+    assert out.returncode == 3, out.stderr
+    (event,) = [json.loads(line) for line in out.stdout.splitlines()]
+    assert event["event"] == "breach" and event["metric"] == "rtt" and event["sseq"] == 9
+    assert "SLA breach: rtt" in out.stderr
+    assert time.time() - started < 8  # not the 10s of the full session
+
+
+def test_sla_is_evaluated_by_the_sender_not_the_writer(tmp_path):
+    """A writer queue too small for the packet records drops them, never SLA samples or events"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    monitor = SlaMonitor(SlaRule.parse("rtt>0.0001,loss>1"), window=10)
+    sinks = [open_sink("packets", f"ndjson:{tmp_path}/packets"), open_sink("events", f"ndjson:{tmp_path}/events")]
+    writer = ResultWriter(sinks, interval=0, maxsize=2, sla=monitor)
+    writer.start()
+    try:
+        port = reflector.local_address[1]
+        config = twampy.SenderConfig(far_end=f"127.0.0.1:{port}", count=200, interval=0.5, writer=writer)
+        result = twampy.run_sender(config)
+        writer.summary(result, ended=time.time())
+        writer.close()
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert result.received == 200
+    assert not monitor.pending and monitor.lost == 0  # every reply reached the monitor
+    events = [json.loads(line) for line in (tmp_path / "events").read_text().splitlines()]
+    assert [(e["event"], e["metric"]) for e in events] == [("breach", "rtt")]
+    assert monitor.breaches == 1
@@ -0,0 +1,75 @@
+"""
+Tests for the SQLite result store and the history sub-command
+"""
+
+import csv
+import io
+import sqlite3
+import subprocess
+import sys
+
+from twampy.session import ResultWriter, TwampStatistics, open_store
+
+
+def write_session(path, started, far_end, tos, intervals):
+    """Session record, intervals and summary through a ResultWriter, like the sender does"""
+    writer = ResultWriter(open_store(str(path)), interval=1.0)
+    writer.start()
+    writer.session(started=started, far_end=far_end, near_end="127.0.0.1:20000", tos=tos, interval=100, count=10)
+    stats = TwampStatistics()
+    t = started
+    for sseq in range(intervals * 10):
+        t = started + sseq * 0.1
+        writer.sent(sseq, t)
+        writer.reply(sseq, sseq, t, t, t, t + 0.002, 2.0, 1.0, 1.0, 64, far_end)
+        stats.add(2.0, 1.0, 1.0, sseq, sseq)
+    writer.summary(stats.result(intervals * 10), ended=t + 0.1)
+    writer.close()
+
+
+def test_store_keeps_sessions_and_intervals(tmp_path):
+    path = tmp_path / "results.db"
+    write_session(path, 1790000000.0, "10.0.0.1:20001", 0x88, 3)
+    write_session(path, 1790000100.0, "10.0.0.2:20001", 0, 2)
+
+    db = sqlite3.connect(path)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    sessions = db.execute("SELECT id, far_end, tos, sent, received FROM sessions ORDER BY id").fetchall()
+    assert [s[1:] for s in sessions] == [("10.0.0.1:20001", 0x88, 30, 30), ("10.0.0.2:20001", 0, 20, 20)]
+    counts = db.execute(
+        "SELECT session, COUNT(*), SUM(sent) FROM intervals GROUP BY session ORDER BY session"
+    ).fetchall()
+    assert counts == [(sessions[0][0], 3, 30), (sessions[1][0], 2, 20)]
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"sessions_far_end", "sessions_tos", "sessions_started"} <= indexes
+
+
+def test_history_filters_and_buckets(tmp_path):
+    path = tmp_path / "results.db"
+    for day in range(3):
+        write_session(path, 1790000000.0 + day * 86400, "10.0.0.1:20001", 0x88, 1)
+        write_session(path, 1790000000.0 + day * 86400, "10.0.0.2:20001", 0, 1)
+
+    def history(*options):
+        result = subprocess.run(
+            [sys.executable, "-m", "twampy", "history", str(path), "--format", "csv", *options],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+        assert result.returncode == 0, result.stdout + result.stderr
+        return list(csv.DictReader(io.StringIO(result.stdout)))
+
+    assert len(history()) == 6
+    assert {row["far_end"] for row in history("--target", "10.0.0.1")} == {"10.0.0.1:20001"}
+    assert len(history("--tos", "136")) == 3
+
+    buckets = history("--bucket", "day", "--target", "10.0.0.2:20001")
+    assert len(buckets) == 3
+    assert [int(row["sessions"]) for row in buckets] == [1, 1, 1]
+    assert float(buckets[0]["rt_avg"]) == 2.0
+
+    intervals = history("--intervals", "--bucket", "week")
+    assert len(intervals) == 1
+    assert intervals[0]["far_end"] == "*"
+    assert int(intervals[0]["sent"]) == 60
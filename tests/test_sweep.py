@@ -0,0 +1,149 @@
+"""Tests for the path MTU / padding sweep."""
+
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import twampy
+from twampy.__main__ import Sweep, SweepTarget
+from twampy.session import encode_reply, now
+
+
+@pytest.fixture
+def limited_reflector():
+    """Reflector that silently drops requests above 1200 bytes IP (1172 bytes UDP payload)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.2)
+    stopped = threading.Event()
+
+    def reflect():
+        while not stopped.is_set():
+            try:
+                data, address = sock.recvfrom(9216)
+            except TimeoutError:
+                continue
+            if len(data) + 28 <= 1200:
+                sock.sendto(encode_reply(0, now(), data), address)
+
+    thread = threading.Thread(target=reflect, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stopped.set()
+    thread.join()
+    sock.close()
+
+
+def sweep_args(**kwargs):
+    defaults = {"parallel": 4, "timeout": 0.2, "max_sessions": 0, "tos": 0, "ttl": 64, "interval": 2, "count": 2}
+    return argparse.Namespace(**dict(defaults, **kwargs))
+
+
+@pytest.mark.parametrize("parallel", [1, 4, 64])
+def test_sweep_finds_largest_passing_size(limited_reflector, parallel):
+    """Binary search and parallel rounds converge on the same size"""
+    target = SweepTarget(f"127.0.0.1:{limited_reflector}", 4, 0, 1500, 1)
+    asyncio.run(asyncio.wait_for(Sweep([target], sweep_args(parallel=parallel)).run(), 20))
+
+    assert target.largest == 1200
+    assert target.records[1200]["received"] == 2
+    assert target.records[1200]["padding"] == 1158
+    assert target.records[1201]["received"] == 0
+    assert not target.inconsistent
+    if parallel == 1:
+        assert len(target.records) <= 12
+
+
+def test_sweep_cli_reports_ndjson_per_size(limited_reflector):
+    """Several targets are swept at once; every record carries the result of its target"""
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "twampy",
+            "sweep",
+            f"127.0.0.1:{limited_reflector}",
+            "127.0.0.1:9",
+            "--min-size",
+            "1000",
+            "--max-size",
+            "1300",
+            "--step",
+            "50",
+            "--timeout",
+            "0.2",
+            "--format",
+            "ndjson",
+        ],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert out.returncode == 0, out.stderr
+    records = [json.loads(line) for line in out.stdout.splitlines()]
+    largest = {record["target"]: record["largest"] for record in records}
+    assert largest == {f"127.0.0.1:{limited_reflector}": 1200, "127.0.0.1:9": None}
+    assert {record["size"] for record in records} <= {1000, 1050, 1100, 1150, 1200, 1250, 1300}
+
+
+def test_sweep_reports_local_message_too_long():
+    """Sizes the local stack refuses (EMSGSIZE) fail at once with the error, not by timeout"""
+    reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="127.0.0.1:0"))
+    try:
+        target = SweepTarget(f"127.0.0.1:{reflector.local_address[1]}", 4, 65000, 66000, 100)
+        started = now()
+        asyncio.run(asyncio.wait_for(Sweep([target], sweep_args(timeout=5.0)).run(), 20))
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+
+    assert now() - started < 5  # no size waited out the timeout
+    assert target.largest is not None and target.largest <= 65535
+    too_long = [record for size, record in target.records.items() if size > 65535]
+    assert too_long
+    assert all(record["error"] == "Message too long" and record["sent"] == 0 for record in too_long)
+
+
+@pytest.mark.skipif(not socket.has_ipv6, reason="no IPv6")
+def test_sweep_cli_ipv6_target():
+    """IPv6 literals with port keep their brackets in the record and reach the reflector"""
+    try:
+        reflector = twampy.start_reflector(twampy.ReflectorConfig(near_end="[::1]:0"))
+    except OSError:
+        pytest.skip("no IPv6 loopback")
+    try:
+        port = reflector.local_address[1]
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "twampy",
+                "sweep",
+                f"[::1]:{port}",
+                "--min-size",
+                "100",
+                "--max-size",
+                "1000",
+                "--step",
+                "100",
+                "--format",
+                "ndjson",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    finally:
+        reflector.stop()
+        reflector.join(timeout=5)
+    assert out.returncode == 0, out.stderr
+    records = [json.loads(line) for line in out.stdout.splitlines()]
+    assert {record["target"] for record in records} == {f"[::1]:{port}"}
+    assert records[0]["largest"] == 1000
+    assert all(record["error"] is None for record in records)